@@ -1,8 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
-from routers import publish_validated, validate, status, events, licences, publish, unpublish, response_codes
+from routers import publish_validated, validate, status, events, licences, publish, unpublish, response_codes, metrics, uploads, \
+    user_requests
 from fastapi.middleware.cors import CORSMiddleware
+from util.dataset_names import get_dataset_names
+from util.events import get_events_feed
+from util.executor import get_validation_executor
+from util.http import get_http_clients
+from util.jobs import get_validation_jobs
+from util.registry import get_request_registry
+from util.status import get_status_cache, get_status_poller
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_http_clients().start()
+    get_events_feed().start(get_http_clients(), get_dataset_names())
+    get_status_poller().start(get_http_clients(), get_status_cache())
+    yield
+    get_events_feed().shutdown()
+    get_status_poller().shutdown()
+    get_validation_jobs().shutdown()
+    await get_http_clients().close()
+    get_validation_executor().shutdown()
+    get_request_registry().close()
+
 
 app = FastAPI(
+    lifespan=lifespan,
     docs_url="/",
     title='Publishing API for Darwin core archives',
     description='API for publishing darwin core archives to the Atlas',
@@ -28,13 +53,16 @@ app = FastAPI(
 )
 
 app.include_router(validate.router)
+app.include_router(uploads.router)
 app.include_router(publish.router)
 app.include_router(publish_validated.router)
 app.include_router(unpublish.router)
 app.include_router(status.router)
 app.include_router(events.router)
+app.include_router(user_requests.router)
 app.include_router(licences.router)
 app.include_router(response_codes.router)
+app.include_router(metrics.router)
 
 
 # Enable CORS
@@ -44,4 +72,5 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allow all methods (GET, POST, PUT, etc.)
     allow_headers=["*"],  # Allow all headers
+    expose_headers=["X-Next-Cursor"],  # Allow clients to page through /events
 )
@@ -0,0 +1,34 @@
+from fastapi import APIRouter, Depends
+
+from util.auth import TokenVerifier, get_token_verifier
+from util.collectory import data_resources, data_resource_names
+from util.executor import ValidationExecutor, get_validation_executor
+from util.status import StatusCache, get_status_cache
+from util.storage import TransferStats, get_transfer_stats
+
+router = APIRouter()
+
+
+@router.get("/metrics/executors", tags=["metrics"], description="Get the queue depth and worker utilisation of the validation and I/O worker pools",
+            summary="Worker pool metrics")
+async def executor_metrics(executor: ValidationExecutor = Depends(get_validation_executor)):
+    return executor.stats()
+
+
+@router.get("/metrics/transfers", tags=["metrics"], description="Get the number of S3 transfers and their throughput",
+            summary="S3 transfer metrics")
+async def transfer_metrics(stats: TransferStats = Depends(get_transfer_stats)):
+    return stats.to_dict()
+
+
+@router.get("/metrics/caches", tags=["metrics"], description="Get the size and hit counts of the registry, status and authenticated user caches",
+            summary="Cache metrics")
+async def cache_metrics(status_cache: StatusCache = Depends(get_status_cache),
+                        verifier: TokenVerifier = Depends(get_token_verifier)):
+    return {
+        "dataResources": data_resources.to_dict(),
+        "dataResourceNames": data_resource_names.to_dict(),
+        "finishedStatuses": status_cache.finished.to_dict(),
+        "runningStatuses": status_cache.running.to_dict(),
+        "users": verifier.users.to_dict()
+    }
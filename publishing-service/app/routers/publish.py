@@ -1,24 +1,29 @@
 import json
-import os
 import uuid
 import logging
-from pathlib import Path
 from typing import Union
 import boto3
 import botocore
 from botocore.exceptions import NoCredentialsError
-from dwc_validator.validate_dwca import validate_archive
-from dwca.darwincore.utils import qualname as qn
-from dwca.read import DwCAReader
-from fastapi import APIRouter, Depends, UploadFile, File
-from routers.licences import get_licence
+from fastapi import APIRouter, Depends, UploadFile, File, Form
+from util.licences import get_licence
 from util.airflow import start_ingest_dag
-from util.collectory import get_data_resource, update_conn_params, create_or_update_data_resource
+from util.collectory import get_data_resource, update_conn_params, create_or_update_data_resource, RegistryException
+from util.storage import upload_archive
 from util.config import get_app_config, AppConfig
-from util.auth import get_user, User, JWTBearer
-from util.eml import extract_metadata
+from util.auth import get_user, User, jwt_bearer
+from util.eml import has_required_metadata
 from util.error_codes import ErrorCode
+from util.executor import ValidationExecutor, get_validation_executor
+from util.precheck import precheck_archive
+from util.http import HttpClients, get_http_clients
+from util.registry import RequestRegistry, get_request_registry
 from util.responses import ErrorResponse, PublishResponse, ProcessRequest
+from util.upload import store_upload, remove_temp_file, UploadTooLargeException
+from util.upload_sessions import UploadSessions, get_upload_sessions, UploadNotFoundException, UploadIncompleteException
+from util.validation_cache import ValidationCache, get_validation_cache, validate_upload, validation_summary
+from util.chunked_validation import UnpartitionableArchiveException
+from util.zip_safety import UnsafeArchiveException, CorruptArchiveException
 
 router = APIRouter()
 
@@ -29,15 +34,21 @@ router = APIRouter()
     name="Validate and publish a dataset",
     description="Validate and publish a dataset using the supplied darwin core archive",
     summary="Validate and publish a dataset",
-    dependencies=[Depends(JWTBearer())],
+    dependencies=[Depends(jwt_bearer)],
     response_model=Union[PublishResponse, ErrorResponse]
 )
 async def process(
-        file: UploadFile = File(...),
+        file: UploadFile = File(None),
+        uploadID: str = Form(None),
         config: AppConfig = Depends(get_app_config),
+        executor: ValidationExecutor = Depends(get_validation_executor),
+        cache: ValidationCache = Depends(get_validation_cache),
+        sessions: UploadSessions = Depends(get_upload_sessions),
+        http: HttpClients = Depends(get_http_clients),
+        registry: RequestRegistry = Depends(get_request_registry),
         user: User = Depends(get_user)
     ) -> Union[PublishResponse, ErrorResponse]:
-    return await reprocess(file, None,  user, config)
+    return await reprocess(file, uploadID, None,  user, config, executor, cache, sessions, http, registry)
 
 @router.post(
     "/publish/{dataResourceUid}",
@@ -45,21 +56,33 @@ async def process(
     description="Validate and republish a dataset using the supplied darwin core archive",
     summary="Validate and republish a dataset",
     tags=["publish"],
-    dependencies=[Depends(JWTBearer())],
+    dependencies=[Depends(jwt_bearer)],
     response_model=Union[PublishResponse, ErrorResponse]
 )
 async def reprocess(
-        file: UploadFile = File(...),
+        file: UploadFile = File(None),
+        uploadID: str = Form(None),
         dataResourceUid: str = None,
         user: User = Depends(get_user),
-        config: AppConfig = Depends(get_app_config)) -> Union[PublishResponse, ErrorResponse]:
+        config: AppConfig = Depends(get_app_config),
+        executor: ValidationExecutor = Depends(get_validation_executor),
+        cache: ValidationCache = Depends(get_validation_cache),
+        sessions: UploadSessions = Depends(get_upload_sessions),
+        http: HttpClients = Depends(get_http_clients),
+        registry: RequestRegistry = Depends(get_request_registry)) -> Union[PublishResponse, ErrorResponse]:
     """
     Validate and publish a dataset using the supplied darwin core archive
     :param user:
     :param file:
+    :param uploadID: a completed resumable upload to publish, in place of the file
     :param request:
     :param dataResourceUid:
     :param config:
+    :param executor:
+    :param cache:
+    :param sessions:
+    :param http:
+    :param registry:
     :return:
     """
     if user.is_publisher is False and user.is_admin is False:
@@ -68,68 +91,75 @@ async def reprocess(
     # generate request ID for status calls
     request_id = str(uuid.uuid4())
 
-    # read the uploaded file
-    file2store = await file.read()
-
     # Check if the post request has the file part
-    if not file2store:
+    if file is None and uploadID is None:
         logging.info("Validation request missing file")
         return ErrorResponse(error=ErrorCode.MISSING_DATA_FILE, message='HTTP POST missing Missing file')
 
-    # Save the file temporarily
+    # Save the file temporarily, streaming it to disk
     temp_file_path = f'/tmp/temp-{request_id}.zip'
     try:
-        with open(temp_file_path, 'wb') as f:
-            f.write(file2store)
+        if uploadID:
+            upload = await executor.run_io(sessions.claim, uploadID, user.id, temp_file_path)
+        else:
+            upload = await store_upload(file, temp_file_path, config)
+    except UploadNotFoundException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_NOT_FOUND, message=e.args[0])
+    except UploadIncompleteException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_INCOMPLETE, message=e.args[0])
+    except UploadTooLargeException as e:
+        logging.info(f"Publish request file too large {e}")
+        return ErrorResponse(error=ErrorCode.FILE_TOO_LARGE, message=e.args[0])
     except Exception as e:
         logging.error(f"Error with reading archive {e}", exc_info=True)
         return ErrorResponse(error=ErrorCode.FILE_UPLOAD_ERROR, message=f'Problem with the submitted file upload')
-    finally:
-        file.file.close()
 
-    metadata = {}
+    # Check if the post request has the file part
+    if upload.size == 0:
+        logging.info("Validation request missing file")
+        remove_temp_file(temp_file_path)
+        return ErrorResponse(error=ErrorCode.MISSING_DATA_FILE, message='HTTP POST missing Missing file')
+
+    # reject archives that can't be published from their metadata, before reading any data
+    rejection = await executor.run_io(precheck_archive, temp_file_path, config)
+    if rejection is not None:
+        remove_temp_file(temp_file_path)
+        return rejection
+
     try:
         # validate the dataset
-        with DwCAReader(temp_file_path) as dwca:
-
-            # check the core type is supported
-            core_type = dwca.descriptor.core.type
-            logging.info("Core type: %s", core_type)
-            supported_core_types = {qn('Occurrence'), qn('Event')}
-
-            if core_type not in supported_core_types:
-                return ErrorResponse(error=ErrorCode.UNSUPPORTED_CORE_TYPE, message=f'The core type {core_type} is not supported')
-
-            # check metadata
-            if dwca.metadata:
-                metadata = extract_metadata(dwca.metadata)
-
-            # Check for mandatory fields
-            if 'name' not in metadata or metadata['name'] is None or 'licenceUrl' not in metadata or metadata['licenceUrl'] is None or 'pubDescription' not in metadata or metadata['pubDescription'] is None:
-                logging.info("Request missing mandatory fields")
-                return ErrorResponse(error=ErrorCode.MISSING_REQUIRED_FIELD,
-                                     message="Missing required fields. name, licenceUrl and description must be present in EML to pass validation")
-
-            # validate the licence
-            licence = get_licence(metadata['licenceUrl'])
-            if licence is None:
-                return ErrorResponse(error=ErrorCode.UNRECOGNISED_LICENCE, message=f"Unrecognised licence {metadata['licenceUrl']}. Check /licences for a list of recognised licences")
-
-            validate_report = validate_archive(dwca)
-            if not validate_report.valid:
-                os.remove(temp_file_path)
-                logging.info("Darwin core archive failed validation.")
-                return ErrorResponse(
-                    valid=False,
-                    error=ErrorCode.INVALID_ARCHIVE,
-                    message='The supplied Darwin Core Archive failed validation',
-                )
+        result = await validate_upload(upload, config, executor, cache, preview_map=False, require_metadata=True)
+        logging.info("Core type: %s", result.core_type)
+
+        # check the core type is supported
+        if not result.supported_core_type:
+            return ErrorResponse(error=ErrorCode.UNSUPPORTED_CORE_TYPE, message=f'The core type {result.core_type} is not supported')
+
+        # Check for mandatory fields
+        metadata = result.metadata
+        if not has_required_metadata(metadata):
+            logging.info("Request missing mandatory fields")
+            return ErrorResponse(error=ErrorCode.MISSING_REQUIRED_FIELD,
+                                 message="Missing required fields. name, licenceUrl and description must be present in EML to pass validation")
+
+        # validate the licence
+        licence = get_licence(metadata['licenceUrl'])
+        if licence is None:
+            return ErrorResponse(error=ErrorCode.UNRECOGNISED_LICENCE, message=f"Unrecognised licence {metadata['licenceUrl']}. Check /licences for a list of recognised licences")
+
+        if not result.valid:
+            logging.info("Darwin core archive failed validation.")
+            return ErrorResponse(
+                valid=False,
+                error=ErrorCode.INVALID_ARCHIVE,
+                message='The supplied Darwin Core Archive failed validation',
+            )
 
         # check user is authorised to edit this datasets
         if dataResourceUid:
 
             # user needs to be creator or have ROLE_ADMIN privilege
-            data_resource = get_data_resource(dataResourceUid, config)
+            data_resource = await get_data_resource(dataResourceUid, config, http)
             if data_resource is None:
                 return ErrorResponse(error=ErrorCode.DATA_RESOURCE_NOT_FOUND, message='The data resource UID is not recognised')
 
@@ -141,8 +171,8 @@ async def reprocess(
         # validate dwca archive
         data_resource = {
             "name":  metadata['name'],
-            "licenseType": licence.value['acronym'],
-            "licenseVersion": licence.value['version'],
+            "licenseType": licence.acronym,
+            "licenseVersion": licence.version,
             "pubDescription": metadata['pubDescription'],
             "citation": metadata['citation'],
             "rights": metadata['rights'],
@@ -157,36 +187,45 @@ async def reprocess(
         }
 
         # register in the collectory
-        data_resource_uid = create_or_update_data_resource(dataResourceUid, data_resource, user, config)
+        data_resource_uid = await create_or_update_data_resource(dataResourceUid, data_resource, user, config, http)
 
         if data_resource_uid:
             # upload to s3
             logging.info("Uploading to S3 bucket...")
-            s3 = boto3.client('s3')
-            s3.upload_file(temp_file_path, config.s3_bucket_name,
-                           f"dwca-imports/{data_resource_uid}/{data_resource_uid}.zip")
-            os.remove(temp_file_path)  # Remove the temporary file
+            await executor.run_io(upload_archive, config, temp_file_path,
+                                  f"dwca-imports/{data_resource_uid}/{data_resource_uid}.zip")
             logging.info(
                 f'File uploaded successfully to S3! Details: Name={data_resource["name"]}')
         else:
             return ErrorResponse(error=ErrorCode.REGISTRY_ERROR, message='Problem updating dataset in the registry')
 
         # Update the connection parameters to include references to S3
-        update_conn_params(data_resource_uid, config)
-        return start_ingest_dag(metadata['name'], data_resource_uid, request_id, user, config)
-
+        await update_conn_params(data_resource_uid, config, http)
+        return await start_ingest_dag(metadata['name'], data_resource_uid, request_id, user, config, http, registry, executor,
+                                      validation_summary(upload, result))
+
+    except RegistryException as e:
+        logging.error(f"Registry error {e}")
+        return ErrorResponse(error=ErrorCode.REGISTRY_ERROR, message=e.args[0])
+    except UnpartitionableArchiveException as e:
+        logging.error(f"Unable to validate large archive {e}")
+        return ErrorResponse(error=ErrorCode.VALIDATION_ERROR,
+                             message=f'The archive is too large to validate in one pass, and its partitions could not be validated: {e.args[0]}')
+    except UnsafeArchiveException as e:
+        logging.info(f"Rejected unsafe archive {e}")
+        return ErrorResponse(error=ErrorCode.UNSAFE_ARCHIVE, message=e.args[0])
+    except CorruptArchiveException as e:
+        logging.info(f"Rejected corrupt archive {e}")
+        return ErrorResponse(error=ErrorCode.CORRUPT_ARCHIVE, message=e.args[0])
     except botocore.exceptions.ClientError as ce:
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)  # Remove the temporary file in case of upload failure
         logging.error("AWS credentials not available or expired", ce, exc_info=True)
         return ErrorResponse(error=ErrorCode.AWS_CRED_EXPIRED, message='AWS credentials not available or expired')
     except NoCredentialsError as ne:
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)  # Remove the temporary file in case of upload failure
         logging.error("AWS credentials not available", ne, exc_info=True)
         return ErrorResponse(error=ErrorCode.AWS_NOT_AVAILABLE, message='AWS credentials not available')
     except Exception as e:
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)  # Remove the temporary file in case of upload failure
         logging.error("Exception", e, exc_info=True)
         return ErrorResponse(error=ErrorCode.SYSTEM_ERROR, message=f'Error: {str(e)}')
+    finally:
+        # the archive is only needed until it is validated and stored, whichever way the request ends
+        remove_temp_file(temp_file_path)
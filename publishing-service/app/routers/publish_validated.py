@@ -6,12 +6,16 @@ import botocore
 from botocore.exceptions import NoCredentialsError
 from dwca.read import DwCAReader
 from fastapi import APIRouter, Depends, Form
-from routers.licences import get_licence
+from util.licences import get_licence
 from util.airflow import start_ingest_dag
-from util.collectory import get_data_resource, update_conn_params, create_or_update_data_resource
+from util.collectory import get_data_resource, update_conn_params, create_or_update_data_resource, RegistryException
+from util.storage import copy_archive
 from util.config import get_app_config, AppConfig
-from util.auth import get_user, JWTBearer, User
+from util.auth import get_user, jwt_bearer, User
 from util.error_codes import ErrorCode
+from util.executor import ValidationExecutor, get_validation_executor
+from util.http import HttpClients, get_http_clients
+from util.registry import RequestRegistry, get_request_registry
 from util.responses import ErrorResponse, PublishResponse
 
 router = APIRouter()
@@ -23,7 +27,7 @@ router = APIRouter()
     name="Publish a pre-validated dataset",
     description="Publish a pre-validated dataset. To use this service, users must first use the validate service and use the supplied requestID",
     summary="Publish a pre-validated dataset",
-    dependencies=[Depends(JWTBearer())],
+    dependencies=[Depends(jwt_bearer)],
     response_model=Union[PublishResponse, ErrorResponse]
 )
 async def publish_validated(
@@ -38,10 +42,13 @@ async def publish_validated(
         tempPath: str = Form(),
         requestID: str = Form(),
         user: User = Depends(get_user),
-        config: AppConfig = Depends(get_app_config)):
+        config: AppConfig = Depends(get_app_config),
+        executor: ValidationExecutor = Depends(get_validation_executor),
+        http: HttpClients = Depends(get_http_clients),
+        registry: RequestRegistry = Depends(get_request_registry)):
     return await republish_validated(name, licenceUrl, pubDescription, citation, rights, purpose,
                                      methodStepDescription, qualityControlDescription,
-                                     tempPath, requestID, None, user, config)
+                                     tempPath, requestID, None, user, config, executor, http, registry)
 
 
 @router.post(
@@ -49,7 +56,7 @@ async def publish_validated(
     name="Re-publish a pre-validated dataset",
     description="Re-publish a pre-validated dataset. To use this service, users must first use the validate service and use the supplied requestID",
     tags=["publish"],
-    dependencies=[Depends(JWTBearer())],
+    dependencies=[Depends(jwt_bearer)],
     response_model=Union[PublishResponse, ErrorResponse]
 )
 async def republish_validated(
@@ -65,7 +72,10 @@ async def republish_validated(
         requestID: str = Form(),
         dataResourceUid: Union[str, None] = None,
         user: User = Depends(get_user),
-        config: AppConfig = Depends(get_app_config)):
+        config: AppConfig = Depends(get_app_config),
+        executor: ValidationExecutor = Depends(get_validation_executor),
+        http: HttpClients = Depends(get_http_clients),
+        registry: RequestRegistry = Depends(get_request_registry)):
     """
     Publish a dataset using the supplied darwin core archive
     :param user:
@@ -81,6 +91,9 @@ async def republish_validated(
     :param name:
     :param dataResourceUid:
     :param config:
+    :param executor:
+    :param http:
+    :param registry:
     :return:
     """
     # check user is authenticated
@@ -95,7 +108,10 @@ async def republish_validated(
     # check user is authorised to edit this datasets
     if dataResourceUid:
         # user needs to be creator or have ROLE_ADMIN privilege
-        data_resource = get_data_resource(dataResourceUid, config)
+        try:
+            data_resource = await get_data_resource(dataResourceUid, config, http)
+        except RegistryException as e:
+            return ErrorResponse(error=ErrorCode.REGISTRY_ERROR, message=e.args[0])
         if data_resource is None:
             return ErrorResponse(error=ErrorCode.INVALID_DATA_RESOURCE_UID, message="The data resource UID is not recognised")
 
@@ -105,6 +121,10 @@ async def republish_validated(
             return ErrorResponse(error=ErrorCode.NOT_AUTHORIZED_FOR_DATA_RESOURCE,
                                  message="You are not authorised to update this resource")
 
+    # the request ID is supplied by the client, so check it isn't another user's request
+    if not await executor.run_io(registry.is_owned_by, requestID, user):
+        return ErrorResponse(error=ErrorCode.NOT_AUTHORIZED, message="You are not authorised to publish this request")
+
     request_id = None
 
     # Check if the form fields are present in the request
@@ -120,8 +140,8 @@ async def republish_validated(
     # validate dwca archive
     data_resource = {
         "name": name,
-        "licenseType": licence.value['acronym'],
-        "licenseVersion": licence.value['version'],
+        "licenseType": licence.acronym,
+        "licenseVersion": licence.version,
         "pubDescription": pubDescription,
         "citation": citation,
         "rights": rights,
@@ -137,23 +157,24 @@ async def republish_validated(
 
     try:
         # update the registry
-        data_resource_uid = create_or_update_data_resource(dataResourceUid, data_resource, user, config)
+        data_resource_uid = await create_or_update_data_resource(dataResourceUid, data_resource, user, config, http)
 
         if data_resource_uid:
             logging.info("Copy from temp location to dwca-imports")
             request_id = requestID
-            s3 = boto3.client('s3')
             # Copy the object
-            s3.copy_object(
-                Bucket=config.s3_bucket_name,
-                CopySource={'Bucket': config.s3_bucket_name, 'Key': f'file-uploads/{tempPath}'},
-                Key=f"dwca-imports/{data_resource_uid}/{data_resource_uid}.zip"
-            )
+            await executor.run_io(copy_archive, config, f'file-uploads/{tempPath}',
+                                  f"dwca-imports/{data_resource_uid}/{data_resource_uid}.zip")
+        else:
+            return ErrorResponse(error=ErrorCode.REGISTRY_ERROR, message='Problem updating dataset in the registry')
 
         # Update the connection parameters to include references to S3
-        update_conn_params(data_resource_uid, config)
-        return start_ingest_dag(name, data_resource_uid, request_id, user, config)
+        await update_conn_params(data_resource_uid, config, http)
+        return await start_ingest_dag(name, data_resource_uid, request_id, user, config, http, registry, executor)
 
+    except RegistryException as e:
+        logging.error(f"Registry error {e}")
+        return ErrorResponse(error=ErrorCode.REGISTRY_ERROR, message=e.args[0])
     except botocore.exceptions.ClientError as ce:
         logging.error("AWS credentials not available or expired", ce, exc_info=True)
         return ErrorResponse(error=ErrorCode.AWS_CRED_EXPIRED, message='AWS credentials not available or expired')
@@ -1,54 +1,77 @@
-import json
-import logging
-from typing import Union
+from typing import AsyncIterator, Dict, Union
 
-import requests
 from fastapi import APIRouter, Depends
-from requests.auth import HTTPBasicAuth
+from fastapi.responses import StreamingResponse
 from util.config import AppConfig, get_app_config
+from util.http import HttpClients, get_http_clients
 from util.error_codes import ErrorCode
-from util.responses import ErrorResponse, PublishStatus
+from util.responses import ErrorResponse, PublishStatus, StatusBatchRequest
+from util.status import StatusCache, get_status_cache, StatusPoller, get_status_poller
 
 router = APIRouter()
 
 
+@router.post("/status/batch", tags=["publish"],
+             description="Get the status of several dataset publishing events, returned by request ID",
+             summary="Get the status of several publishing events",
+             response_model=Union[Dict[str, Union[PublishStatus, ErrorResponse]], ErrorResponse])
+async def status_batch(batch: StatusBatchRequest, config: AppConfig = Depends(get_app_config),
+                       http: HttpClients = Depends(get_http_clients),
+                       cache: StatusCache = Depends(get_status_cache)) -> Union[Dict[str, Union[PublishStatus, ErrorResponse]], ErrorResponse]:
+    """
+    Get the status of several dataset publishing events
+    :param batch: the request IDs
+    :param config:
+    :param http:
+    :param cache:
+    :return:
+    """
+    if len(batch.requestIDs) > config.status_batch_max_size:
+        return ErrorResponse(error=ErrorCode.TOO_MANY_REQUEST_IDS,
+                             message=f'At most {config.status_batch_max_size} request IDs can be requested at once')
+    return await cache.get_many(batch.requestIDs, config, http)
+
+
 @router.get("/status/{requestID}", tags=["publish"], description="Get the status of a dataset publishing event",
             summary="Get the status of publishing event",
             response_model=Union[PublishStatus, ErrorResponse])
-async def status(requestID: str, config: AppConfig = Depends(get_app_config)) -> Union[ErrorResponse, PublishStatus]:
+async def status(requestID: str, config: AppConfig = Depends(get_app_config),
+                 http: HttpClients = Depends(get_http_clients),
+                 cache: StatusCache = Depends(get_status_cache)) -> Union[ErrorResponse, PublishStatus]:
     """
     Get the status of a dataset publishing event
     :param requestID:
     :param config:
+    :param http:
+    :param cache:
     :return:
     """
+    return await cache.get(requestID, config, http)
 
-    endpoint = f'{config.airflow_api_base_url}/dags/Ingest_small_datasets/dagRuns/{requestID}'
-    headers = {'Content-Type': 'application/json'}
-    response = requests.get(endpoint, headers=headers,
-                            auth=HTTPBasicAuth(config.airflow_username, config.airflow_password))
 
-    if response.status_code == 200:
+@router.get("/status/{requestID}/stream", tags=["publish"],
+            description="Stream the status of a dataset publishing event as server-sent events. A 'status' event is sent "
+                        "with the current status and again on each change, until the event finishes. An 'error' event "
+                        "is sent if the status can't be retrieved.",
+            summary="Stream the status of publishing event",
+            response_class=StreamingResponse)
+async def status_stream(requestID: str, poller: StatusPoller = Depends(get_status_poller)) -> StreamingResponse:
+    """
+    Stream the status of a dataset publishing event
+    :param requestID:
+    :param poller:
+    :return:
+    """
+    return StreamingResponse(server_sent_events(poller.watch(requestID)), media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
-        json_str = response.content
-        dag_details = json.loads(json_str)
 
-        # Check if 'conf' key is present and not None
-        conf = dag_details.get('conf')
-        if conf is not None:
-            dataset_ids = conf.get('datasetIds', [])
+async def server_sent_events(statuses: AsyncIterator[Union[PublishStatus, ErrorResponse, None]]) -> AsyncIterator[str]:
+    async for status in statuses:
+        if status is None:
+            # keep the connection open through proxies
+            yield ': keep-alive\n\n'
+        elif isinstance(status, ErrorResponse):
+            yield f'event: error\ndata: {status.model_dump_json()}\n\n'
         else:
-            dataset_ids = []
-
-        return PublishStatus(
-            id=dag_details['dag_run_id'],
-            dataset_name=dag_details.get('conf').get('dataset_name') if dag_details.get('conf') else None,
-            datasets=dataset_ids,
-            state=dag_details['state'],
-            start_date=dag_details['start_date'],
-            end_date=dag_details['end_date']
-        )
-    else:
-        logging.info(f"Failed to retrieve DAGs. Status code: {response.status_code}")
-        return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message=f'Unable to access airflow {response.status_code}')
-
+            yield f'event: status\ndata: {status.model_dump_json()}\n\n'
@@ -1,13 +1,15 @@
 import uuid
 import logging
 from typing import Union
-import requests
+import httpx
 from fastapi import APIRouter, Depends
-from requests.auth import HTTPBasicAuth
-from util.collectory import get_data_resource
+from util.collectory import get_data_resource, RegistryException
 from util.config import get_app_config, AppConfig
-from util.auth import get_user, JWTBearer, User
+from util.auth import get_user, jwt_bearer, User
 from util.error_codes import ErrorCode
+from util.executor import ValidationExecutor, get_validation_executor
+from util.http import HttpClients, get_http_clients
+from util.registry import RequestRegistry, get_request_registry, DELETE
 from util.responses import ErrorResponse, PublishResponse
 
 router = APIRouter()
@@ -17,16 +19,22 @@ router = APIRouter()
                name="Un-publish a dataset",
                description="Un-publish a  dataset",
                tags=["publish"],
-               dependencies=[Depends(JWTBearer())],
+               dependencies=[Depends(jwt_bearer)],
                response_model=Union[PublishResponse, ErrorResponse])
 async def un_publish(dataResourceUid: str,
                      user: User = Depends(get_user),
-                     config: AppConfig = Depends(get_app_config)) -> [PublishResponse, ErrorResponse]:
+                     config: AppConfig = Depends(get_app_config),
+                     http: HttpClients = Depends(get_http_clients),
+                     executor: ValidationExecutor = Depends(get_validation_executor),
+                     registry: RequestRegistry = Depends(get_request_registry)) -> [PublishResponse, ErrorResponse]:
     """
     Un-publish a dataset
     :param user:
     :param dataResourceUid:
     :param config:
+    :param http:
+    :param executor:
+    :param registry:
     :return:
     """
     # check user is authenticated
@@ -37,7 +45,10 @@ async def un_publish(dataResourceUid: str,
     if dataResourceUid:
 
         # user needs to be creator or have ROLE_ADMIN privilege
-        data_resource = get_data_resource(dataResourceUid, config)
+        try:
+            data_resource = await get_data_resource(dataResourceUid, config, http)
+        except RegistryException as e:
+            return ErrorResponse(error=ErrorCode.REGISTRY_ERROR, message=e.args[0])
         if data_resource is None:
             return ErrorResponse(error=ErrorCode.INVALID_DATA_RESOURCE_UID, message='The data resource UID is not recognised')
 
@@ -48,9 +59,6 @@ async def un_publish(dataResourceUid: str,
                                  message='You are not authorised to update this resource')
 
         endpoint = f'{config.airflow_api_base_url}/dags/{config.delete_dag}/dagRuns'
-        headers = {
-            'Content-Type': 'application/json'
-        }
 
         request_id = str(uuid.uuid4())
 
@@ -71,10 +79,15 @@ async def un_publish(dataResourceUid: str,
             }
         }
 
-        airflow_response = requests.post(endpoint, json=dag_run_data, headers=headers,
-                                         auth=HTTPBasicAuth(config.airflow_username, config.airflow_password))
+        try:
+            airflow_response = await http.airflow.post(endpoint, json=dag_run_data)
+        except httpx.HTTPError as e:
+            logging.error(f"Error starting DAG {e}")
+            return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message='Unable to access airflow')
 
         if airflow_response.status_code == 200:
+            await executor.run_io(registry.record_run, request_id, config.delete_dag, DELETE, user, [dataResourceUid],
+                                  data_resource['name'])
             # start the publishing
             return PublishResponse(
                 requestID=request_id,
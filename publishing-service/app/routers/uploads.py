@@ -0,0 +1,246 @@
+import logging
+import uuid
+from typing import Union
+
+import botocore
+from botocore.exceptions import NoCredentialsError
+from fastapi import APIRouter, Depends, Form, Request
+from util.auth import get_user, User, jwt_bearer
+from util.config import AppConfig, get_app_config
+from util.error_codes import ErrorCode
+from util.executor import ValidationExecutor, get_validation_executor
+from util.responses import ErrorResponse, UploadSession, PresignedUpload, PresignedUploadCompletion
+from util.storage import presign_upload, complete_presigned_upload, upload_key
+from util.upload import UploadTooLargeException
+from util.upload_sessions import UploadSessions, get_upload_sessions, UploadNotFoundException, \
+    UploadIncompleteException, InvalidChunkException
+
+router = APIRouter()
+
+
+@router.post("/uploads",
+             tags=["upload"],
+             name="Start a resumable upload",
+             description="Start a resumable upload of a darwin core archive. Send the archive in chunks of chunkSize bytes, "
+                         "then complete the upload and supply the uploadID to /validate or /publish",
+             summary="Start a resumable upload",
+             dependencies=[Depends(jwt_bearer)],
+             response_model=Union[UploadSession, ErrorResponse])
+async def create_upload(fileName: str = Form(...), size: int = Form(...),
+                        sessions: UploadSessions = Depends(get_upload_sessions),
+                        executor: ValidationExecutor = Depends(get_validation_executor),
+                        user: User = Depends(get_user)) -> Union[UploadSession, ErrorResponse]:
+    """
+    Start a resumable upload
+    :param fileName: the name of the file
+    :param size: the size of the file in bytes
+    :param sessions:
+    :param executor:
+    :param user:
+    :return:
+    """
+    if size <= 0:
+        return ErrorResponse(error=ErrorCode.MISSING_DATA_FILE, message='The upload size must be greater than zero')
+    try:
+        state = await executor.run_io(sessions.create, user.id, fileName, size)
+        return await executor.run_io(sessions.to_response, state)
+    except UploadTooLargeException as e:
+        return ErrorResponse(error=ErrorCode.FILE_TOO_LARGE, message=e.args[0])
+    except Exception as e:
+        logging.error(f"Error creating upload {e}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.FILE_UPLOAD_ERROR, message='Problem starting the upload')
+
+
+@router.get("/uploads/{uploadID}",
+            tags=["upload"],
+            name="Get a resumable upload",
+            description="Get a resumable upload, including the chunks received so far, to resume an interrupted upload",
+            summary="Get a resumable upload",
+            dependencies=[Depends(jwt_bearer)],
+            response_model=Union[UploadSession, ErrorResponse])
+async def get_upload(uploadID: str,
+                     sessions: UploadSessions = Depends(get_upload_sessions),
+                     executor: ValidationExecutor = Depends(get_validation_executor),
+                     user: User = Depends(get_user)) -> Union[UploadSession, ErrorResponse]:
+    """
+    Get a resumable upload
+    :param uploadID:
+    :param sessions:
+    :param executor:
+    :param user:
+    :return:
+    """
+    try:
+        state = await executor.run_io(sessions.get, uploadID, user.id)
+        return await executor.run_io(sessions.to_response, state)
+    except UploadNotFoundException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_NOT_FOUND, message=e.args[0])
+
+
+@router.put("/uploads/{uploadID}/chunks/{chunkNumber}",
+            tags=["upload"],
+            name="Upload a chunk",
+            description="Upload a chunk of the archive as the request body. Chunks are numbered from 1, and all but "
+                        "the last must be chunkSize bytes. Re-sending a chunk replaces it.",
+            summary="Upload a chunk",
+            dependencies=[Depends(jwt_bearer)],
+            response_model=Union[UploadSession, ErrorResponse])
+async def upload_chunk(uploadID: str, chunkNumber: int, request: Request,
+                       sessions: UploadSessions = Depends(get_upload_sessions),
+                       executor: ValidationExecutor = Depends(get_validation_executor),
+                       user: User = Depends(get_user)) -> Union[UploadSession, ErrorResponse]:
+    """
+    Upload a chunk
+    :param uploadID:
+    :param chunkNumber:
+    :param request:
+    :param sessions:
+    :param executor:
+    :param user:
+    :return:
+    """
+    try:
+        state = await executor.run_io(sessions.get, uploadID, user.id)
+        temp_path = await sessions.receive_chunk(state, chunkNumber, request.stream(), executor.run_io)
+        await executor.run_io(sessions.store_chunk, state, chunkNumber, temp_path)
+        return await executor.run_io(sessions.to_response, state)
+    except UploadNotFoundException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_NOT_FOUND, message=e.args[0])
+    except InvalidChunkException as e:
+        return ErrorResponse(error=ErrorCode.INVALID_CHUNK, message=e.args[0])
+    except Exception as e:
+        logging.error(f"Error storing chunk {chunkNumber} of {uploadID} {e}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.FILE_UPLOAD_ERROR, message='Problem storing the chunk')
+
+
+@router.post("/uploads/{uploadID}/complete",
+             tags=["upload"],
+             name="Complete a resumable upload",
+             description="Complete a resumable upload once all the chunks have been sent. "
+                         "The uploadID can then be supplied to /validate or /publish in place of the file",
+             summary="Complete a resumable upload",
+             dependencies=[Depends(jwt_bearer)],
+             response_model=Union[UploadSession, ErrorResponse])
+async def complete_upload(uploadID: str,
+                          sessions: UploadSessions = Depends(get_upload_sessions),
+                          executor: ValidationExecutor = Depends(get_validation_executor),
+                          user: User = Depends(get_user)) -> Union[UploadSession, ErrorResponse]:
+    """
+    Complete a resumable upload
+    :param uploadID:
+    :param sessions:
+    :param executor:
+    :param user:
+    :return:
+    """
+    try:
+        state = await executor.run_io(sessions.get, uploadID, user.id)
+        state = await executor.run_io(sessions.complete, state)
+        return await executor.run_io(sessions.to_response, state)
+    except UploadNotFoundException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_NOT_FOUND, message=e.args[0])
+    except UploadIncompleteException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_INCOMPLETE, message=e.args[0])
+    except Exception as e:
+        logging.error(f"Error completing upload {uploadID} {e}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.FILE_UPLOAD_ERROR, message='Problem completing the upload')
+
+
+@router.delete("/uploads/{uploadID}",
+               tags=["upload"],
+               name="Abandon a resumable upload",
+               description="Abandon a resumable upload, removing any chunks received",
+               summary="Abandon a resumable upload",
+               dependencies=[Depends(jwt_bearer)],
+               response_model=Union[UploadSession, ErrorResponse])
+async def abort_upload(uploadID: str,
+                       sessions: UploadSessions = Depends(get_upload_sessions),
+                       executor: ValidationExecutor = Depends(get_validation_executor),
+                       user: User = Depends(get_user)) -> Union[UploadSession, ErrorResponse]:
+    """
+    Abandon a resumable upload
+    :param uploadID:
+    :param sessions:
+    :param executor:
+    :param user:
+    :return:
+    """
+    try:
+        state = await executor.run_io(sessions.get, uploadID, user.id)
+        response = await executor.run_io(sessions.to_response, state)
+        await executor.run_io(sessions.abort, state)
+        return response
+    except UploadNotFoundException as e:
+        return ErrorResponse(error=ErrorCode.UPLOAD_NOT_FOUND, message=e.args[0])
+
+
+@router.post("/uploads/presigned",
+             tags=["upload"],
+             name="Start a direct upload to S3",
+             description="Issue presigned URLs to upload a darwin core archive directly to S3. Archives larger than "
+                         "the multipart threshold are uploaded in parts of partSize bytes, one to each of the partUrls, "
+                         "then completed with /uploads/presigned/{requestID}/complete. Then supply the requestID to /validate/s3",
+             summary="Start a direct upload to S3",
+             dependencies=[Depends(jwt_bearer)],
+             response_model=Union[PresignedUpload, ErrorResponse])
+async def presigned_upload(size: int = Form(...),
+                           config: AppConfig = Depends(get_app_config),
+                           executor: ValidationExecutor = Depends(get_validation_executor),
+                           user: User = Depends(get_user)) -> Union[PresignedUpload, ErrorResponse]:
+    """
+    Issue presigned URLs for a direct upload to S3
+    :param size: the size of the file in bytes
+    :param config:
+    :param executor:
+    :param user:
+    :return:
+    """
+    if size <= 0:
+        return ErrorResponse(error=ErrorCode.MISSING_DATA_FILE, message='The upload size must be greater than zero')
+    if config.max_upload_size and size > config.max_upload_size:
+        return ErrorResponse(error=ErrorCode.FILE_TOO_LARGE,
+                             message=f'The supplied file exceeds the maximum upload size of {config.max_upload_size} bytes')
+
+    request_id = str(uuid.uuid4())
+    try:
+        urls = await executor.run_io(presign_upload, config, upload_key(user.id, request_id), size)
+        return PresignedUpload(requestID=request_id, tempPath=f'{user.id}/{request_id}.zip', **urls)
+    except botocore.exceptions.ClientError as ce:
+        logging.error(f"AWS credentials not available or expired {ce}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.AWS_CRED_EXPIRED, message='AWS credentials not available or expired')
+    except NoCredentialsError as ne:
+        logging.error(f"AWS credentials not available {ne}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.AWS_NOT_AVAILABLE, message='AWS credentials not available')
+
+
+@router.post("/uploads/presigned/{requestID}/complete",
+             tags=["upload"],
+             name="Complete a direct multipart upload to S3",
+             description="Complete a multipart upload to S3, supplying the ETag returned for each part",
+             summary="Complete a direct multipart upload to S3",
+             dependencies=[Depends(jwt_bearer)],
+             response_model=Union[PresignedUpload, ErrorResponse])
+async def complete_presigned_upload_parts(requestID: str, completion: PresignedUploadCompletion,
+                                          config: AppConfig = Depends(get_app_config),
+                                          executor: ValidationExecutor = Depends(get_validation_executor),
+                                          user: User = Depends(get_user)) -> Union[PresignedUpload, ErrorResponse]:
+    """
+    Complete a direct multipart upload to S3
+    :param requestID: the requestID from /uploads/presigned
+    :param completion: the multipart upload ID and the ETag of each part
+    :param config:
+    :param executor:
+    :param user:
+    :return:
+    """
+    try:
+        uuid.UUID(requestID)
+    except ValueError:
+        return ErrorResponse(error=ErrorCode.INVALID_REQUEST_ID, message='The request ID is not valid')
+    try:
+        await executor.run_io(complete_presigned_upload, config, upload_key(user.id, requestID), completion.uploadId,
+                              [part.model_dump() for part in completion.parts])
+        return PresignedUpload(requestID=requestID, tempPath=f'{user.id}/{requestID}.zip')
+    except botocore.exceptions.ClientError as ce:
+        logging.error(f"Error completing multipart upload {requestID} {ce}")
+        return ErrorResponse(error=ErrorCode.UPLOAD_INCOMPLETE, message='Unable to complete the upload, check all parts have been uploaded')
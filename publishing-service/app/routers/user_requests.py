@@ -0,0 +1,46 @@
+from datetime import datetime, timezone
+from typing import List
+
+from fastapi import APIRouter, Depends, Query
+from util.auth import get_user, User, jwt_bearer
+from util.executor import ValidationExecutor, get_validation_executor
+from util.registry import RequestRegistry, get_request_registry
+from util.responses import PublishRequestSummary
+
+router = APIRouter()
+
+
+@router.get("/requests",
+            tags=["publish"],
+            name="List my publishing requests",
+            description="List the publish and un-publish requests made by the authenticated user, most recent first",
+            summary="List my publishing requests",
+            dependencies=[Depends(jwt_bearer)],
+            response_model=List[PublishRequestSummary])
+async def user_requests(limit: int = Query(20, ge=1, le=100), offset: int = Query(0, ge=0),
+                        registry: RequestRegistry = Depends(get_request_registry),
+                        executor: ValidationExecutor = Depends(get_validation_executor),
+                        user: User = Depends(get_user)) -> List[PublishRequestSummary]:
+    """
+    List the requests made by the user, from the request registry
+    :param limit:
+    :param offset:
+    :param registry:
+    :param executor:
+    :param user:
+    :return:
+    """
+    records = await executor.run_io(registry.list_for_user, user.id, limit, offset)
+    return [
+        PublishRequestSummary(
+            requestID=record.request_id,
+            action=record.action,
+            dagId=record.dag_id,
+            dataResourceUids=record.data_resource_uids,
+            datasetName=record.dataset_name,
+            validation=record.validation,
+            started=datetime.fromtimestamp(record.started, tz=timezone.utc).isoformat() if record.started else None,
+            statusUrl=f"/status/{record.request_id}"
+        )
+        for record in records
+    ]
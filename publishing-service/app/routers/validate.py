@@ -1,22 +1,26 @@
 import logging
 import uuid
-import os
-from typing import Union
-from fastapi.encoders import jsonable_encoder
+from typing import Callable, Union
 import boto3
-from pathlib import Path
-from dwca.darwincore.utils import qualname as qn
+import botocore
+from botocore.exceptions import NoCredentialsError
 from fastapi import Depends
 from dwc_validator.exceptions import CoordinatesException
 from dwca.exceptions import BadlyFormedMetaXml
-from fastapi import APIRouter, File, UploadFile, Form
-from util.auth import get_user, User, JWTBearer
-from dwca.read import DwCAReader
-from dwc_validator.validate_dwca import validate_archive
+from fastapi import APIRouter, File, UploadFile, Form, Query
+from util.auth import get_user, User, jwt_bearer
+from util.storage import download_archive, upload_archive, upload_key
 from util.config import AppConfig, get_app_config
-from util.eml import extract_metadata
-from util.responses import ErrorResponse, ValidationResponse
-from util.map import generate_preview_map
+from util.error_codes import ErrorCode
+from util.responses import ErrorResponse, ValidationResponse, ValidationJob
+from util.executor import ValidationExecutor, get_validation_executor, WorkerFailedException
+from util.jobs import ValidationJobs, get_validation_jobs, QUEUED, RUNNING
+from util.registry import RequestRegistry, get_request_registry
+from util.upload import StoredUpload, store_upload, remove_temp_file, UploadTooLargeException
+from util.upload_sessions import UploadSessions, get_upload_sessions, UploadNotFoundException, UploadIncompleteException
+from util.validation_cache import ValidationCache, get_validation_cache, validate_upload, validation_summary
+from util.chunked_validation import UnpartitionableArchiveException
+from util.zip_safety import UnsafeArchiveException, CorruptArchiveException
 
 router = APIRouter()
 
@@ -26,136 +30,296 @@ router = APIRouter()
              name="Validate a dataset",
              description="Validate a dataset using the supplied darwin core archive",
              summary="Validate a dataset",
-             dependencies=[Depends(JWTBearer())],
-             response_model=Union[ValidationResponse, ErrorResponse]
+             dependencies=[Depends(jwt_bearer)],
+             response_model=Union[ValidationResponse, ValidationJob, ErrorResponse]
  )
 async def validate(storeTemp: bool = Form(None), file: UploadFile = File(None, media_type="application/zip"),
+                   uploadID: str = Form(None),
+                   async_: bool = Query(False, alias="async", description="Validate in the background, returning a job to poll"),
                    config: AppConfig = Depends(get_app_config),
-                   user: User = Depends(get_user)) -> Union[ValidationResponse, ErrorResponse]:
+                   executor: ValidationExecutor = Depends(get_validation_executor),
+                   cache: ValidationCache = Depends(get_validation_cache),
+                   jobs: ValidationJobs = Depends(get_validation_jobs),
+                   sessions: UploadSessions = Depends(get_upload_sessions),
+                   registry: RequestRegistry = Depends(get_request_registry),
+                   user: User = Depends(get_user)) -> Union[ValidationResponse, ValidationJob, ErrorResponse]:
     """
     Validate a dataset using the supplied darwin core archive
     :param storeTemp:
     :param store_temp: Store the file for later publishing if valid
+    :param async_: Validate in the background, returning a job to poll
     :param user:
     :param config:
+    :param executor:
+    :param cache:
+    :param jobs:
+    :param sessions:
+    :param registry:
     :param file:
+    :param uploadID: a completed resumable upload to validate, in place of the file
     :return:
     """
     logging.info("Validation request received")
     request_id = str(uuid.uuid4())
-    file2store = await file.read()
 
     # Check if the post request has the file part
-    if not file2store:
+    if file is None and uploadID is None:
         logging.info("Validation request missing file")
         return ErrorResponse(error='MISSING_DATA_FILE', message='Missing file in HTTP POST')
 
-    # file = request.files['file']
+    # stream the upload to disk
     temp_file_path = f'/tmp/temp-{request_id}.zip'
     try:
-        with open(temp_file_path, 'wb') as f:
-            f.write(file2store)
+        if uploadID:
+            upload = await executor.run_io(sessions.claim, uploadID, user.id, temp_file_path)
+        else:
+            upload = await store_upload(file, temp_file_path, config)
+    except UploadNotFoundException as e:
+        return ErrorResponse(error='UPLOAD_NOT_FOUND', message=e.args[0])
+    except UploadIncompleteException as e:
+        return ErrorResponse(error='UPLOAD_INCOMPLETE', message=e.args[0])
+    except UploadTooLargeException as e:
+        logging.info(f"Validation request file too large {e}")
+        return ErrorResponse(error='FILE_TOO_LARGE', message=e.args[0])
     except Exception as e:
         logging.error(f"Error with reading archive {e}", exc_info=True)
-        return ErrorResponse(error='FILE_UPLOAD_ERROR', message='Error with reading archive {e}')
-    finally:
-        file.file.close()
+        return ErrorResponse(error='FILE_UPLOAD_ERROR', message=f'Error with reading archive {e}')
+
+    if upload.size == 0:
+        logging.info("Validation request missing file")
+        remove_temp_file(temp_file_path)
+        return ErrorResponse(error='MISSING_DATA_FILE', message='Missing file in HTTP POST')
+
+    return await start_validation(upload, request_id, storeTemp, async_, user, config, executor, cache, jobs, registry)
+
+
+@router.post("/validate/s3",
+             tags=["validate"],
+             name="Validate a dataset uploaded to S3",
+             description="Validate a darwin core archive uploaded directly to S3 using the URLs from /uploads/presigned. "
+                         "If valid, the archive can be published with /validate/publish using the returned tempPath",
+             summary="Validate a dataset uploaded to S3",
+             dependencies=[Depends(jwt_bearer)],
+             response_model=Union[ValidationResponse, ValidationJob, ErrorResponse]
+ )
+async def validate_s3(requestID: str = Form(...), fileName: str = Form(None),
+                      async_: bool = Query(False, alias="async", description="Validate in the background, returning a job to poll"),
+                      config: AppConfig = Depends(get_app_config),
+                      executor: ValidationExecutor = Depends(get_validation_executor),
+                      cache: ValidationCache = Depends(get_validation_cache),
+                      jobs: ValidationJobs = Depends(get_validation_jobs),
+                      registry: RequestRegistry = Depends(get_request_registry),
+                      user: User = Depends(get_user)) -> Union[ValidationResponse, ValidationJob, ErrorResponse]:
+    """
+    Validate a dataset uploaded directly to S3
+    :param requestID: the requestID from /uploads/presigned
+    :param fileName: the name of the uploaded file
+    :param async_: Validate in the background, returning a job to poll
+    :param config:
+    :param executor:
+    :param cache:
+    :param jobs:
+    :param registry:
+    :param user:
+    :return:
+    """
+    logging.info("S3 validation request received")
+    try:
+        uuid.UUID(requestID)
+    except ValueError:
+        return ErrorResponse(error=ErrorCode.INVALID_REQUEST_ID, message='The request ID is not valid')
 
+    # read the archive from the bucket, to a file of its own in case the same request ID is validated concurrently
+    temp_file_path = f'/tmp/temp-{uuid.uuid4()}.zip'
     try:
-        with DwCAReader(temp_file_path) as dwca:
-
-            # check the core type is supported
-            core_file_location = dwca.descriptor.core.file_location
-            core_df = dwca.pd_read(core_file_location, parse_dates=False)
-            core_type = dwca.descriptor.core.type
-            logging.info("Core type: %s", core_type)
-            supported_core_types = {qn('Occurrence'), qn('Event')}
-
-            if core_type not in supported_core_types:
-                return ErrorResponse(error='UNSUPPORTED_CORE_TYPE', message=f'The core type {core_type} is not supported')
-
-            validate_report = validate_archive(dwca)
-
-            # generate a preview map
-            map_img = generate_preview_map(core_df, config)
-
-            if not validate_report.valid:
-                os.remove(temp_file_path)
-                logging.info("Darwin core archive failed validation.")
-                return ValidationResponse(
-                    valid=False,
-                    datasetType=validate_report.dataset_type,
-                    breakdowns=validate_report.breakdowns,
-                    fileName=file.filename,
-                    requestID=request_id,
-                    coreValidation=jsonable_encoder(validate_report.core),
-                    extensionValidations=jsonable_encoder(validate_report.extensions),
-                    mapImage=map_img
-                )
-
-            metadata = {}
-            has_eml = False
-            if dwca.metadata:
-                has_eml = True
-                metadata = extract_metadata(dwca.metadata)
-
-            # save to s3
-            s3_temp_path = None
-            if storeTemp:
-                logging.info("Uploading to S3 bucket...")
-                s3 = boto3.client('s3')
-                s3_temp_path = f'{user.id}/{request_id}.zip'
-                s3.upload_file(temp_file_path, config.s3_bucket_name, f"file-uploads/{user.id}/{request_id}.zip")
-                os.remove(temp_file_path)  # Remove the temporary file
-                logging.info("Uploaded to S3 bucket.")
+        upload = await executor.run_io(download_archive, config, upload_key(user.id, requestID), temp_file_path,
+                                       fileName or f'{requestID}.zip')
+    except UploadTooLargeException as e:
+        logging.info(f"S3 validation request file too large {e}")
+        return ErrorResponse(error=ErrorCode.FILE_TOO_LARGE, message=e.args[0])
+    except botocore.exceptions.ClientError as e:
+        logging.info(f"Unable to read upload {requestID} {e}")
+        return ErrorResponse(error=ErrorCode.UPLOAD_NOT_FOUND, message='The upload is not recognised')
+    except NoCredentialsError as e:
+        logging.error(f"AWS credentials not available {e}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.AWS_NOT_AVAILABLE, message='AWS credentials not available')
+    except botocore.exceptions.BotoCoreError as e:
+        logging.error(f"Unable to read upload {requestID} {e}", exc_info=True)
+        return ErrorResponse(error='S3_ERROR', message='Problem reading the upload from storage')
+
+    return await start_validation(upload, requestID, True, async_, user, config, executor, cache, jobs, registry,
+                                  stored=True)
+
+
+async def start_validation(upload: StoredUpload, request_id: str, store_temp: bool, async_: bool, user: User,
+                           config: AppConfig, executor: ValidationExecutor, cache: ValidationCache, jobs: ValidationJobs,
+                           registry: RequestRegistry, stored: bool = False) -> Union[ValidationResponse, ValidationJob, ErrorResponse]:
+    """
+    Validate a stored upload, either now or in the background
+    """
+    if async_:
+        # run the validation in the background, returning the job for polling
+        job = jobs.create(request_id, user.id)
+        jobs.start(job, run_validation(upload, request_id, upload.file_name, store_temp, user, config, executor, cache,
+                                       registry, job.set_progress, stored))
+        return job.to_response()
+
+    return await run_validation(upload, request_id, upload.file_name, store_temp, user, config, executor, cache,
+                                registry, stored=stored)
 
+
+async def run_validation(upload: StoredUpload, request_id: str, file_name: str, store_temp: bool, user: User,
+                         config: AppConfig, executor: ValidationExecutor, cache: ValidationCache,
+                         registry: RequestRegistry, progress: Callable[[str], None] = lambda message: None,
+                         stored: bool = False) -> Union[ValidationResponse, ErrorResponse]:
+    """
+    Validate a stored upload, optionally storing it in S3 for later publishing if valid
+    :param upload: the stored upload
+    :param request_id:
+    :param file_name: the name of the uploaded file
+    :param store_temp: Store the file for later publishing if valid
+    :param user:
+    :param config:
+    :param executor:
+    :param cache:
+    :param registry:
+    :param progress: callback for progress messages
+    :param stored: the archive is already stored in S3 for later publishing
+    :return:
+    """
+    temp_file_path = upload.path
+    try:
+        progress('Validating archive')
+        result = await validate_upload(upload, config, executor, cache)
+        logging.info("Core type: %s", result.core_type)
+
+        # check the core type is supported
+        if not result.supported_core_type:
+            return ErrorResponse(error='UNSUPPORTED_CORE_TYPE', message=f'The core type {result.core_type} is not supported')
+
+        if not result.valid:
+            logging.info("Darwin core archive failed validation.")
             return ValidationResponse(
-                valid=True,
-                datasetType=validate_report.dataset_type,
-                breakdowns=validate_report.breakdowns,
-                fileName=file.filename,
+                valid=False,
+                datasetType=result.dataset_type,
+                breakdowns=result.breakdowns,
+                fileName=file_name,
                 requestID=request_id,
-                tempPath=s3_temp_path,
-                metadata=metadata,
-                hasEml=has_eml,
-                coreValidation=jsonable_encoder(validate_report.core),
-                extensionValidations=jsonable_encoder(validate_report.extensions),
-                mapImage=map_img
+                coreValidation=result.core_validation,
+                extensionValidations=result.extension_validations,
+                mapImage=result.map_image
             )
 
+        # save to s3
+        s3_temp_path = None
+        if stored:
+            s3_temp_path = f'{user.id}/{request_id}.zip'
+        elif store_temp:
+            logging.info("Uploading to S3 bucket...")
+            progress('Storing archive')
+            s3_temp_path = f'{user.id}/{request_id}.zip'
+            await executor.run_io(upload_archive, config, temp_file_path, upload_key(user.id, request_id), progress)
+            logging.info("Uploaded to S3 bucket.")
+        if s3_temp_path:
+            await executor.run_io(registry.record_validation, request_id, user, validation_summary(upload, result))
+
+        return ValidationResponse(
+            valid=True,
+            datasetType=result.dataset_type,
+            breakdowns=result.breakdowns,
+            fileName=file_name,
+            requestID=request_id,
+            tempPath=s3_temp_path,
+            metadata=result.metadata,
+            hasEml=result.has_eml,
+            coreValidation=result.core_validation,
+            extensionValidations=result.extension_validations,
+            mapImage=result.map_image
+        )
+
     except boto3.exceptions.S3UploadFailedError as s3e:
         logging.error(f"Authentication error with S3 {s3e}")
         logging.error(s3e, exc_info=True)
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)
         return ErrorResponse(error='S3_ERROR', message=f'Problem uploading file to temporary storage')
+    except UnpartitionableArchiveException as e:
+        logging.error(f"Unable to validate large archive {e}")
+        return ErrorResponse(error=ErrorCode.VALIDATION_ERROR,
+                             message=f'The archive is too large to validate in one pass, and its partitions could not be validated: {e.args[0]}')
+    except UnsafeArchiveException as e:
+        logging.info(f"Rejected unsafe archive {e}")
+        return ErrorResponse(error=ErrorCode.UNSAFE_ARCHIVE, message=e.args[0])
+    except CorruptArchiveException as e:
+        logging.info(f"Rejected corrupt archive {e}")
+        return ErrorResponse(error=ErrorCode.CORRUPT_ARCHIVE, message=e.args[0])
+    except WorkerFailedException as e:
+        logging.error(f"Error with validate {e}", exc_info=True)
+        return ErrorResponse(error=ErrorCode.SYSTEM_ERROR, message=e.args[0])
     except CoordinatesException as e:
         logging.error(f"Problem generating map preview {e}", exc_info=True)
         logging.error(e, exc_info=True)
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)
         return ErrorResponse(error='BADLY_FORMED_COORDINATES', message=e.args[0])
     except ValueError as e:
         logging.error(f"Error with reading archive {e}", exc_info=True)
         logging.error(e, exc_info=True)
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)
         return ErrorResponse(error='BADLY_FORMED_META_XML', message=e.args[0])
     except AttributeError as e:
         logging.error(f"Error with reading archive {e}", exc_info=True)
         logging.error(e, exc_info=True)
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)
         return ErrorResponse(error='BADLY_FORMED_META_XML', message=e.args[0])
     except BadlyFormedMetaXml as e:
         logging.error(f"Error with validate {e}", exc_info=True)
         logging.error(e, exc_info=True)
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)
         return ErrorResponse(error='BADLY_FORMED_META_XML', message=e.args[0])
     except Exception as e:
         logging.error(f"Error with validate {e}", exc_info=True)
         logging.error(e, exc_info=True)
-        if temp_file_path and Path(temp_file_path).is_file():
-            os.remove(temp_file_path)
         return ErrorResponse(error='INVALID_ARCHIVE', message=e.args[0])
+    finally:
+        # the archive is only needed for the validation, whichever way it ends
+        remove_temp_file(temp_file_path)
+
+
+@router.get("/validate/jobs/{jobID}",
+            tags=["validate"],
+            name="Get a validation job",
+            description="Get the progress of a validation started with /validate?async=true",
+            summary="Get the progress of a validation job",
+            dependencies=[Depends(jwt_bearer)],
+            response_model=Union[ValidationJob, ErrorResponse])
+async def validation_job(jobID: str, jobs: ValidationJobs = Depends(get_validation_jobs),
+                         user: User = Depends(get_user)) -> Union[ValidationJob, ErrorResponse]:
+    """
+    Get the progress of a validation job
+    :param jobID:
+    :param jobs:
+    :param user:
+    :return:
+    """
+    job = jobs.get(jobID)
+    if job is None or (job.user_id != user.id and not user.is_admin):
+        return ErrorResponse(error=ErrorCode.JOB_NOT_FOUND, message='The validation job is not recognised')
+    return job.to_response()
+
+
+@router.get("/validate/jobs/{jobID}/result",
+            tags=["validate"],
+            name="Get the result of a validation job",
+            description="Get the result of a validation started with /validate?async=true",
+            summary="Get the result of a validation job",
+            dependencies=[Depends(jwt_bearer)],
+            response_model=Union[ValidationResponse, ErrorResponse])
+async def validation_job_result(jobID: str, jobs: ValidationJobs = Depends(get_validation_jobs),
+                                user: User = Depends(get_user)) -> Union[ValidationResponse, ErrorResponse]:
+    """
+    Get the result of a validation job
+    :param jobID:
+    :param jobs:
+    :param user:
+    :return:
+    """
+    job = jobs.get(jobID)
+    if job is None or (job.user_id != user.id and not user.is_admin):
+        return ErrorResponse(error=ErrorCode.JOB_NOT_FOUND, message='The validation job is not recognised')
+    if job.state in (QUEUED, RUNNING):
+        return ErrorResponse(error=ErrorCode.JOB_NOT_COMPLETE, message=f'The validation job is {job.state}: {job.progress}')
+    return job.result
@@ -1,27 +1,35 @@
 import logging
-from typing import Union
+from typing import Dict, Union
 
-import requests
-from requests.auth import HTTPBasicAuth
+import httpx
 
 from util.config import AppConfig
+from util.http import HttpClients
+from util.error_codes import ErrorCode
+from util.executor import ValidationExecutor
+from util.registry import RequestRegistry, INGEST
 from util.responses import PublishResponse, ErrorResponse
 
 
-def start_ingest_dag(data_resource_name, data_resource_uid, request_id, user, config: AppConfig) -> Union[ErrorResponse, PublishResponse]:
+async def start_ingest_dag(data_resource_name, data_resource_uid, request_id, user, config: AppConfig,
+                           http: HttpClients, registry: RequestRegistry, executor: ValidationExecutor,
+                           validation: Union[Dict, None] = None) -> Union[ErrorResponse, PublishResponse]:
     """
-    Start the ingest DAG for the supplied data resource
+    Start the ingest DAG for the supplied data resource, recording the run in the request registry
     :param data_resource_name:
     :param data_resource_uid:
     :param request_id:
     :param user:
     :param config:
+    :param http:
+    :param registry:
+    :param executor:
+    :param validation: summary of the archive validation, if not already recorded against the request
     :return:
     """
 
     # start the data resource loading
     endpoint = f'{config.airflow_api_base_url}/dags/{config.ingest_dag}/dagRuns'
-    headers = {'Content-Type': 'application/json'}
 
     dag_run_data = {
         "dag_run_id": request_id,
@@ -39,10 +47,15 @@ def start_ingest_dag(data_resource_name, data_resource_uid, request_id, user, co
         }
     }
 
-    airflow_response = requests.post(endpoint, json=dag_run_data, headers=headers,
-                                     auth=HTTPBasicAuth(config.airflow_username, config.airflow_password))
+    try:
+        airflow_response = await http.airflow.post(endpoint, json=dag_run_data)
+    except httpx.HTTPError as e:
+        logging.error(f"Error starting DAG {e}")
+        return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message='Unable to access airflow')
 
     if airflow_response.status_code == 200:
+        await executor.run_io(registry.record_run, request_id, config.ingest_dag, INGEST, user, [data_resource_uid],
+                              data_resource_name, validation)
         # start the publishing
         return PublishResponse(
             requestID=request_id,
@@ -55,4 +68,3 @@ def start_ingest_dag(data_resource_name, data_resource_uid, request_id, user, co
     else:
         logging.info(f"Failed to start DAG. Status code: {airflow_response.status_code}")
         return ErrorResponse(error='AIRFLOW_ERROR', message=f'Unable to access airflow: {airflow_response.status_code}')
-
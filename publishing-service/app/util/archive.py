@@ -0,0 +1,181 @@
+import logging
+from typing import Iterator, List, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from dwc_validator.exceptions import CoordinatesException
+
+LATITUDE_COLUMN = 'decimalLatitude'
+LONGITUDE_COLUMN = 'decimalLongitude'
+
+# terms with few distinct values, read as categoricals rather than a string object per record
+CATEGORICAL_TERMS = {
+    'basisOfRecord', 'countryCode', 'country', 'stateProvince', 'taxonRank', 'taxonomicStatus', 'kingdom', 'phylum',
+    'class', 'order', 'family', 'occurrenceStatus', 'establishmentMeans', 'degreeOfEstablishment', 'sex', 'lifeStage',
+    'geodeticDatum', 'institutionCode', 'collectionCode', 'datasetName', 'license', 'type', 'language',
+    'nomenclaturalCode'
+}
+
+# numeric terms, read as floats. Coordinates keep their full precision, measurements don't need it
+FLOAT_TERMS = {
+    LATITUDE_COLUMN: pa.float64(),
+    LONGITUDE_COLUMN: pa.float64(),
+    'coordinateUncertaintyInMeters': pa.float32(),
+    'coordinatePrecision': pa.float32(),
+    'minimumElevationInMeters': pa.float32(),
+    'maximumElevationInMeters': pa.float32(),
+    'minimumDepthInMeters': pa.float32(),
+    'maximumDepthInMeters': pa.float32()
+}
+
+# bytes sampled from the start of a data file to estimate the size of its records
+ROW_SIZE_SAMPLE = 1024 * 1024
+
+
+def column_type(term: str) -> Union[pa.DataType, None]:
+    """
+    Get the type a term is read as
+    :param term: the short name of the term
+    :return: the arrow type, or None to infer it
+    """
+    if term in FLOAT_TERMS:
+        return FLOAT_TERMS[term]
+    if term in CATEGORICAL_TERMS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return None
+
+
+def read_core_columns(dwca, columns: List[str],
+                      chunk_rows: Union[int, None] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    """
+    Read only the supplied columns of the core data file, rather than materialising the whole table. The file is
+    parsed with pyarrow's multithreaded CSV reader, with each term read as its column_type. Arrow can't read rows with
+    the wrong number of fields as pandas does, so if there are any the file is read with pandas instead.
+    :param dwca: an open DwCAReader
+    :param columns: the short names of the columns to read
+    :param chunk_rows: read about this many records at a time, returning the DataFrame of each in turn
+    :return: a DataFrame, or DataFrames, containing the columns present in the core
+    :raises ValueError: if a value can't be read as its column's type, or a row has too many fields
+    """
+    descriptor = dwca.descriptor.core
+    present = [column for column in columns if column in descriptor.short_headers]
+    if not present:
+        return pd.DataFrame() if chunk_rows is None else iter([pd.DataFrame()])
+
+    path = dwca.absolute_temporary_path(descriptor.file_location)
+    if len(descriptor.fields_terminated_by) != 1:
+        # arrow only splits on a single character
+        return _pandas_read(dwca, present, chunk_rows)
+
+    skipped_rows = _SkippedRows()
+    read_options = pa_csv.ReadOptions(column_names=descriptor.short_headers, skip_rows=descriptor.lines_to_ignore,
+                                      encoding=descriptor.file_encoding or 'utf8',
+                                      block_size=block_size(path, chunk_rows) if chunk_rows else None)
+    parse_options = pa_csv.ParseOptions(delimiter=descriptor.fields_terminated_by, newlines_in_values=True,
+                                        invalid_row_handler=skipped_rows)
+    types = {column: column_type(column) for column in present if column_type(column) is not None}
+    convert_options = pa_csv.ConvertOptions(include_columns=present, column_types=types)
+    if chunk_rows is None:
+        table = pa_csv.read_csv(path, read_options, parse_options, convert_options)
+        if skipped_rows.count:
+            logging.info(f"{descriptor.file_location} has rows with the wrong number of fields, reading it with pandas")
+            return _pandas_read(dwca, present)
+        return table.to_pandas()
+    return _read_batches(dwca, present, chunk_rows, pa_csv.open_csv(path, read_options, parse_options, convert_options),
+                         skipped_rows)
+
+
+def read_coordinates(dwca) -> pd.DataFrame:
+    """
+    Read the coordinates of the core records, parsed as floats
+    :param dwca: an open DwCAReader
+    :return: a DataFrame containing the latitude and longitude columns, if present
+    """
+    try:
+        return read_core_columns(dwca, [LATITUDE_COLUMN, LONGITUDE_COLUMN])
+    except ValueError:
+        raise CoordinatesException("Invalid coordinates supplied. Please check the values in the provided latitude and longitude columns.")
+
+
+def read_coordinate_chunks(dwca, chunk_rows: int) -> Iterator[pd.DataFrame]:
+    """
+    Read the coordinates of the core records, parsed as floats, about chunk_rows records at a time
+    :param dwca: an open DwCAReader
+    :param chunk_rows: the number of records in each chunk
+    :return: DataFrames containing the latitude and longitude columns, if present
+    """
+    try:
+        for chunk in read_core_columns(dwca, [LATITUDE_COLUMN, LONGITUDE_COLUMN], chunk_rows=chunk_rows):
+            yield chunk
+    except ValueError:
+        raise CoordinatesException("Invalid coordinates supplied. Please check the values in the provided latitude and longitude columns.")
+
+
+def block_size(path: str, chunk_rows: int) -> int:
+    """
+    Estimate the size of the blocks arrow reads a data file in, which are bytes rather than records, from the size
+    of the records at the start of the file
+    :param path: path to the data file
+    :param chunk_rows: the number of records wanted in each block
+    :return: the block size in bytes
+    """
+    with open(path, 'rb') as data_file:
+        sample = data_file.read(ROW_SIZE_SAMPLE)
+    row_size = len(sample) / max(sample.count(b'\n'), 1)
+    return max(int(row_size * chunk_rows), ROW_SIZE_SAMPLE)
+
+
+class _SkippedRows:
+    """
+    Arrow's handler for rows with the wrong number of fields, counting the rows it skips
+    """
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, row) -> str:
+        self.count += 1
+        return 'skip'
+
+
+def _read_batches(dwca, columns: List[str], chunk_rows: int, reader,
+                  skipped_rows: _SkippedRows) -> Iterator[pd.DataFrame]:
+    # a batch is only returned once its rows are parsed, so the batches returned before a row is skipped are complete,
+    # and the rest of the file is read with pandas, after the records already returned
+    records = 0
+    for batch in reader:
+        if skipped_rows.count:
+            break
+        records += batch.num_rows
+        yield batch.to_pandas()
+    if skipped_rows.count:
+        logging.info(f"{dwca.descriptor.core.file_location} has rows with the wrong number of fields, "
+                     f"reading it with pandas")
+        yield from _skip_records(_pandas_read(dwca, columns, chunk_rows), records)
+
+
+def _skip_records(dataframes: Iterator[pd.DataFrame], count: int) -> Iterator[pd.DataFrame]:
+    for dataframe in dataframes:
+        if count < len(dataframe):
+            yield dataframe.iloc[count:]
+            count = 0
+        else:
+            count -= len(dataframe)
+
+
+def _pandas_read(dwca, columns: List[str],
+                 chunk_rows: Union[int, None] = None) -> Union[pd.DataFrame, Iterator[pd.DataFrame]]:
+    # read_csv is called directly, as the DwCAReader refuses to read in chunks if any field has a default value
+    descriptor = dwca.descriptor.core
+    dtypes = {column: _pandas_type(column) for column in columns if column_type(column) is not None}
+    return pd.read_csv(dwca.absolute_temporary_path(descriptor.file_location),
+                       delimiter=descriptor.fields_terminated_by, skiprows=descriptor.lines_to_ignore, header=None,
+                       names=descriptor.short_headers, encoding=descriptor.file_encoding or 'utf8', usecols=columns,
+                       parse_dates=False, dtype=dtypes, chunksize=chunk_rows)
+
+
+def _pandas_type(column: str):
+    arrow_type = column_type(column)
+    if arrow_type is None:
+        return None
+    return 'category' if pa.types.is_dictionary(arrow_type) else arrow_type.to_pandas_dtype()
@@ -1,8 +1,21 @@
+import json
 import logging
+import threading
+import time
+from typing import Dict, Union
+from urllib.parse import urlparse
+
+import httpx
 import jwt
-from fastapi import Request, HTTPException
+from fastapi import Depends, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 
+from util.config import AppConfig, app_config
+from util.ttl_cache import TTLCache
+
+KEY_RELOAD_COOLDOWN = 30
+
 
 class User:
     def __init__(self, id, email, name, is_admin, is_publisher):
@@ -13,74 +26,144 @@ class User:
         self.is_publisher = is_publisher
 
 
-def get_user(request: Request) -> User:
+class InvalidTokenException(Exception):
+    pass
+
+
+class TokenVerifier:
     """
-    Check the request for a valid JWT token
-    :param request:
+    Verifies bearer tokens against the signing keys published at jwks_url, which may be a URL or the path of a
+    local JWKS file. The key set is loaded once and kept for jwks_cache_ttl seconds, or reloaded early, at most
+    every KEY_RELOAD_COOLDOWN seconds, for a token signed by a key it doesn't contain. The user for each verified
+    token is cached until the token expires, so a client making repeated requests with the same token is only
+    verified once. Without a jwks_url tokens are decoded without verifying their signature or expiry.
+    """
+    def __init__(self, config: AppConfig):
+        self.algorithms = config.jwt_algorithms
+        self.audience = config.jwt_audience
+        self.issuer = config.jwt_issuer
+        self.users = TTLCache(config.auth_user_cache_size, config.auth_user_cache_ttl)
+        self.jwks_url = config.jwks_url
+        self.jwks_ttl = config.jwks_cache_ttl
+        self.keys: Dict[Union[str, None], jwt.PyJWK] = {}
+        self.keys_loaded: Union[float, None] = None
+        self.lock = threading.Lock()
+        if not self.jwks_url:
+            logging.warning("No jwks_url configured, JWT signatures will not be verified")
+
+    async def authenticate(self, token: str) -> User:
+        """
+        Get the user a token was issued to
+        :param token: the bearer token
+        :return:
+        :raises InvalidTokenException: if the token can't be verified or is missing the user's claims
+        """
+        user = self.users.get(token)
+        if user is None:
+            # loading the key set blocks, so verify off the event loop
+            claims = await run_in_threadpool(self.decode, token) if self.jwks_url else self.decode(token)
+            try:
+                roles = claims['role']
+                user = User(claims['userid'], claims['email'], claims['name'],
+                            'ROLE_ADMIN' in roles, 'ROLE_DATA_PUBLISHER' in roles)
+            except (KeyError, TypeError) as e:
+                raise InvalidTokenException(f'Token missing claim {e}') from e
+            expires = claims.get('exp')
+            self.users.put(token, user, expires - time.time() if isinstance(expires, (int, float)) else None)
+        return user
+
+    def decode(self, token: str) -> Dict:
+        """
+        Verify and decode a token
+        :param token:
+        :return: the token's claims
+        """
+        try:
+            if not self.jwks_url:
+                return jwt.decode(token, options={'verify_signature': False})
+            signing_key = self.signing_key(jwt.get_unverified_header(token).get('kid'))
+            return jwt.decode(token, signing_key.key, algorithms=self.algorithms, audience=self.audience,
+                              issuer=self.issuer, options={'verify_aud': self.audience is not None})
+        except jwt.PyJWTError as e:
+            raise InvalidTokenException(str(e)) from e
+
+    def signing_key(self, kid: Union[str, None]) -> jwt.PyJWK:
+        """
+        Get a signing key from the key set, loading the key set if it has expired or doesn't contain the key
+        :param kid: the key ID from the token header
+        :return:
+        """
+        with self.lock:
+            age = float('inf') if self.keys_loaded is None else time.monotonic() - self.keys_loaded
+            if age > self.jwks_ttl or (kid not in self.keys and age > KEY_RELOAD_COOLDOWN):
+                self._load_keys()
+            keys = self.keys
+        if kid is None and len(keys) == 1:
+            return next(iter(keys.values()))
+        if kid not in keys:
+            raise InvalidTokenException(f'No signing key {kid}')
+        return keys[kid]
+
+    def _load_keys(self):
+        try:
+            if urlparse(self.jwks_url).scheme in ('http', 'https'):
+                response = httpx.get(self.jwks_url, timeout=10)
+                response.raise_for_status()
+                jwks = response.json()
+            else:
+                with open(self.jwks_url) as jwks_file:
+                    jwks = json.load(jwks_file)
+            self.keys = {key.key_id: key for key in jwt.PyJWKSet.from_dict(jwks).keys}
+            logging.info(f"Loaded {len(self.keys)} signing keys from {self.jwks_url}")
+        except (httpx.HTTPError, OSError, ValueError, jwt.PyJWTError) as e:
+            # keep any keys already loaded, and wait for the cooldown before trying again
+            logging.error(f"Error loading signing keys from {self.jwks_url} {e}")
+        self.keys_loaded = time.monotonic()
+
+
+token_verifier = TokenVerifier(app_config)
+
+
+def get_token_verifier():
+    """
+    Get the token verifier
     :return:
     """
-    auth_header = request.headers.get("Authorization")
-
-    if not auth_header:
-        credentials_exception = HTTPException(
-            status_code=401,
-            detail="Could not validate credentials",
-            headers={"Authorization": "Bearer"},
-        )
-        raise credentials_exception
-    try:
-        jwt_token = auth_header.split(' ')[1]
-        decoded_token = jwt.decode(jwt=jwt_token,
-                                   verify=False,
-                                   algorithms=None,
-                                   verify_signature=False,
-                                   options={'verify_signature': False})
-
-        userid = decoded_token['userid']
-        user_email = decoded_token['email']
-        user_display_name = decoded_token['name']
-        roles = decoded_token['role']
-        is_admin = 'ROLE_ADMIN' in roles
-        is_publisher = 'ROLE_DATA_PUBLISHER' in roles
-        return User(userid, user_email, user_display_name, is_admin, is_publisher)
-    except Exception as e:
-        logging.error("Authentication error", exc_info=True)
-        credentials_exception = HTTPException(
-            status_code=401,
-            detail="Could not validate credentials",
-            headers={"Authorization": "Bearer"},
-        )
-        raise credentials_exception
+    return token_verifier
 
 
 class JWTBearer(HTTPBearer):
-    def __init__(self, auto_error: bool = True):
+    """
+    Authenticates the request's bearer token, keeping the user it was issued to in request.state.user
+    """
+    def __init__(self, auto_error: bool = True, verifier: TokenVerifier = token_verifier):
         super(JWTBearer, self).__init__(auto_error=auto_error)
+        self.verifier = verifier
 
     async def __call__(self, request: Request):
         credentials: HTTPAuthorizationCredentials = await super(JWTBearer, self).__call__(request)
         if credentials:
             if not credentials.scheme == "Bearer":
                 raise HTTPException(status_code=403, detail="Invalid authentication scheme.")
-            if not self.verify_jwt(credentials.credentials):
+            try:
+                request.state.user = await self.verifier.authenticate(credentials.credentials)
+            except InvalidTokenException as e:
+                logging.info(f"Authentication error {e}")
                 raise HTTPException(status_code=403, detail="Invalid token or expired token.")
             return credentials.credentials
         else:
             raise HTTPException(status_code=403, detail="Invalid authorization code.")
 
-    def verify_jwt(self, token: str) -> bool:
-        is_valid: bool = False
 
-        try:
-            payload = jwt.decode(jwt=token,
-                                   verify=False,
-                                   algorithms=None,
-                                   verify_signature=False,
-                                   options={'verify_signature': False})
-
-            # payload = decodeJWT(jwtoken)
-        except:
-            payload = None
-        if payload:
-            is_valid = True
-        return is_valid
\ No newline at end of file
+# shared by the routes' dependencies and get_user, so FastAPI authenticates each request once
+jwt_bearer = JWTBearer()
+
+
+def get_user(request: Request, token: str = Depends(jwt_bearer)) -> User:
+    """
+    Get the user authenticated by the request's bearer token
+    :param request:
+    :param token:
+    :return:
+    """
+    return request.state.user
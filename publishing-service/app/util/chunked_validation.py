@@ -0,0 +1,469 @@
+import csv
+import logging
+import os
+import shutil
+import tempfile
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Dict, IO, Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+from dwc_validator.validate_dwca import validate_archive
+from fastapi.encoders import jsonable_encoder
+
+from util.config import AppConfig
+
+# how each field of the validator's reports is merged across partitions. If a field isn't listed, the archive can't
+# be validated in partitions. Row numbers in records are the record's index in its data file.
+SUM = 'sum'  # counts of records, summed
+ALL = 'all'  # true only if true in every partition
+ANY = 'any'  # true if true in any partition
+SAME = 'same'  # determined by the data file's columns, so must be the same in every partition
+COUNTS = 'counts'  # counts by value, summed by value
+UNIQUE = 'unique'  # values found, without duplicates, in the order they appear
+RECORDS = 'records'  # errors or warnings, with row numbers mapped back to the data file
+REPORT = 'report'  # a nested report
+REPORTS = 'reports'  # a list of nested reports, one per field
+
+REPORT_FIELDS = {
+    'valid': ALL,
+    'dataset_type': SAME,
+    'breakdowns': COUNTS,
+    'record_type': SAME,
+    'record_count': SUM,
+    'record_error_count': SUM,
+    'errors': RECORDS,
+    'warnings': RECORDS,
+    'all_required_columns_present': ALL,
+    'missing_columns': SAME,
+    'incorrect_dwc_terms': SAME,
+    'column_counts': COUNTS,
+    'records_with_taxonomy_count': SUM,
+    'records_with_temporal_count': SUM,
+    'records_with_recorded_by_count': SUM,
+    'records_with_coordinates_count': SUM,
+    'taxonomy_report': REPORT,
+    'has_invalid_taxa': ANY,
+    'unrecognised_taxa': UNIQUE,
+    'coordinates_report': REPORT,
+    'has_coordinates_fields': SAME,
+    'invalid_decimal_latitude_count': SUM,
+    'invalid_decimal_longitude_count': SUM,
+    'vocab_reports': REPORTS,
+    'field': SAME,
+    'has_invalid_values': ANY,
+    'recognised_count': SUM,
+    'unrecognised_count': SUM,
+    'non_matching_values': UNIQUE
+}
+
+# keys of a record's row number, and of the field a nested report in a list is for
+ROW_KEYS = ('row', 'row_index', 'index', 'line', 'line_number')
+REPORT_KEY = 'field'
+
+# the error added to the core's report for IDs used by records in different partitions, which the validator can't see
+DUPLICATE_ID_ERROR = 'DUPLICATE_ID'
+# the most duplicate IDs listed in the error
+MAX_REPORTED_DUPLICATE_IDS = 100
+
+
+class UnpartitionableArchiveException(Exception):
+    """
+    Raised when the reports of an archive's partitions can't be merged into the report of a single pass
+    """
+    pass
+
+
+@dataclass
+class ChunkedValidationReport:
+    """
+    The merged reports of validating an archive a partition at a time, in the shape of the validator's report
+    """
+    valid: bool = True
+    dataset_type: str = ""
+    breakdowns: Dict = field(default_factory=dict)
+    core: Any = None
+    extensions: List = field(default_factory=list)
+
+
+def is_large_core(dwca, config: AppConfig) -> bool:
+    """
+    Check if the core data file is large enough to be validated in chunks
+    :param dwca: an open DwCAReader
+    :param config:
+    :return:
+    """
+    core_path = dwca.absolute_temporary_path(dwca.descriptor.core.file_location)
+    return bool(config.validation_chunk_threshold) and os.path.getsize(core_path) > config.validation_chunk_threshold
+
+
+def validate_archive_in_chunks(dwca, config: AppConfig):
+    """
+    Validate an archive in partitions of validation_chunk_rows core records, so memory use is proportional to the
+    partition size rather than the dataset. The core is split into consecutive runs of records, and each extension
+    record goes to the partition of the core record it refers to, so references to the core ID hold across
+    partitions. Records are copied as they are in the data files, rather than parsed and rewritten. Each partition
+    is put in place of the archive's data files and validated, and the reports are merged field by field. Core IDs
+    used by records in different partitions are found while partitioning, and reported as a DUPLICATE_ID error.
+    :param dwca: an open DwCAReader
+    :param config:
+    :return: the merged report, or the validator's report if the core fits in a single partition
+    :raises UnpartitionableArchiveException: if the reports have a field with no merge rule, or values that can't be
+    merged by it. The archive isn't validated in a single pass instead, as memory use would grow with the dataset.
+    """
+    descriptors = [dwca.descriptor.core] + list(dwca.descriptor.extensions)
+    paths = [dwca.absolute_temporary_path(descriptor.file_location) for descriptor in descriptors]
+    chunk_rows = config.validation_chunk_rows
+
+    work_dir = tempfile.mkdtemp(dir=os.path.dirname(paths[0]))
+    originals = [f'{path}.full' for path in paths]
+    try:
+        core_paths, core_positions, core_index, duplicate_hashes = _partition_core(
+            paths[0], descriptors[0], chunk_rows, os.path.join(work_dir, '0'))
+        partitions = len(core_paths)
+        if partitions <= 1:
+            # no bigger than a partition, so there's nothing to merge
+            return validate_archive(dwca)
+        logging.info(f"Validating {paths[0]} in {partitions} partitions")
+        duplicate_ids = _duplicate_ids(paths[0], descriptors[0], duplicate_hashes)
+        partition_paths = [core_paths]
+        positions = [core_positions]
+        for i, (path, descriptor) in enumerate(zip(paths[1:], descriptors[1:]), start=1):
+            extension_paths, extension_positions = _partition_extension(path, descriptor, core_index, partitions,
+                                                                        chunk_rows, os.path.join(work_dir, str(i)))
+            partition_paths.append(extension_paths)
+            positions.append(extension_positions)
+        for path, original in zip(paths, originals):
+            os.replace(path, original)
+
+        reports = []
+        for partition in range(partitions):
+            for path, file_partitions in zip(paths, partition_paths):
+                os.replace(file_partitions[partition], path)
+            reports.append(jsonable_encoder(validate_archive(dwca)))
+
+        report = ChunkedValidationReport(
+            valid=_merge_field('valid', [report['valid'] for report in reports], []),
+            dataset_type=_merge_field('dataset_type', [report['dataset_type'] for report in reports], []),
+            breakdowns=_merge_field('breakdowns', [report['breakdowns'] for report in reports], []),
+            core=merge_reports([report['core'] for report in reports], positions[0]),
+            extensions=[
+                merge_reports([(report['extensions'] or [None] * len(descriptors))[i] for report in reports],
+                              positions[i + 1])
+                for i in range(len(descriptors) - 1)
+            ]
+        )
+        if len(duplicate_hashes):
+            _add_duplicate_id_error(report, len(duplicate_hashes), duplicate_ids)
+        return report
+    finally:
+        for path, original in zip(paths, originals):
+            if os.path.exists(original):
+                os.replace(original, path)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def _add_duplicate_id_error(report: ChunkedValidationReport, count: int, duplicate_ids: List[str]):
+    report.valid = False
+    if report.core is None:
+        return
+    if 'valid' in report.core:
+        report.core['valid'] = False
+    report.core['errors'] = (report.core.get('errors') or []) + [{
+        'error': DUPLICATE_ID_ERROR,
+        'message': f'{count} core IDs are used by more than one record',
+        'ids': duplicate_ids
+    }]
+
+
+def merge_reports(reports: List[Union[Dict, None]], positions: List[Sequence[int]]) -> Union[Dict, None]:
+    """
+    Merge the reports of a data file's partitions, field by field, by the rules in REPORT_FIELDS
+    :param reports: the report of each partition
+    :param positions: the index in the data file of each record in each partition
+    :return: the report of the data file
+    :raises UnpartitionableArchiveException: if a field has no merge rule, or its values can't be merged by it
+    """
+    present = [(report, partition_positions) for report, partition_positions in zip(reports, positions)
+               if report is not None]
+    if not present:
+        return None
+    reports = [report for report, _ in present]
+    positions = [partition_positions for _, partition_positions in present]
+    keys = list(dict.fromkeys(key for report in reports for key in report))
+    return {key: _merge_field(key, [report.get(key) for report in reports], positions) for key in keys}
+
+
+def _merge_field(key: str, values: List[Any], positions: List[Sequence[int]]) -> Any:
+    rule = REPORT_FIELDS.get(key)
+    if rule is None:
+        raise UnpartitionableArchiveException(f'No merge rule for the report field {key}')
+    if all(value is None for value in values):
+        return None
+    if rule == REPORT:
+        return merge_reports(values, positions)
+    if any(value is None for value in values):
+        raise UnpartitionableArchiveException(f'The report field {key} is missing from some partitions')
+
+    if rule == SUM and all(_is_number(value) for value in values):
+        return sum(values)
+    if rule in (ALL, ANY) and all(isinstance(value, bool) for value in values):
+        return all(values) if rule == ALL else any(values)
+    if rule == SAME and all(value == values[0] for value in values):
+        return values[0]
+    if rule == COUNTS and all(isinstance(value, dict) for value in values):
+        return _merge_counts(key, values)
+    if rule == UNIQUE and all(isinstance(value, list) for value in values):
+        merged = list(dict.fromkeys(item for value in values for item in _hashable(key, value)))
+        return sorted(merged) if all(value == sorted(value) for value in values) else merged
+    if rule == RECORDS and all(isinstance(value, list) for value in values):
+        return _merge_records(key, values, positions)
+    if rule == REPORTS and all(isinstance(value, list) for value in values):
+        return _merge_report_lists(key, values, positions)
+    raise UnpartitionableArchiveException(f'The values of the report field {key} can\'t be merged')
+
+
+def _merge_counts(key: str, values: List[Dict]) -> Dict:
+    merged = {}
+    for value in values:
+        for name, count in value.items():
+            if name not in merged:
+                merged[name] = count
+            elif _is_number(merged[name]) and _is_number(count):
+                merged[name] += count
+            elif isinstance(merged[name], dict) and isinstance(count, dict):
+                merged[name] = _merge_counts(key, [merged[name], count])
+            elif merged[name] != count:
+                raise UnpartitionableArchiveException(f'The counts in the report field {key} can\'t be merged')
+    return merged
+
+
+def _merge_records(key: str, values: List[List], positions: List[Sequence[int]]) -> List:
+    # records for a row are mapped back to the row's index in the data file, others are the same in every partition
+    rows = []
+    others = []
+    for records, partition_positions in zip(values, positions):
+        for record in records:
+            row_key = _row_key(record)
+            if row_key is None:
+                others.append(record)
+                continue
+            row = record[row_key]
+            if row < 0 or row >= len(partition_positions):
+                raise UnpartitionableArchiveException(f'A record in the report field {key} has an unknown row {row}')
+            rows.append({**record, row_key: int(partition_positions[row])})
+    if rows and others:
+        raise UnpartitionableArchiveException(f'The records in the report field {key} can\'t be ordered')
+    if rows:
+        return sorted(rows, key=lambda record: record[_row_key(record)])
+    return list(dict.fromkeys(_hashable(key, others)))
+
+
+def _merge_report_lists(key: str, values: List[List], positions: List[Sequence[int]]) -> List:
+    grouped: Dict[Any, Tuple[List, List]] = {}
+    for reports, partition_positions in zip(values, positions):
+        for report in reports:
+            if not isinstance(report, dict) or REPORT_KEY not in report:
+                raise UnpartitionableArchiveException(f'The reports in the report field {key} can\'t be matched')
+            group = grouped.setdefault(report[REPORT_KEY], ([], []))
+            group[0].append(report)
+            group[1].append(partition_positions)
+    return [merge_reports(reports, report_positions) for reports, report_positions in grouped.values()]
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _row_key(record: Any) -> Union[str, None]:
+    if isinstance(record, dict):
+        for row_key in ROW_KEYS:
+            if _is_number(record.get(row_key)) and record[row_key] == int(record[row_key]):
+                return row_key
+    return None
+
+
+def _hashable(key: str, values: List) -> List:
+    if not all(isinstance(value, (str, int, float, bool)) or value is None for value in values):
+        raise UnpartitionableArchiveException(f'The values of the report field {key} can\'t be combined')
+    return values
+
+
+def _partition_core(path: str, descriptor, chunk_rows: int,
+                    prefix: str) -> Tuple[List[str], List[range], Union[np.ndarray, None], np.ndarray]:
+    """
+    Split the core into partitions of chunk_rows consecutive records, copying each record as it is
+    :return: the paths of the partition files, the index of the records in each, an index of the core IDs, and the
+    hashes of the IDs used in more than one partition
+    """
+    key_index = _key_index(descriptor, 'id')
+    partition_paths = []
+    partition_file = None
+    key_hashes = array('q')
+    count = 0
+    try:
+        with _open_data_file(path, descriptor) as data_file:
+            header = _read_header(data_file, descriptor)
+            for raw, key in _read_records(data_file, descriptor, key_index):
+                if count % chunk_rows == 0:
+                    if partition_file:
+                        partition_file.close()
+                    partition_paths.append(f'{prefix}-{len(partition_paths)}.txt')
+                    partition_file = _create_partition(partition_paths[-1], descriptor, header)
+                partition_file.write(raw)
+                key_hashes.append(_key_hash(key))
+                count += 1
+    finally:
+        if partition_file:
+            partition_file.close()
+    # the core IDs, sorted, with the partition of each, to route extension records
+    hashes = np.frombuffer(key_hashes, dtype=np.int64) if count else np.empty(0, dtype=np.int64)
+    order = np.argsort(hashes, kind='stable')
+    sorted_hashes = hashes[order]
+    partitions = order // chunk_rows
+    positions = [range(start, min(start + chunk_rows, count)) for start in range(0, count, chunk_rows)]
+    if key_index is None:
+        return partition_paths, positions, None, np.empty(0, dtype=np.int64)
+    # the validator only sees the IDs in each partition, so IDs repeated across partitions are found here
+    repeated = (sorted_hashes[1:] == sorted_hashes[:-1]) & (partitions[1:] != partitions[:-1])
+    duplicate_hashes = np.unique(sorted_hashes[1:][repeated])
+    return partition_paths, positions, np.stack([sorted_hashes, partitions]), duplicate_hashes
+
+
+def _duplicate_ids(path: str, descriptor, duplicate_hashes: np.ndarray) -> List[str]:
+    """
+    Get the IDs used by records in different partitions, up to MAX_REPORTED_DUPLICATE_IDS, from their hashes
+    """
+    if not len(duplicate_hashes):
+        return []
+    wanted = set(duplicate_hashes[:MAX_REPORTED_DUPLICATE_IDS].tolist())
+    found: Dict[Any, List[str]] = {}
+    with _open_data_file(path, descriptor) as data_file:
+        _read_header(data_file, descriptor)
+        for _, key in _read_records(data_file, descriptor, _key_index(descriptor, 'id')):
+            if _key_hash(key) in wanted:
+                found.setdefault(_key_value(key), []).append(key.strip())
+    # different IDs with the same hash aren't duplicates
+    return [keys[0] for keys in found.values() if len(keys) > 1]
+
+
+def _partition_extension(path: str, descriptor, core_index: Union[np.ndarray, None], partitions: int,
+                         chunk_rows: int, prefix: str) -> Tuple[List[str], List[np.ndarray]]:
+    """
+    Split an extension into the partitions of the core records its records refer to, or by position if they
+    refer to none, copying each record as it is
+    :return: the paths of the partition files, and the index of the records in each
+    """
+    key_index = _key_index(descriptor, 'coreid')
+    partition_paths = [f'{prefix}-{partition}.txt' for partition in range(partitions)]
+    positions = [array('q') for _ in range(partitions)]
+    files = []
+    try:
+        with _open_data_file(path, descriptor) as data_file:
+            header = _read_header(data_file, descriptor)
+            files = [_create_partition(partition_path, descriptor, header) for partition_path in partition_paths]
+            position = 0
+            while True:
+                batch = [record for _, record in zip(range(chunk_rows), _read_records(data_file, descriptor, key_index))]
+                if not batch:
+                    break
+                batch_positions = np.arange(position, position + len(batch))
+                assignments = np.minimum(batch_positions // chunk_rows, partitions - 1)
+                if key_index is not None and core_index is not None and core_index.shape[1]:
+                    hashes = np.array([_key_hash(key) for _, key in batch], dtype=np.int64)
+                    found = np.minimum(np.searchsorted(core_index[0], hashes), core_index.shape[1] - 1)
+                    matched = core_index[0][found] == hashes
+                    assignments = np.where(matched, core_index[1][found], assignments)
+                for (raw, _), partition, record_position in zip(batch, assignments, batch_positions):
+                    files[partition].write(raw)
+                    positions[partition].append(record_position)
+                position += len(batch)
+    finally:
+        for partition_file in files:
+            partition_file.close()
+    return partition_paths, [np.frombuffer(partition_positions, dtype=np.int64) if partition_positions
+                             else np.empty(0, dtype=np.int64) for partition_positions in positions]
+
+
+def _key_index(descriptor, key: str) -> Union[int, None]:
+    return descriptor.short_headers.index(key) if key in descriptor.short_headers else None
+
+
+def _key_hash(key: str) -> int:
+    return hash(_key_value(key))
+
+
+def _key_value(key: str) -> Union[str, float]:
+    # the validator reads IDs that are all numbers as numbers, so 1 and 01 are the same ID
+    key = key.strip()
+    try:
+        return float(key)
+    except ValueError:
+        return key
+
+
+def _open_data_file(path: str, descriptor) -> IO:
+    # undecodable bytes are kept as they are, so records are copied exactly
+    return open(path, 'r', encoding=descriptor.file_encoding or 'utf-8', errors='surrogateescape', newline='')
+
+
+def _create_partition(path: str, descriptor, header: str) -> IO:
+    partition_file = open(path, 'w', encoding=descriptor.file_encoding or 'utf-8', errors='surrogateescape',
+                          newline='')
+    partition_file.write(header)
+    return partition_file
+
+
+def _read_header(data_file: IO, descriptor) -> str:
+    return ''.join(data_file.readline() for _ in range(descriptor.lines_to_ignore))
+
+
+def _read_records(data_file: IO, descriptor, key_index: Union[int, None]) -> Iterator[Tuple[str, str]]:
+    """
+    Read the records of a data file as they are, with the value of the key column. Records are split as pandas
+    splits them when the validator reads the file, so quoted values may span lines, and blank lines are skipped.
+    """
+    delimiter = descriptor.fields_terminated_by
+    if len(delimiter) != 1:
+        for line in data_file:
+            if line.strip('\r\n'):
+                fields = line.rstrip('\r\n').split(delimiter)
+                yield _terminated(line), _field(fields, key_index)
+        return
+
+    lines = _LineRecorder(data_file)
+    for fields in csv.reader(lines, delimiter=delimiter, quotechar='"', strict=False):
+        raw = lines.take()
+        if fields:
+            yield _terminated(raw), _field(fields, key_index)
+
+
+class _LineRecorder:
+    """
+    Iterates the lines of a file, recording the lines read since the last take, to recover the text of each record
+    """
+    def __init__(self, data_file: IO):
+        self.lines = iter(data_file)
+        self.read = []
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        line = next(self.lines)
+        self.read.append(line)
+        return line
+
+    def take(self) -> str:
+        raw = ''.join(self.read)
+        self.read = []
+        return raw
+
+
+def _terminated(raw: str) -> str:
+    # the last record may have no line ending, and mustn't run into the record after it in a partition
+    return raw if raw.endswith('\n') else raw + '\n'
+
+
+def _field(fields: List[str], index: Union[int, None]) -> str:
+    return fields[index] if index is not None and index < len(fields) else ''
@@ -1,34 +1,66 @@
 import json
 import logging
-import requests
+
+import httpx
+
 from util.auth import User
-from util.config import AppConfig
+from util.config import AppConfig, app_config
+from util.http import HttpClients
+from util.ttl_cache import TTLCache
+
+# data resource records by UID, to save a registry round trip for authorisation checks. Entries are
+# removed whenever this service updates the data resource.
+data_resources = TTLCache(app_config.data_resource_cache_size, app_config.data_resource_cache_ttl)
+# data resource names by UID, for the events feed
+data_resource_names = TTLCache(app_config.dataset_name_cache_size, app_config.dataset_name_cache_ttl)
+
+
+class RegistryException(Exception):
+    """
+    Raised when the registry can't be reached
+    """
+    pass
+
+
+def invalidate_data_resource(data_resource_uid: str):
+    data_resources.pop(data_resource_uid)
+    data_resource_names.pop(data_resource_uid)
 
 
-def create_or_update_data_resource(data_resource_uid, data_resource, user:User, config: AppConfig):
+async def create_or_update_data_resource(data_resource_uid, data_resource, user:User, config: AppConfig, http: HttpClients):
+    try:
+        return await _create_or_update_data_resource(data_resource_uid, data_resource, user, config, http)
+    except httpx.HTTPError as e:
+        logging.error(f"Error updating data resource in the registry {e}")
+        return None
+
+
+async def _create_or_update_data_resource(data_resource_uid, data_resource, user: User, config: AppConfig,
+                                          http: HttpClients):
     collectory_headers = {"apikey": config.ala_api_key}
 
     if data_resource_uid:
         logging.info("Updating existing data resource")
-        collectory_response = requests.post(f'{config.collectory_lookup_url}/{data_resource_uid}',
-                                            data=json.dumps(data_resource),
-                                            headers=collectory_headers)
+        collectory_response = await http.collectory.post(f'{config.collectory_lookup_url}/{data_resource_uid}',
+                                                         content=json.dumps(data_resource),
+                                                         headers=collectory_headers)
     else:
         logging.info("Checking to see if data resource already exists")
         # check of a data resource exists for this name, created by this user
-        search_response = requests.get(f"{config.collectory_lookup_url}?createdByID={user.id}&name={data_resource['name']}")
+        search_response = await http.collectory.get(config.collectory_lookup_url,
+                                                    params={'createdByID': user.id, 'name': data_resource['name']})
         matches = json.loads(search_response.content)
         if matches and len(matches) > 0:
             logging.info(f"Existing data resource found for {data_resource['name']}")
             data_resource_uid = matches[0]['uid']
-            collectory_response = requests.post(f'{config.collectory_lookup_url}/{data_resource_uid}',
-                                                data=json.dumps(data_resource),
-                                                headers=collectory_headers)
+            collectory_response = await http.collectory.post(f'{config.collectory_lookup_url}/{data_resource_uid}',
+                                                             content=json.dumps(data_resource),
+                                                             headers=collectory_headers)
         else:
             logging.info(f"Creating new  data resource for {data_resource['name']}")
-            collectory_response = requests.post(f'{config.collectory_lookup_url}/',
-                                                data=json.dumps(data_resource),
-                                                headers=collectory_headers)
+            collectory_response = await http.collectory.post(f'{config.collectory_lookup_url}/',
+                                                             content=json.dumps(data_resource),
+                                                             headers=collectory_headers)
 
     logging.info(collectory_response.status_code)
 
@@ -38,32 +70,55 @@ def create_or_update_data_resource(data_resource_uid, data_resource, user:User,
         segments = url.split('/')
         # get the UID from the response
         data_resource_uid = segments[-1] if segments[-1] else segments[-2]
+        invalidate_data_resource(data_resource_uid)
         return data_resource_uid
     elif collectory_response.status_code == 200:
         logging.info("Collectory resource updated")
+        invalidate_data_resource(data_resource_uid)
         return data_resource_uid
     else:
         logging.info(f"Failed to create data resource. Status code: {collectory_response.status_code}")
         return None
 
 
-def get_data_resource(data_resource_uid:str, config: AppConfig):
-
+async def get_data_resource(data_resource_uid:str, config: AppConfig, http: HttpClients):
+    """
+    Get a data resource from the registry
+    :param data_resource_uid:
+    :param config:
+    :param http:
+    :return: the data resource, or None if it isn't found
+    :raises RegistryException: if the registry can't be reached
+    """
     collectory_headers = {"apikey": config.ala_api_key}
 
+    data_resource = data_resources.get(data_resource_uid)
+    if data_resource is not None:
+        return data_resource
+
     # update the collectory entry with archive location
     logging.info(f"Getting to {config.collectory_lookup_url}/{data_resource_uid}")
     try:
-        response = requests.get(f'{config.collectory_lookup_url}/{data_resource_uid}', headers=collectory_headers)
+        response = await http.collectory.get(f'{config.collectory_lookup_url}/{data_resource_uid}', headers=collectory_headers)
         if response.status_code == 200:
-            return json.loads(response.content)
+            data_resource = json.loads(response.content)
+            data_resources.put(data_resource_uid, data_resource)
+            return data_resource
         return None
-    except Exception as e:
-        logging.info(str(e))
-
+    except httpx.HTTPError as e:
+        logging.error(f"Error getting data resource {data_resource_uid} from the registry {e}")
+        raise RegistryException('Unable to access the registry')
 
-def update_conn_params(data_resource_uid: str, config: AppConfig):
 
+async def update_conn_params(data_resource_uid: str, config: AppConfig, http: HttpClients):
+    """
+    Point the data resource's connection parameters at its archive in S3
+    :param data_resource_uid:
+    :param config:
+    :param http:
+    :return:
+    :raises RegistryException: if the registry can't be reached
+    """
     collectory_headers = { "apikey": config.ala_api_key}
 
     data_resource_connection_parameters = {
@@ -76,8 +131,11 @@ def update_conn_params(data_resource_uid: str, config: AppConfig):
     # update the collectory entry with archive location
     logging.info(f"Posting to {config.collectory_lookup_url}/{data_resource_uid}")
     try:
-        requests.post(f'{config.collectory_lookup_url}/{data_resource_uid}',
-                      data=json.dumps(data_resource_connection_parameters),
-                      headers=collectory_headers)
-    except Exception as e:
-        logging.info(str(e))
+        await http.collectory.post(f'{config.collectory_lookup_url}/{data_resource_uid}',
+                                   content=json.dumps(data_resource_connection_parameters),
+                                   headers=collectory_headers)
+    except httpx.HTTPError as e:
+        logging.error(f"Error updating connection parameters of {data_resource_uid} in the registry {e}")
+        raise RegistryException('Unable to access the registry')
+    finally:
+        invalidate_data_resource(data_resource_uid)
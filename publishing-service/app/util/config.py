@@ -1,3 +1,5 @@
+from typing import List, Union
+
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -5,6 +7,7 @@ class AppConfig(BaseSettings):
     airflow_api_base_url: str
     collectory_lookup_url: str
     s3_bucket_name: str
+    s3_endpoint_url: Union[str, None] = None
     ala_api_key: str
     airflow_username: str
     airflow_password: str
@@ -15,9 +18,65 @@ class AppConfig(BaseSettings):
     default_max_latitude: float = -5
     default_min_longitude: float = 109
     default_max_longitude: float = 158
+    map_density_threshold: int = 50000
+    map_density_cell_size: int = 10
     remove_records_in_solr: bool = True
     remove_records_in_es: bool = False
     delete_avro_files: bool = True
+    upload_chunk_size: int = 1024 * 1024
+    max_upload_size: int = 5 * 1024 * 1024 * 1024
+    validation_workers: int = 2
+    io_workers: int = 16
+    validation_cache_backend: str = 'disk'
+    validation_cache_dir: str = '/tmp/validation-cache'
+    validation_cache_max_size: int = 1024 * 1024 * 1024
+    validation_cache_ttl: int = 24 * 60 * 60
+    validation_job_ttl: int = 60 * 60
+    upload_session_backend: str = 'disk'
+    upload_session_dir: str = '/tmp/upload-sessions'
+    upload_session_chunk_size: int = 8 * 1024 * 1024
+    upload_session_ttl: int = 24 * 60 * 60
+    presigned_url_expiry: int = 60 * 60
+    presigned_multipart_threshold: int = 100 * 1024 * 1024
+    presigned_part_size: int = 64 * 1024 * 1024
+    s3_multipart_threshold: int = 64 * 1024 * 1024
+    s3_multipart_chunk_size: int = 16 * 1024 * 1024
+    s3_max_concurrency: int = 10
+    airflow_timeout: float = 30
+    airflow_max_connections: int = 20
+    collectory_timeout: float = 30
+    collectory_max_connections: int = 20
+    data_resource_cache_ttl: int = 5 * 60
+    data_resource_cache_size: int = 1000
+    dataset_name_cache_ttl: int = 60 * 60
+    dataset_name_cache_size: int = 10000
+    dataset_name_lookup_concurrency: int = 10
+    events_refresh_interval: int = 10
+    status_running_ttl: int = 5
+    status_cache_size: int = 10000
+    status_poll_interval: int = 5
+    status_poll_page_size: int = 100
+    status_stream_heartbeat: int = 15
+    status_batch_max_size: int = 500
+    status_batch_max_pages: int = 5
+    request_registry_path: str = '/data/publishing-service/requests.db'
+    events_idle_timeout: int = 5 * 60
+    events_page_size: int = 10
+    events_max_page_size: int = 100
+    events_max_scan_pages: int = 10
+    jwks_url: Union[str, None] = None
+    jwks_cache_ttl: int = 60 * 60
+    jwt_algorithms: List[str] = ['RS256']
+    jwt_audience: Union[str, None] = None
+    jwt_issuer: Union[str, None] = None
+    auth_user_cache_size: int = 1000
+    auth_user_cache_ttl: int = 5 * 60
+    licences_file: Union[str, None] = None
+    archive_max_uncompressed_size: int = 20 * 1024 * 1024 * 1024
+    archive_max_compression_ratio: float = 200
+    archive_max_members: int = 10000
+    validation_chunk_threshold: int = 512 * 1024 * 1024
+    validation_chunk_rows: int = 250000
 
     model_config = SettingsConfigDict(env_file="/data/publishing-service/config/.env")
 
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+from typing import Dict, Iterable, Union
+
+import httpx
+
+from util.config import AppConfig, app_config
+from util.collectory import data_resources, data_resource_names
+from util.http import HttpClients
+
+
+class DatasetNames:
+    """
+    Resolves data resource UIDs to their names in the collectory, using the cached data resource record or
+    name where there is one. Lookups for uncached UIDs are made concurrently, at most
+    dataset_name_lookup_concurrency at a time, and a UID already being looked up by another request is
+    awaited rather than requested again.
+    """
+    def __init__(self, config: AppConfig):
+        self.concurrency = config.dataset_name_lookup_concurrency
+        self.pending: Dict[str, asyncio.Future] = {}
+        self.semaphore: Union[asyncio.Semaphore, None] = None
+
+    async def resolve(self, data_resource_uids: Iterable[str], config: AppConfig,
+                      http: HttpClients) -> Dict[str, Union[str, None]]:
+        """
+        Look up the names of the supplied data resources
+        :param data_resource_uids: the UIDs, which may contain duplicates
+        :param config:
+        :param http:
+        :return: the name of each UID, or None if it could not be found
+        """
+        uids = set(data_resource_uids)
+        names = {}
+        lookups = {}
+        for uid in uids:
+            name = self._cached(uid)
+            if name is not None:
+                names[uid] = name
+            elif uid in self.pending:
+                lookups[uid] = self.pending[uid]
+            else:
+                lookups[uid] = self.pending[uid] = asyncio.ensure_future(self._lookup(uid, config, http))
+
+        if lookups:
+            # shielded, as other requests may be waiting on the same lookups
+            results = await asyncio.gather(*(asyncio.shield(lookup) for lookup in lookups.values()))
+            names.update(zip(lookups.keys(), results))
+        return names
+
+    async def _lookup(self, uid: str, config: AppConfig, http: HttpClients) -> Union[str, None]:
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        try:
+            async with self.semaphore:
+                response = await http.collectory.get(f'{config.collectory_lookup_url}/{uid}')
+            if response.status_code != 200:
+                return None
+            name = json.loads(response.content).get('name')
+            if name is not None:
+                data_resource_names.put(uid, name)
+            return name
+        except (httpx.HTTPError, ValueError) as e:
+            logging.error(f"Error looking up dataset {uid} {e}")
+            return None
+        finally:
+            self.pending.pop(uid, None)
+
+    def _cached(self, uid: str) -> Union[str, None]:
+        data_resource = data_resources.get(uid)
+        if data_resource is not None and data_resource.get('name') is not None:
+            return data_resource['name']
+        return data_resource_names.get(uid)
+
+
+dataset_names = DatasetNames(app_config)
+
+
+def get_dataset_names():
+    """
+    Get the dataset name resolver
+    :return:
+    """
+    return dataset_names
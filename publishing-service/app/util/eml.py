@@ -1,50 +1,62 @@
-from typing import Dict
+import xml.etree.ElementTree as ET
+from typing import Dict, IO, Iterator, Tuple, Union
 
+# the metadata extracted from the EML, and the path each is read from. Paths match at any depth, like .//dataset/title
+METADATA_PATHS = {
+    'name': ('dataset', 'title'),
+    'pubDescription': ('dataset', 'abstract', 'para'),
+    'licenceUrl': ('dataset', 'intellectualRights', 'para', 'ulink'),
+    'citation': ('additionalMetadata', 'metadata', 'gbif', 'citation', 'text'),
+    'rights': ('dataset', 'intellectualRights', 'para'),
+    'purpose': ('dataset', 'purpose', 'para'),
+    'methodStepDescription': ('dataset', 'methods', 'methodStep', 'description', 'para'),
+    'qualityControlDescription': ('dataset', 'methods', 'qualityControl', 'description', 'para')
+}
 
-def extract_metadata(eml) -> Dict:
+
+def extract_metadata(eml: Union[ET.Element, IO[bytes]]) -> Dict:
     """
-    Extract required elements from the EML
-    :param eml:
+    Extract required elements from the EML, in a single pass over the document. When streaming from a file,
+    reading stops once every element has been found.
+    :param eml: the root element of the EML, or a file to stream it from
     :return:
     """
 
-    metadata = {}
-    # Define a list of paths to elements
-    element_paths = [
-        './/dataset/title',
-        './/dataset/abstract/para',
-        './/dataset/intellectualRights/para/ulink',
-        './/additionalMetadata/metadata/gbif/citation/text',
-        './/dataset/intellectualRights/para',
-        './/dataset/purpose/para',
-        './/dataset/methods/methodStep/description/para',
-        './/dataset/methods/qualityControl/description/para'
-    ]
-
-    # Define keys for the metadata dictionary
-    metadata_keys = [
-        'name',
-        'pubDescription',
-        'licenceUrl',
-        'citation',
-        'rights',
-        'purpose',
-        'methodStepDescription',
-        'qualityControlDescription'
-    ]
-
-    # Iterate through the paths and populate the metadata dictionary
-    for key, path in zip(metadata_keys, element_paths):
-        element = eml.find(path)
-        if key == 'licenceUrl':
-            url = element.get('url') if element is not None and 'url' in element.attrib else None
-            if url:
-                # look up the legal code version of the url, and return the full URL
-                metadata[key] = url
+    found = {}
+    remaining = dict(METADATA_PATHS)
+
+    for path, element in _iter_paths(eml):
+        for key, tail in list(remaining.items()):
+            if path[-len(tail):] == tail:
+                found[key] = element.get('url') if key == 'licenceUrl' else element.text
+                del remaining[key]
+        if not remaining:
+            break
+
+    # the licence URL is only included if the first link has one
+    return {key: found.get(key) for key in METADATA_PATHS if key != 'licenceUrl' or found.get(key)}
+
+
+def _iter_paths(eml: Union[ET.Element, IO[bytes]]) -> Iterator[Tuple[Tuple[str, ...], ET.Element]]:
+    # yield each element once it is complete, with the tags from the root down to it
+    if hasattr(eml, 'tag'):
+        yield from _walk(eml, ())
+        return
+    path = []
+    for event, element in ET.iterparse(eml, events=('start', 'end')):
+        if event == 'start':
+            path.append(element.tag)
         else:
-            metadata[key] = element.text if element is not None else None
+            yield tuple(path), element
+            path.pop()
+            element.clear()
+
 
-    return metadata
+def _walk(element: ET.Element, parents: Tuple[str, ...]) -> Iterator[Tuple[Tuple[str, ...], ET.Element]]:
+    path = parents + (element.tag,)
+    for child in element:
+        yield from _walk(child, path)
+    yield path, element
 
 
 def find_partial_match(dictionary, search_string):
@@ -52,3 +64,15 @@ def find_partial_match(dictionary, search_string):
         if search_string in key:
             return key
     return None
+
+
+REQUIRED_METADATA = ['name', 'licenceUrl', 'pubDescription']
+
+
+def has_required_metadata(metadata: Dict) -> bool:
+    """
+    Check the mandatory fields are present in the extracted metadata
+    :param metadata:
+    :return:
+    """
+    return all(metadata.get(key) is not None for key in REQUIRED_METADATA)
@@ -9,17 +9,28 @@ class ErrorCode(str, Enum):
     AIRFLOW_ERROR = 'AIRFLOW_ERROR'
     AWS_CRED_EXPIRED = 'AWS_CRED_EXPIRED'
     AWS_NOT_AVAILABLE = 'AWS_NOT_AVAILABLE'
+    CORRUPT_ARCHIVE = 'CORRUPT_ARCHIVE'
     DATA_FILE_MISSING_FOUND = 'DATA_FILE_MISSING_FOUND'
     DATA_RESOURCE_NOT_FOUND = 'DATA_RESOURCE_NOT_FOUND'
+    FILE_TOO_LARGE = 'FILE_TOO_LARGE'
     FILE_UPLOAD_ERROR = 'FILE_UPLOAD_ERROR'
     INVALID_ARCHIVE = 'INVALID_ARCHIVE'
+    INVALID_CHUNK = 'INVALID_CHUNK'
+    INVALID_CURSOR = 'INVALID_CURSOR'
     INVALID_DATA_RESOURCE_UID = 'INVALID_DATA_RESOURCE_UID'
     INVALID_REQUEST_ID = 'INVALID_REQUEST_ID'
+    JOB_NOT_COMPLETE = 'JOB_NOT_COMPLETE'
+    JOB_NOT_FOUND = 'JOB_NOT_FOUND'
     MISSING_DATA_FILE = 'MISSING_DATA_FILE'
     MISSING_REQUIRED_FIELD = 'MISSING_REQUIRED_FIELD'
     NOT_AUTHORIZED = 'NOT_AUTHORIZED'
     NOT_AUTHORIZED_FOR_DATA_RESOURCE = 'NOT_AUTHORIZED_FOR_DATA_RESOURCE'
     REGISTRY_ERROR = 'REGISTRY_ERROR'
     SYSTEM_ERROR = 'SYSTEM_ERROR'
+    TOO_MANY_REQUEST_IDS = 'TOO_MANY_REQUEST_IDS'
     UNRECOGNISED_LICENCE = 'UNRECOGNISED_LICENCE'
+    UNSAFE_ARCHIVE = 'UNSAFE_ARCHIVE'
     UNSUPPORTED_CORE_TYPE = 'UNSUPPORTED_CORE_TYPE'
+    UPLOAD_INCOMPLETE = 'UPLOAD_INCOMPLETE'
+    UPLOAD_NOT_FOUND = 'UPLOAD_NOT_FOUND'
+    VALIDATION_ERROR = 'VALIDATION_ERROR'
@@ -0,0 +1,259 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Tuple, Union
+
+from util.config import AppConfig, app_config
+from util.dataset_names import DatasetNames
+from util.error_codes import ErrorCode
+from util.http import HttpClients
+from util.registry import INGEST, DELETE
+from util.responses import ErrorResponse
+from util.status import list_dag_runs
+
+
+@dataclass
+class EventsQuery:
+    """
+    A page of the events feed. The filters on DAG, state and start date are passed to airflow, the filters on
+    user and data resource are applied to the runs airflow returns, as they are only recorded in the run's conf.
+    """
+    limit: int
+    cursor: Union[str, None] = None
+    action: Union[str, None] = None
+    states: Union[List[str], None] = None
+    started_from: Union[datetime, None] = None
+    started_to: Union[datetime, None] = None
+    user_id: Union[str, None] = None
+    data_resource_uid: Union[str, None] = None
+
+    def is_default(self, config: AppConfig) -> bool:
+        return self == EventsQuery(limit=config.events_page_size)
+
+    def post_filtered(self) -> bool:
+        return self.user_id is not None or self.data_resource_uid is not None
+
+
+@dataclass
+class EventsPage:
+    events: List[Dict]
+    next_cursor: Union[str, None] = None
+
+
+class InvalidCursorException(Exception):
+    pass
+
+
+def encode_cursor(before: str, offset: int) -> str:
+    """
+    Encode the position after a page of events. Runs are listed up to the execution date of the newest run when
+    the first page was loaded, so the offset into them isn't shifted by runs started since.
+    :param before: execution date of the newest run listed
+    :param offset: number of runs already scanned
+    :return:
+    """
+    return base64.urlsafe_b64encode(json.dumps({"before": before, "offset": offset}).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        before, offset = position['before'], position['offset']
+    except (ValueError, TypeError, KeyError) as e:
+        raise InvalidCursorException(f'Invalid cursor {cursor}') from e
+    if not isinstance(before, str) or not isinstance(offset, int) or offset < 0:
+        raise InvalidCursorException(f'Invalid cursor {cursor}')
+    return before, offset
+
+
+def _dataset_ids(run: Dict) -> List[str]:
+    conf = run.get('conf') or {}
+    return list(filter(None, conf.get('datasetIds', "").strip().split(" ")))
+
+
+def _matches(run: Dict, query: EventsQuery) -> bool:
+    conf = run.get('conf') or {}
+    if query.user_id is not None and conf.get('userid') != query.user_id:
+        return False
+    return query.data_resource_uid is None or query.data_resource_uid in _dataset_ids(run)
+
+
+async def load_events(query: EventsQuery, config: AppConfig, http: HttpClients,
+                      dataset_names: DatasetNames) -> Union[EventsPage, ErrorResponse]:
+    """
+    Get a page of the publishing and un-publishing events from airflow, most recent first, with the names of
+    their datasets. Airflow is paged through until the page is filled, the runs run out or events_max_scan_pages
+    pages have been scanned, so a page filtered by user or data resource may be short but still have a cursor.
+    :param query: the page to load
+    :param config:
+    :param http:
+    :param dataset_names:
+    :return:
+    """
+    before, offset = decode_cursor(query.cursor) if query.cursor else (None, 0)
+    dag_ids = {INGEST: [config.ingest_dag], DELETE: [config.delete_dag]}.get(query.action)
+    filters = {}
+    if query.started_from is not None:
+        filters['start_date_gte'] = query.started_from.isoformat()
+    if query.started_to is not None:
+        filters['start_date_lte'] = query.started_to.isoformat()
+    # when filtering on the conf, scan airflow in full pages rather than a page per event wanted
+    page_size = config.events_max_page_size if query.post_filtered() else query.limit
+
+    runs = []
+    exhausted = False
+    for _ in range(config.events_max_scan_pages):
+        if before is not None:
+            filters['execution_date_lte'] = before
+        dag_list = await list_dag_runs(config, http, offset, page_size, query.states, dag_ids, **filters)
+        if dag_list is None:
+            return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message='Unable to access airflow')
+
+        page = dag_list['dag_runs']
+        if before is None and page:
+            before = page[0]['execution_date']
+        for run in page:
+            offset += 1
+            if _matches(run, query):
+                runs.append(run)
+                if len(runs) == query.limit:
+                    break
+        if not page or offset >= dag_list['total_entries']:
+            exhausted = True
+            break
+        if len(runs) == query.limit:
+            break
+
+    # resolve the names of every dataset across all the runs together
+    run_dataset_ids = [_dataset_ids(run) for run in runs]
+    names = await dataset_names.resolve([uid for ids in run_dataset_ids for uid in ids], config, http)
+    actions = {config.ingest_dag: INGEST, config.delete_dag: DELETE}
+
+    mapped_data = []
+
+    for item, dataset_ids in zip(runs, run_dataset_ids):
+
+        datasets = []
+        for dataset_id in dataset_ids:
+            if names.get(dataset_id) is not None:
+                datasets.append({"datasetId": dataset_id, "datasetName": names[dataset_id]})
+            else:
+                datasets.append({"datasetId": dataset_id})
+
+        conf = item.get('conf') or {}
+        user_display_name = ""
+
+        if conf.get('userDisplayName') is not None:
+            user_display_name = conf.get('userDisplayName')
+
+        # Add the mapped dictionary to the new array
+        mapped_data.append(
+            {
+                "id": item['dag_run_id'],
+                "action": actions.get(item.get('dag_id')),
+                "user": user_display_name,
+                "datasets": datasets,
+                "state": item['state'],
+                "start_date": item['start_date'],
+                "end_date": item['end_date']
+            }
+        )
+    return EventsPage(events=mapped_data, next_cursor=None if exhausted else encode_cursor(before, offset))
+
+
+class EventsFeed:
+    """
+    In-memory copy of the first page of the events feed, refreshed by a single background task every
+    events_refresh_interval seconds, so upstream load doesn't grow with the number of clients polling /events.
+    Requests are served the last good copy, which is kept if a refresh fails. Refreshes stop once the feed hasn't
+    been requested for events_idle_timeout seconds; the next request is then served the stale copy while a refresh
+    runs. Later pages and filtered pages are loaded from airflow on request.
+    """
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.interval = config.events_refresh_interval
+        self.idle_timeout = config.events_idle_timeout
+        self.events: Union[EventsPage, None] = None
+        self.refreshed: Union[float, None] = None
+        self.last_request = 0.0
+        self.refreshing: Union[asyncio.Task, None] = None
+        self.task: Union[asyncio.Task, None] = None
+        self.http: Union[HttpClients, None] = None
+        self.dataset_names: Union[DatasetNames, None] = None
+
+    def start(self, http: HttpClients, dataset_names: DatasetNames):
+        self.http = http
+        self.dataset_names = dataset_names
+        self.task = asyncio.create_task(self._run())
+
+    def shutdown(self):
+        for task in (self.task, self.refreshing):
+            if task:
+                task.cancel()
+
+    async def get(self, query: Union[EventsQuery, None] = None) -> Union[EventsPage, ErrorResponse]:
+        """
+        Get a page of the events feed. Only the first request for the first page, before the feed has been
+        loaded, waits for airflow.
+        :param query: the page to get, the first unfiltered page if not supplied
+        :return:
+        """
+        if query is not None and not query.is_default(self.config):
+            return await load_events(query, self.config, self.http, self.dataset_names)
+        self.last_request = time.monotonic()
+        if self.events is None:
+            return await asyncio.shield(self.refresh())
+        if self._stale():
+            self.refresh()
+        return self.events
+
+    def refresh(self) -> asyncio.Task:
+        """
+        Start a refresh of the feed, unless one is already running
+        :return: the refresh task
+        """
+        if self.refreshing is None:
+            self.refreshing = asyncio.create_task(self._refresh())
+        return self.refreshing
+
+    async def _refresh(self) -> Union[EventsPage, ErrorResponse]:
+        try:
+            events = await load_events(EventsQuery(limit=self.config.events_page_size), self.config, self.http,
+                                       self.dataset_names)
+            if isinstance(events, ErrorResponse):
+                return events if self.events is None else self.events
+            self.events = events
+            self.refreshed = time.monotonic()
+            return events
+        except Exception as e:
+            logging.error(f"Error refreshing events {e}", exc_info=True)
+            if self.events is None:
+                return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message='Unable to access airflow')
+            return self.events
+        finally:
+            self.refreshing = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            if time.monotonic() - self.last_request <= self.idle_timeout:
+                await self.refresh()
+
+    def _stale(self) -> bool:
+        # while the feed is being watched the background task keeps it fresh, this only catches an idle feed
+        return self.refreshed is None or time.monotonic() - self.refreshed > 2 * self.interval
+
+
+events_feed = EventsFeed(app_config)
+
+
+def get_events_feed():
+    """
+    Get the events feed
+    :return:
+    """
+    return events_feed
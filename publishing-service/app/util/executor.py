@@ -0,0 +1,127 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Dict
+
+from util.config import AppConfig, app_config
+from util.validation import init_worker
+
+
+class WorkerFailedException(Exception):
+    """
+    Raised when a validation worker process dies while running a task, e.g. it is killed for running out of memory
+    """
+    pass
+
+
+class PoolStats:
+    """
+    Counters for a worker pool. Pools run tasks in submission order, so any task beyond the
+    number of workers is waiting in the queue.
+    """
+    def __init__(self, workers: int):
+        self.workers = workers
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+
+    def in_flight(self) -> int:
+        return self.submitted - self.completed - self.failed
+
+    def to_dict(self) -> Dict:
+        in_flight = self.in_flight()
+        active = min(in_flight, self.workers)
+        return {
+            "workers": self.workers,
+            "active": active,
+            "queueDepth": in_flight - active,
+            "utilisation": active / self.workers if self.workers else 0,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed
+        }
+
+
+class ValidationExecutor:
+    """
+    Runs blocking work off the event loop. CPU bound archive parsing, validation and map rendering
+    is run in a process pool, blocking I/O (S3, registry and airflow calls) in a thread pool.
+    """
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.process_pool = self._create_process_pool()
+        self.process_pool_lock = threading.Lock()
+        self.thread_pool = ThreadPoolExecutor(max_workers=config.io_workers, thread_name_prefix='io')
+        self.cpu_stats = PoolStats(config.validation_workers)
+        self.io_stats = PoolStats(config.io_workers)
+
+    async def run_cpu(self, fn: Callable, *args, **kwargs):
+        """
+        Run a CPU bound function in the process pool. The function and its arguments must be picklable.
+        If a worker dies the pool can't run any more tasks, so it is replaced, and the task fails.
+        :raises WorkerFailedException: if a worker died while the task was queued or running
+        """
+        pool = self.process_pool
+        try:
+            return await self._run(pool, self.cpu_stats, fn, *args, **kwargs)
+        except BrokenProcessPool as e:
+            logging.error(f"Validation worker died, replacing the process pool: {e}")
+            self._replace_process_pool(pool)
+            raise WorkerFailedException('The validation worker stopped unexpectedly, please try again') from e
+
+    async def run_io(self, fn: Callable, *args, **kwargs):
+        """
+        Run a blocking I/O function in the thread pool
+        """
+        return await self._run(self.thread_pool, self.io_stats, fn, *args, **kwargs)
+
+    async def _run(self, pool: Executor, stats: PoolStats, fn: Callable, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        stats.submitted += 1
+        try:
+            result = await loop.run_in_executor(pool, functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            stats.failed += 1
+            raise
+        stats.completed += 1
+        return result
+
+    def _create_process_pool(self) -> ProcessPoolExecutor:
+        # spawn rather than fork, as the parent process is multithreaded
+        return ProcessPoolExecutor(max_workers=self.config.validation_workers,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_worker, initargs=(self.config,))
+
+    def _replace_process_pool(self, broken: Executor):
+        # every task in the broken pool fails, so only the first to fail replaces it
+        with self.process_pool_lock:
+            if self.process_pool is broken:
+                self.process_pool = self._create_process_pool()
+                broken.shutdown(wait=False)
+
+    def stats(self) -> Dict:
+        return {
+            "validation": self.cpu_stats.to_dict(),
+            "io": self.io_stats.to_dict()
+        }
+
+    def shutdown(self):
+        logging.info("Shutting down validation executor")
+        self.process_pool.shutdown(wait=True)
+        self.thread_pool.shutdown(wait=True)
+
+
+# Worker processes are only started on first use
+validation_executor = ValidationExecutor(app_config)
+
+
+def get_validation_executor():
+    """
+    Get the validation executor
+    :return:
+    """
+    return validation_executor
@@ -0,0 +1,49 @@
+from typing import Union
+
+import httpx
+
+from util.config import AppConfig, app_config
+
+
+class HttpClients:
+    """
+    Pooled async HTTP clients for the upstream services, one per upstream so each has its own timeout
+    and connection limit. Connections are kept alive between requests, and once the connection limit
+    is reached further requests wait for a free connection. The clients are opened at application
+    startup and closed at shutdown.
+    """
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.airflow: Union[httpx.AsyncClient, None] = None
+        self.collectory: Union[httpx.AsyncClient, None] = None
+
+    def start(self):
+        config = self.config
+        self.airflow = httpx.AsyncClient(
+            auth=httpx.BasicAuth(config.airflow_username, config.airflow_password),
+            headers={'Content-Type': 'application/json'},
+            timeout=httpx.Timeout(config.airflow_timeout),
+            limits=httpx.Limits(max_connections=config.airflow_max_connections,
+                                max_keepalive_connections=config.airflow_max_connections))
+        self.collectory = httpx.AsyncClient(
+            timeout=httpx.Timeout(config.collectory_timeout),
+            limits=httpx.Limits(max_connections=config.collectory_max_connections,
+                                max_keepalive_connections=config.collectory_max_connections))
+
+    async def close(self):
+        for client in (self.airflow, self.collectory):
+            if client:
+                await client.aclose()
+        self.airflow = None
+        self.collectory = None
+
+
+http_clients = HttpClients(app_config)
+
+
+def get_http_clients():
+    """
+    Get the upstream HTTP clients
+    :return:
+    """
+    return http_clients
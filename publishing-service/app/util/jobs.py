@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Dict, Union
+
+from util.config import AppConfig, app_config
+from util.responses import ErrorResponse, ValidationJob, ValidationResponse
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCESS = 'success'
+FAILED = 'failed'
+
+
+class Job:
+    """
+    A validation running in the background
+    """
+    def __init__(self, job_id: str, user_id: str):
+        self.job_id = job_id
+        self.user_id = user_id
+        self.state = QUEUED
+        self.progress = 'Archive received'
+        self.created = time.time()
+        self.finished: Union[float, None] = None
+        self.result: Union[ValidationResponse, ErrorResponse, None] = None
+        self.task: Union[asyncio.Task, None] = None
+
+    def set_progress(self, progress: str):
+        self.progress = progress
+
+    def to_response(self) -> ValidationJob:
+        return ValidationJob(
+            jobID=self.job_id,
+            state=self.state,
+            progress=self.progress,
+            created=_isoformat(self.created),
+            finished=_isoformat(self.finished) if self.finished else None,
+            statusUrl=f"/validate/jobs/{self.job_id}",
+            resultUrl=f"/validate/jobs/{self.job_id}/result"
+        )
+
+
+class ValidationJobs:
+    """
+    In-memory registry of background validation jobs. Finished jobs are kept for validation_job_ttl seconds.
+    """
+    def __init__(self, config: AppConfig):
+        self.ttl = config.validation_job_ttl
+        self.jobs: Dict[str, Job] = {}
+
+    def create(self, job_id: str, user_id: str) -> Job:
+        self.expire()
+        job = Job(job_id, user_id)
+        self.jobs[job_id] = job
+        return job
+
+    def get(self, job_id: str) -> Union[Job, None]:
+        return self.jobs.get(job_id)
+
+    def start(self, job: Job, validation: Awaitable):
+        """
+        Run the validation coroutine in the background, recording its result against the job
+        """
+        job.task = asyncio.create_task(self._run(job, validation))
+
+    async def _run(self, job: Job, validation: Awaitable):
+        job.state = RUNNING
+        try:
+            job.result = await validation
+            job.state = FAILED if isinstance(job.result, ErrorResponse) else SUCCESS
+            job.progress = 'Complete'
+        except Exception as e:
+            logging.error(f"Error with validation job {job.job_id} {e}", exc_info=True)
+            job.result = ErrorResponse(error='SYSTEM_ERROR', message=f'Error: {str(e)}')
+            job.state = FAILED
+            job.progress = 'Failed'
+        finally:
+            job.finished = time.time()
+            job.task = None
+
+    def expire(self):
+        now = time.time()
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished and now - job.finished > self.ttl]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            if job.task:
+                job.task.cancel()
+
+
+def _isoformat(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp, tz=timezone.utc).isoformat()
+
+
+validation_jobs = ValidationJobs(app_config)
+
+
+def get_validation_jobs():
+    """
+    Get the validation job registry
+    :return:
+    """
+    return validation_jobs
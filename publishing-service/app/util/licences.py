@@ -0,0 +1,111 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Union
+from urllib.parse import urlparse
+
+from util.config import AppConfig, app_config
+
+DEFAULT_LICENCES_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'licences.json')
+
+# the legal code and deed pages of a licence, in any language or format, e.g. legalcode.de, deed.en, legalcode.txt
+LEGAL_CODE_PAGE = re.compile(r'(legalcode|deed)(\.[a-z]{2,3}([-_][a-z0-9]+)?)?(\.(html?|txt))?')
+
+
+@dataclass
+class Licence:
+    key: str
+    url: str
+    acronym: str
+    version: str
+    name: str
+    aliases: List[str] = field(default_factory=list)
+
+    def to_dict(self) -> Dict:
+        licence = {'url': self.url, 'acronym': self.acronym, 'version': self.version, 'name': self.name}
+        if self.aliases:
+            licence['aliases'] = self.aliases
+        return licence
+
+
+def normalise_licence_url(url: str) -> str:
+    """
+    Reduce a licence URL to the part that identifies the licence, ignoring the scheme, www, trailing slashes,
+    query and the legal code or deed page, so https://www.creativecommons.org/licenses/by/4.0/legalcode.en and
+    http://creativecommons.org/licenses/by/4.0/ are the same licence. Jurisdiction ports, e.g. by/4.0/au, are kept.
+    :param url:
+    :return:
+    """
+    url = url.strip().lower()
+    parsed = urlparse(url if '://' in url else f'//{url}')
+    host = parsed.netloc[4:] if parsed.netloc.startswith('www.') else parsed.netloc
+    segments = [segment for segment in parsed.path.split('/') if segment]
+    if segments and LEGAL_CODE_PAGE.fullmatch(segments[-1]):
+        segments.pop()
+    return '/'.join([host] + segments)
+
+
+class LicenceRegistry:
+    """
+    The recognised licences, loaded at startup from data/licences.json and then from licences_file if configured,
+    which adds licences or replaces those with the same key. Licences are indexed by their normalised URL and
+    aliases, and the /licences response and its ETag are computed once on loading.
+    """
+    def __init__(self, config: AppConfig):
+        self.licences: Dict[str, Licence] = {}
+        self.index: Dict[str, Licence] = {}
+        self.body = b'{}'
+        self.etag = ''
+        self.load(config)
+
+    def load(self, config: AppConfig):
+        licences = self._read(DEFAULT_LICENCES_FILE)
+        if config.licences_file:
+            licences.update(self._read(config.licences_file))
+
+        index = {}
+        for licence in licences.values():
+            for url in [licence.url] + licence.aliases:
+                normalised = normalise_licence_url(url)
+                if normalised in index and index[normalised].key != licence.key:
+                    logging.warning(f"Licence {licence.key} URL {url} replaces {index[normalised].key}")
+                index[normalised] = licence
+
+        self.licences = licences
+        self.index = index
+        self.body = json.dumps({key: licence.to_dict() for key, licence in licences.items()}).encode()
+        self.etag = f'"{hashlib.sha256(self.body).hexdigest()[:32]}"'
+        logging.info(f"Loaded {len(licences)} licences")
+
+    def get(self, licence_url: Union[str, None]) -> Union[Licence, None]:
+        """
+        Get the licence with the supplied URL
+        :param licence_url:
+        :return: the licence, or None if it isn't recognised
+        """
+        if not licence_url:
+            return None
+        return self.index.get(normalise_licence_url(licence_url))
+
+    @staticmethod
+    def _read(path: str) -> Dict[str, Licence]:
+        with open(path) as licences_file:
+            return {key: Licence(key=key, **value) for key, value in json.load(licences_file).items()}
+
+
+licence_registry = LicenceRegistry(app_config)
+
+
+def get_licence_registry():
+    """
+    Get the licence registry
+    :return:
+    """
+    return licence_registry
+
+
+def get_licence(licence_url: Union[str, None]) -> Union[Licence, None]:
+    return licence_registry.get(licence_url)
@@ -1,17 +1,45 @@
+import functools
 import logging
 import warnings
+from dataclasses import dataclass
+from typing import Iterable, Tuple
 
 from dwc_validator.exceptions import CoordinatesException
 import geopandas as gpd
-import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
 import base64
 from io import BytesIO
+from matplotlib import colormaps
+from matplotlib import image as mpimg
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from shapely.errors import ShapelyDeprecationWarning
 
 from util.config import AppConfig
 
 warnings.filterwarnings("ignore", category=ShapelyDeprecationWarning)
 
+MAP_SIZE_INCHES = 15
+MAP_DPI = 100
+# matplotlib marker size 20 (points^2) at 100 dpi
+MARKER_RADIUS_PIXELS = 3
+MARKER_COLOUR = (196, 77, 52, 255)  # '#c44d34'
+DENSITY_COLOUR_MAP = 'YlOrRd'
+DENSITY_ALPHA = 0.8
+
+
+@dataclass
+class Basemap:
+    """
+    A rasterised basemap, with the extent in decimal degrees it covers
+    """
+    pixels: np.ndarray
+    min_latitude: float
+    max_latitude: float
+    min_longitude: float
+    max_longitude: float
+
 
 def generate_preview_map(dataframe, config: AppConfig, latitude_col='decimalLatitude', longitude_col='decimalLongitude') -> str:
     """
@@ -22,30 +50,53 @@ def generate_preview_map(dataframe, config: AppConfig, latitude_col='decimalLati
     :param longitude_col: Name of the longitude column
     :return: base64 encoded map image
     """
+    return generate_chunked_preview_map([dataframe], config, latitude_col, longitude_col)
 
-    try:
-        if latitude_col not in dataframe.columns or longitude_col not in dataframe.columns:
-            # Plot a world map
-            world_data = gpd.read_file(gpd.datasets.get_path(config.geopandas_dataset))
-            world_data = world_data.to_crs(epsg=4326)
 
-            plot_map(world_data, config)
-        else:
-            # Plot the world map with data points
-            df_geo = gpd.GeoDataFrame(dataframe, geometry=gpd.points_from_xy(dataframe[longitude_col], dataframe[latitude_col]))
+def generate_chunked_preview_map(dataframes: Iterable[pd.DataFrame], config: AppConfig, latitude_col='decimalLatitude',
+                                 longitude_col='decimalLongitude') -> str:
+    """
+    Generate a map preview of the supplied chunks of a dataset. The marked pixels and cell counts are accumulated a
+    chunk at a time, so only one chunk of coordinates is held in memory.
+    :param dataframes: Pandas DataFrames containing geographical data
+    :param config:
+    :param latitude_col: Name of the latitude column
+    :param longitude_col: Name of the longitude column
+    :return: base64 encoded map image
+    """
 
-            world_data = gpd.read_file(gpd.datasets.get_path(config.geopandas_dataset))
-            world_data = world_data.to_crs(epsg=4326)
+    try:
+        basemap = get_basemap(config)
+        pixels = basemap.pixels.copy()
+        height, width = pixels.shape[:2]
+        cell_size = config.map_density_cell_size
+        hits = np.zeros((height, width), dtype=bool)
+        counts = np.zeros((-(-height // cell_size), -(-width // cell_size)), dtype=np.int64)
+        total = 0
+
+        for dataframe in dataframes:
+            if latitude_col in dataframe.columns and longitude_col in dataframe.columns:
+                latitudes = pd.to_numeric(dataframe[latitude_col]).to_numpy(dtype=float)
+                longitudes = pd.to_numeric(dataframe[longitude_col]).to_numpy(dtype=float)
+                rows, columns = to_pixel_coordinates(basemap, latitudes, longitudes)
+                hits[rows, columns] = True
+                counts += count_cells(rows, columns, counts.shape, cell_size)
+                total += len(latitudes)
 
-            plot_map(world_data, config)
-            df_geo.plot(ax=plt.gca(), markersize=20, color='#c44d34', marker='o', label='Occurrence')
+        # Plot the data points on the world map
+        if total > config.map_density_threshold:
+            draw_cell_counts(pixels, counts, cell_size)
+        elif total > 0:
+            draw_markers(pixels, hits)
 
-        # Save the plot to a BytesIO buffer and encode as base64
+        # Save the image to a BytesIO buffer and encode as base64
         buffer = BytesIO()
-        plt.savefig(buffer, format='png', dpi=100, transparent=True, bbox_inches='tight', pad_inches=0)
+        mpimg.imsave(buffer, pixels, format='png')
         buffer.seek(0)
         return base64.b64encode(buffer.read()).decode()
 
+    except CoordinatesException:
+        raise
     except ValueError as e:
         logging.error(f"Error generating map: {e}")
         raise CoordinatesException("Invalid coordinates supplied. Please check the values in the provided latitude and longitude columns.")
@@ -54,11 +105,120 @@ def generate_preview_map(dataframe, config: AppConfig, latitude_col='decimalLati
         raise CoordinatesException("An error occurred while generating the map.")
 
 
-def plot_map(world_data, config: AppConfig):
-    # Plot the world map
-    axis = world_data.plot(figsize=(15, 15), color='white', edgecolor='black')
+def get_basemap(config: AppConfig) -> Basemap:
+    """
+    Get the rasterised basemap for the configured extent. This is rendered once per process.
+    :param config:
+    :return:
+    """
+    return render_basemap(config.geopandas_dataset, config.default_min_latitude, config.default_max_latitude,
+                          config.default_min_longitude, config.default_max_longitude)
+
+
+@functools.lru_cache(maxsize=4)
+def render_basemap(dataset: str, min_latitude: float, max_latitude: float, min_longitude: float,
+                   max_longitude: float) -> Basemap:
+    """
+    Rasterise the world map for the supplied extent
+    :return: the basemap, cropped to the map axes
+    """
+    logging.info(f"Rendering basemap {dataset}")
+    world_data = gpd.read_file(gpd.datasets.get_path(dataset))
+    world_data = world_data.to_crs(epsg=4326)
+
+    figure = Figure(figsize=(MAP_SIZE_INCHES, MAP_SIZE_INCHES), dpi=MAP_DPI)
+    figure.patch.set_alpha(0)
+    canvas = FigureCanvasAgg(figure)
+    axis = figure.add_axes([0, 0, 1, 1])
+    world_data.plot(ax=axis, color='white', edgecolor='black')
 
     # Set axis limits and turn off axis
-    axis.set_ylim(config.default_min_latitude, config.default_max_latitude)
-    axis.set_xlim(config.default_min_longitude, config.default_max_longitude)
+    axis.set_ylim(min_latitude, max_latitude)
+    axis.set_xlim(min_longitude, max_longitude)
     axis.set_axis_off()
+    canvas.draw()
+
+    # crop the figure to the map itself, the raster origin is top left
+    pixels = np.asarray(canvas.buffer_rgba())
+    extent = axis.get_window_extent()
+    height = pixels.shape[0]
+    top, bottom = int(round(height - extent.y1)), int(round(height - extent.y0))
+    left, right = int(round(extent.x0)), int(round(extent.x1))
+    pixels = np.array(pixels[top:bottom, left:right], dtype=np.uint8)
+    pixels.setflags(write=False)
+
+    return Basemap(pixels=pixels, min_latitude=min_latitude, max_latitude=max_latitude,
+                   min_longitude=min_longitude, max_longitude=max_longitude)
+
+
+def to_pixel_coordinates(basemap: Basemap, latitudes: np.ndarray, longitudes: np.ndarray):
+    """
+    Project coordinates onto the basemap raster, dropping any outside the map or not finite
+    :return: the rows and columns of the pixels
+    """
+    height, width = basemap.pixels.shape[:2]
+    in_extent = (np.isfinite(latitudes) & np.isfinite(longitudes)
+                 & (latitudes >= basemap.min_latitude) & (latitudes <= basemap.max_latitude)
+                 & (longitudes >= basemap.min_longitude) & (longitudes <= basemap.max_longitude))
+    latitudes = latitudes[in_extent]
+    longitudes = longitudes[in_extent]
+
+    rows = (basemap.max_latitude - latitudes) / (basemap.max_latitude - basemap.min_latitude) * (height - 1)
+    columns = (longitudes - basemap.min_longitude) / (basemap.max_longitude - basemap.min_longitude) * (width - 1)
+    return rows.round().astype(np.intp), columns.round().astype(np.intp)
+
+
+def draw_markers(pixels: np.ndarray, hits: np.ndarray):
+    """
+    Draw an occurrence marker at each marked pixel onto the supplied copy of the basemap
+    """
+    height, width = pixels.shape[:2]
+
+    # grow the mark of each point to a disc
+    markers = np.zeros_like(hits)
+    radius = MARKER_RADIUS_PIXELS
+    for dy in range(-radius, radius + 1):
+        for dx in range(-radius, radius + 1):
+            if dx * dx + dy * dy > radius * radius:
+                continue
+            markers[max(dy, 0):height + min(dy, 0), max(dx, 0):width + min(dx, 0)] |= \
+                hits[max(-dy, 0):height + min(-dy, 0), max(-dx, 0):width + min(-dx, 0)]
+
+    pixels[markers] = MARKER_COLOUR
+
+
+def count_cells(rows: np.ndarray, columns: np.ndarray, grid_shape: Tuple[int, int], cell_size: int) -> np.ndarray:
+    """
+    Count the points in each square cell of the grid over the basemap raster
+    :return: the counts, with the grid's shape
+    """
+    grid_rows, grid_columns = grid_shape
+    cells = (rows // cell_size) * grid_columns + columns // cell_size
+    return np.bincount(cells, minlength=grid_rows * grid_columns).reshape(grid_rows, grid_columns)
+
+
+def draw_cell_counts(pixels: np.ndarray, counts: np.ndarray, cell_size: int):
+    """
+    Draw the density of the points onto the supplied copy of the basemap, from their counts in a grid of
+    square cells. Used for large datasets where individual markers would be slow to draw and unreadable.
+    """
+    height, width = pixels.shape[:2]
+    if not counts.any():
+        return
+
+    # colour the cells on a log scale, then scale the grid up to the raster
+    levels = np.log1p(counts) / np.log1p(counts.max())
+    colours = colormaps[DENSITY_COLOUR_MAP](levels, bytes=True)
+    row_cells = np.arange(height) // cell_size
+    column_cells = np.arange(width) // cell_size
+    occupied = (counts > 0)[np.ix_(row_cells, column_cells)]
+    overlay = colours[np.ix_(row_cells, column_cells)][occupied].astype(np.float32)
+
+    # alpha blend the occupied cells over the basemap
+    base = pixels[occupied].astype(np.float32)
+    base_alpha = base[:, 3:] / 255
+    alpha = DENSITY_ALPHA + base_alpha * (1 - DENSITY_ALPHA)
+    blended = np.empty_like(base)
+    blended[:, :3] = (overlay[:, :3] * DENSITY_ALPHA + base[:, :3] * base_alpha * (1 - DENSITY_ALPHA)) / alpha
+    blended[:, 3:] = alpha * 255
+    pixels[occupied] = blended.round().astype(np.uint8)
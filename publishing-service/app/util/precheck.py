@@ -0,0 +1,81 @@
+import logging
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import List, Union
+
+from util.config import AppConfig
+from util.eml import extract_metadata, has_required_metadata
+from util.error_codes import ErrorCode
+from util.licences import get_licence
+from util.responses import ErrorResponse
+from util.validation import SUPPORTED_CORE_TYPES
+from util.zip_safety import check_zip_limits, UnsafeArchiveException
+
+META_FILE = 'meta.xml'
+DEFAULT_EML_FILE = 'eml.xml'
+
+
+def precheck_archive(temp_file_path: str, config: AppConfig) -> Union[ErrorResponse, None]:
+    """
+    Check a darwin core archive can be published before validating it, reading only the zip's central directory,
+    meta.xml and eml.xml. Rejects archives exceeding the zip limits, with an unsupported core type, a missing data
+    file, missing mandatory EML fields or an unrecognised licence, without reading any of the data. Files that aren't
+    zips are left to full validation.
+    :param temp_file_path: path to the archive
+    :param config:
+    :return: the reason the archive can't be published, or None if it passes
+    """
+    if not zipfile.is_zipfile(temp_file_path):
+        return None
+
+    try:
+        with zipfile.ZipFile(temp_file_path) as archive:
+            check_zip_limits(archive, os.path.getsize(temp_file_path), config)
+            names = set(archive.namelist())
+            root = _archive_root(archive.namelist())
+            eml_file = DEFAULT_EML_FILE
+
+            meta_path = posixpath.join(root, META_FILE)
+            if meta_path in names:
+                with archive.open(meta_path) as meta_file:
+                    meta = ET.parse(meta_file).getroot()
+                core = meta.find('{*}core')
+                if core is None or core.get('rowType') not in SUPPORTED_CORE_TYPES:
+                    core_type = core.get('rowType') if core is not None else None
+                    return ErrorResponse(error=ErrorCode.UNSUPPORTED_CORE_TYPE, message=f'The core type {core_type} is not supported')
+                for location in meta.iterfind('.//{*}files/{*}location'):
+                    if posixpath.join(root, (location.text or '').strip()) not in names:
+                        return ErrorResponse(error=ErrorCode.DATA_FILE_MISSING_FOUND,
+                                             message=f'The data file {location.text} listed in meta.xml is missing from the archive')
+                eml_file = meta.get('metadata') or DEFAULT_EML_FILE
+
+            eml_path = posixpath.join(root, eml_file)
+            if eml_path not in names:
+                return ErrorResponse(error=ErrorCode.MISSING_REQUIRED_FIELD,
+                                     message=f"Missing {eml_file}. name, licenceUrl and description must be present in EML to pass validation")
+            with archive.open(eml_path) as eml:
+                metadata = extract_metadata(eml)
+    except UnsafeArchiveException as e:
+        logging.info(f"Archive {temp_file_path} failed pre-check {e}")
+        return ErrorResponse(error=ErrorCode.UNSAFE_ARCHIVE, message=e.args[0])
+    except (zipfile.BadZipFile, ET.ParseError, OSError) as e:
+        logging.info(f"Archive {temp_file_path} failed pre-check {e}")
+        return ErrorResponse(error=ErrorCode.INVALID_ARCHIVE, message=f'Unable to read the archive metadata: {e}')
+
+    if not has_required_metadata(metadata):
+        return ErrorResponse(error=ErrorCode.MISSING_REQUIRED_FIELD,
+                             message="Missing required fields. name, licenceUrl and description must be present in EML to pass validation")
+    if get_licence(metadata['licenceUrl']) is None:
+        return ErrorResponse(error=ErrorCode.UNRECOGNISED_LICENCE, message=f"Unrecognised licence {metadata['licenceUrl']}. Check /licences for a list of recognised licences")
+    return None
+
+
+def _archive_root(names: List[str]) -> str:
+    # archives are read from their root, or from the single directory they contain
+    if META_FILE in names or DEFAULT_EML_FILE in names:
+        return ''
+    directories = {name.split('/', 1)[0] for name in names if '/' in name}
+    files = [name for name in names if '/' not in name]
+    return directories.pop() if len(directories) == 1 and not files else ''
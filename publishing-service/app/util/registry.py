@@ -0,0 +1,193 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Union
+
+from util.auth import User
+from util.config import AppConfig, app_config
+
+INGEST = 'ingest'
+DELETE = 'delete'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS requests (
+    request_id TEXT PRIMARY KEY,
+    dag_id TEXT,
+    action TEXT,
+    user_id TEXT NOT NULL,
+    user_name TEXT,
+    data_resource_uids TEXT,
+    dataset_name TEXT,
+    validation TEXT,
+    created REAL NOT NULL,
+    started REAL
+);
+CREATE INDEX IF NOT EXISTS requests_user ON requests (user_id, started);
+'''
+
+
+@dataclass
+class RequestRecord:
+    request_id: str
+    dag_id: Union[str, None]
+    action: Union[str, None]
+    user_id: str
+    user_name: Union[str, None]
+    data_resource_uids: List[str]
+    dataset_name: Union[str, None]
+    validation: Union[Dict, None]
+    created: float
+    started: Union[float, None]
+
+
+class RequestRegistry:
+    """
+    Local record of the requests made through this service, kept in a SQLite database at request_registry_path.
+    Validations stored for later publishing are recorded against their request ID, and the DAG run started
+    to publish or un-publish is recorded against the same ID, so statuses can be looked up on the right DAG
+    and a user's requests listed without going to airflow. Calls block on a local file, so are made on the I/O
+    pool with executor.run_io. A request belongs to the user who made it, and another user's calls can't update
+    it. The registry is an index rather than the record of truth, so database errors are logged rather than failing
+    the request.
+    """
+    def __init__(self, config: AppConfig):
+        self.path = config.request_registry_path
+        self.lock = threading.Lock()
+        self.connection: Union[sqlite3.Connection, None] = None
+
+    def record_validation(self, request_id: str, user: User, validation: Dict):
+        """
+        Record the validation of an archive stored for later publishing
+        :param request_id:
+        :param user:
+        :param validation: summary of the validation
+        :return:
+        """
+        self._execute('''
+            INSERT INTO requests (request_id, user_id, user_name, validation, created) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (request_id) DO UPDATE SET validation = excluded.validation
+            WHERE requests.user_id = excluded.user_id
+        ''', (request_id, user.id, user.name, json.dumps(validation), time.time()))
+
+    def record_run(self, request_id: str, dag_id: str, action: str, user: User, data_resource_uids: List[str],
+                   dataset_name: str, validation: Union[Dict, None] = None):
+        """
+        Record the DAG run started for a request, keeping any validation already recorded
+        :param request_id: the DAG run ID
+        :param dag_id:
+        :param action: INGEST or DELETE
+        :param user:
+        :param data_resource_uids:
+        :param dataset_name:
+        :param validation: summary of the validation, if not already recorded
+        :return:
+        """
+        now = time.time()
+        self._execute('''
+            INSERT INTO requests (request_id, dag_id, action, user_id, user_name, data_resource_uids, dataset_name,
+                                  validation, created, started)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (request_id) DO UPDATE SET
+                dag_id = excluded.dag_id,
+                action = excluded.action,
+                data_resource_uids = excluded.data_resource_uids,
+                dataset_name = excluded.dataset_name,
+                validation = COALESCE(excluded.validation, validation),
+                started = excluded.started
+            WHERE requests.user_id = excluded.user_id
+        ''', (request_id, dag_id, action, user.id, user.name, json.dumps(data_resource_uids), dataset_name,
+              json.dumps(validation) if validation is not None else None, now, now))
+
+    def get(self, request_id: str) -> Union[RequestRecord, None]:
+        rows = self._query('SELECT * FROM requests WHERE request_id = ?', (request_id,))
+        return rows[0] if rows else None
+
+    def is_owned_by(self, request_id: str, user: User) -> bool:
+        """
+        Check a request wasn't made by another user
+        :param request_id:
+        :param user:
+        :return: True if the request was made by the user or hasn't been recorded
+        """
+        record = self.get(request_id)
+        return record is None or record.user_id == user.id
+
+    def dag_for(self, request_id: str) -> Union[str, None]:
+        """
+        Get the DAG a request's run was started on
+        :param request_id:
+        :return: the DAG ID, or None if no run has been recorded for the request
+        """
+        record = self.get(request_id)
+        return record.dag_id if record else None
+
+    def list_for_user(self, user_id: str, limit: int, offset: int = 0) -> List[RequestRecord]:
+        """
+        List a user's requests that have started a DAG run, most recent first
+        """
+        return self._query('''
+            SELECT * FROM requests WHERE user_id = ? AND started IS NOT NULL ORDER BY started DESC LIMIT ? OFFSET ?
+        ''', (user_id, limit, offset))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self.connection.row_factory = sqlite3.Row
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.executescript(SCHEMA)
+            logging.info(f"Opened request registry {self.path}")
+        return self.connection
+
+    def _execute(self, sql: str, parameters: tuple):
+        try:
+            with self.lock:
+                self._connect().execute(sql, parameters)
+        except (sqlite3.Error, OSError) as e:
+            logging.error(f"Error writing to request registry {e}", exc_info=True)
+
+    def _query(self, sql: str, parameters: tuple) -> List[RequestRecord]:
+        try:
+            with self.lock:
+                rows = self._connect().execute(sql, parameters).fetchall()
+        except (sqlite3.Error, OSError) as e:
+            logging.error(f"Error reading from request registry {e}", exc_info=True)
+            return []
+        return [
+            RequestRecord(
+                request_id=row['request_id'],
+                dag_id=row['dag_id'],
+                action=row['action'],
+                user_id=row['user_id'],
+                user_name=row['user_name'],
+                data_resource_uids=json.loads(row['data_resource_uids']) if row['data_resource_uids'] else [],
+                dataset_name=row['dataset_name'],
+                validation=json.loads(row['validation']) if row['validation'] else None,
+                created=row['created'],
+                started=row['started']
+            )
+            for row in rows
+        ]
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+
+request_registry = RequestRegistry(app_config)
+
+
+def get_request_registry():
+    """
+    Get the request registry
+    :return:
+    """
+    return request_registry
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import Dict, Union
+from typing import Dict, List, Union
 
 from fastapi import File, UploadFile
 from pydantic import BaseModel, ConfigDict
@@ -57,6 +57,60 @@ class ValidationResponse(BaseModel):
     mapImage: Union[str, None]
 
 
+class ValidationJob(BaseModel):
+    jobID: str
+    state: str
+    progress: str = ""
+    created: str
+    finished: Union[str, None] = None
+    statusUrl: str = ""
+    resultUrl: str = ""
+
+
+class UploadSession(BaseModel):
+    uploadID: str
+    fileName: str
+    size: int
+    chunkSize: int
+    chunkCount: int
+    receivedChunks: List[int] = []
+    complete: bool = False
+
+
+class PresignedUpload(BaseModel):
+    requestID: str
+    tempPath: str
+    url: Union[str, None] = None
+    uploadId: Union[str, None] = None
+    partSize: Union[int, None] = None
+    partUrls: List[str] = []
+
+
+class PresignedPart(BaseModel):
+    PartNumber: int
+    ETag: str
+
+
+class PresignedUploadCompletion(BaseModel):
+    uploadId: str
+    parts: List[PresignedPart]
+
+
+class PublishRequestSummary(BaseModel):
+    requestID: str
+    action: Union[str, None] = None
+    dagId: Union[str, None] = None
+    dataResourceUids: List[str] = []
+    datasetName: Union[str, None] = None
+    validation: Union[Dict, None] = None
+    started: Union[str, None] = None
+    statusUrl: str
+
+
+class StatusBatchRequest(BaseModel):
+    requestIDs: List[str]
+
+
 class PublishStatus(BaseModel):
     id: str
     dataset_name: str
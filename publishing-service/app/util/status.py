@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+from typing import AsyncIterator, Dict, List, Set, Union
+
+import httpx
+
+from util.config import AppConfig, app_config
+from util.error_codes import ErrorCode
+from util.executor import ValidationExecutor, validation_executor
+from util.http import HttpClients
+from util.registry import RequestRegistry, request_registry
+from util.responses import ErrorResponse, PublishStatus
+from util.ttl_cache import TTLCache
+
+# DAG run states that never change
+TERMINAL_STATES = {'success', 'failed'}
+
+
+async def fetch_status(request_id: str, dag_id: str, config: AppConfig,
+                       http: HttpClients) -> Union[PublishStatus, ErrorResponse]:
+    """
+    Get the status of a dataset publishing event from airflow
+    :param request_id:
+    :param dag_id: the DAG the event's run was started on
+    :param config:
+    :param http:
+    :return:
+    """
+    endpoint = f'{config.airflow_api_base_url}/dags/{dag_id}/dagRuns/{request_id}'
+    try:
+        response = await http.airflow.get(endpoint)
+    except httpx.HTTPError as e:
+        logging.error(f"Error retrieving DAG run {request_id} {e}")
+        return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message='Unable to access airflow')
+
+    if response.status_code == 200:
+
+        json_str = response.content
+        return to_publish_status(json.loads(json_str))
+    else:
+        logging.info(f"Failed to retrieve DAGs. Status code: {response.status_code}")
+        return ErrorResponse(error=ErrorCode.AIRFLOW_ERROR, message=f'Unable to access airflow {response.status_code}')
+
+
+async def list_dag_runs(config: AppConfig, http: HttpClients, offset: int, limit: int,
+                        states: Union[List[str], None] = None, dag_ids: Union[List[str], None] = None,
+                        **filters) -> Union[Dict, None]:
+    """
+    List a page of the ingest and delete DAG runs, most recent first
+    :param config:
+    :param http:
+    :param offset:
+    :param limit:
+    :param states: only list runs in these states
+    :param dag_ids: only list runs of these DAGs, rather than both the ingest and delete DAGs
+    :param filters: other filters supported by airflow's dagRuns/list, e.g. start_date_gte
+    :return: the dag_runs and total_entries, or None if airflow couldn't be reached
+    """
+    body = {"dag_ids": dag_ids or [config.ingest_dag, config.delete_dag], "order_by": "-execution_date",
+            "page_offset": offset, "page_limit": limit, **filters}
+    if states:
+        body["states"] = states
+    try:
+        response = await http.airflow.post(f'{config.airflow_api_base_url}/dags/~/dagRuns/list', json=body)
+    except httpx.HTTPError as e:
+        logging.error(f"Error listing DAG runs {e}")
+        return None
+    if response.status_code != 200:
+        logging.info(f"Failed to list DAG runs. Status code: {response.status_code}")
+        return None
+    return json.loads(response.content)
+
+
+def to_publish_status(dag_details: Dict) -> PublishStatus:
+    # Check if 'conf' key is present and not None
+    conf = dag_details.get('conf')
+    if conf is not None:
+        dataset_ids = conf.get('datasetIds', [])
+    else:
+        dataset_ids = []
+
+    return PublishStatus(
+        id=dag_details['dag_run_id'],
+        dataset_name=dag_details.get('conf').get('dataset_name') if dag_details.get('conf') else None,
+        datasets=dataset_ids,
+        state=dag_details['state'],
+        start_date=dag_details['start_date'],
+        end_date=dag_details['end_date']
+    )
+
+
+def is_finished(status: Union[PublishStatus, ErrorResponse]) -> bool:
+    return isinstance(status, ErrorResponse) or status.state in TERMINAL_STATES
+
+
+class StatusCache:
+    """
+    Cache of publishing event statuses. Runs that have finished never change, so are kept until evicted by
+    newer finished runs beyond status_cache_size. Runs still in progress are cached for status_running_ttl
+    seconds. Concurrent requests for the same uncached status share a single request to airflow.
+    Errors are not cached.
+    """
+    def __init__(self, config: AppConfig, registry: RequestRegistry, executor: ValidationExecutor):
+        self.registry = registry
+        self.executor = executor
+        self.finished = TTLCache(config.status_cache_size, float('inf'))
+        self.running = TTLCache(config.status_cache_size, config.status_running_ttl)
+        self.pending: Dict[str, asyncio.Future] = {}
+
+    async def get(self, request_id: str, config: AppConfig, http: HttpClients) -> Union[PublishStatus, ErrorResponse]:
+        """
+        Get the status of a dataset publishing event
+        :param request_id:
+        :param config:
+        :param http:
+        :return:
+        """
+        status = self.finished.get(request_id) or self.running.get(request_id)
+        if status is not None:
+            return status
+        if request_id not in self.pending:
+            self.pending[request_id] = asyncio.ensure_future(self._fetch(request_id, config, http))
+        # shielded, as other requests may be waiting on the same fetch
+        return await asyncio.shield(self.pending[request_id])
+
+    async def _fetch(self, request_id: str, config: AppConfig, http: HttpClients) -> Union[PublishStatus, ErrorResponse]:
+        try:
+            status = await self.fetch(request_id, config, http)
+            self.store(request_id, status)
+            return status
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def get_many(self, request_ids: List[str], config: AppConfig,
+                       http: HttpClients) -> Dict[str, Union[PublishStatus, ErrorResponse]]:
+        """
+        Get the status of several publishing events. Uncached statuses are found by listing the most recent
+        runs, up to status_batch_max_pages pages, and any not found are then requested individually.
+        :param request_ids:
+        :param config:
+        :param http:
+        :return: the status of each publishing event by request ID
+        """
+        statuses = {}
+        wanted = set()
+        for request_id in request_ids:
+            status = self.finished.get(request_id) or self.running.get(request_id)
+            if status is not None:
+                statuses[request_id] = status
+            else:
+                wanted.add(request_id)
+
+        offset = 0
+        for _ in range(config.status_batch_max_pages if wanted else 0):
+            page = await list_dag_runs(config, http, offset, config.status_poll_page_size)
+            if page is None:
+                break
+            for item in page['dag_runs']:
+                if item['dag_run_id'] in wanted:
+                    status = to_publish_status(item)
+                    self.store(item['dag_run_id'], status)
+                    statuses[item['dag_run_id']] = status
+                    wanted.discard(item['dag_run_id'])
+            offset += len(page['dag_runs'])
+            if not wanted or not page['dag_runs'] or offset >= page.get('total_entries', 0):
+                break
+
+        remaining = list(wanted)
+        results = await asyncio.gather(*(self.get(request_id, config, http) for request_id in remaining))
+        statuses.update(zip(remaining, results))
+        return {request_id: statuses[request_id] for request_id in request_ids}
+
+    async def fetch(self, request_id: str, config: AppConfig, http: HttpClients) -> Union[PublishStatus, ErrorResponse]:
+        """
+        Fetch a status from airflow, on the DAG recorded for the request in the registry. Requests from before
+        the registry are assumed to be ingests.
+        """
+        dag_id = await self.executor.run_io(self.registry.dag_for, request_id) or config.ingest_dag
+        return await fetch_status(request_id, dag_id, config, http)
+
+    def store(self, request_id: str, status: Union[PublishStatus, ErrorResponse]):
+        if isinstance(status, PublishStatus):
+            if status.state in TERMINAL_STATES:
+                self.finished.put(request_id, status)
+                self.running.pop(request_id)
+            else:
+                self.running.put(request_id, status)
+
+
+class StatusPoller:
+    """
+    Pushes status changes to clients watching publishing events. A single background task polls airflow every
+    status_poll_interval seconds while anything is being watched, listing all the queued and running ingest
+    and delete runs in as few requests as possible, however many clients are watching. A watched run missing
+    from the list has finished, so its final status is fetched individually. Updates are fanned out to each
+    watcher's queue, and also refresh the status cache.
+    """
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.interval = config.status_poll_interval
+        self.heartbeat = config.status_stream_heartbeat
+        self.page_size = config.status_poll_page_size
+        self.subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self.last: Dict[str, PublishStatus] = {}
+        self.task: Union[asyncio.Task, None] = None
+        self.http: Union[HttpClients, None] = None
+        self.cache: Union[StatusCache, None] = None
+
+    def start(self, http: HttpClients, cache: StatusCache):
+        self.http = http
+        self.cache = cache
+
+    def shutdown(self):
+        if self.task:
+            self.task.cancel()
+
+    async def watch(self, request_id: str) -> AsyncIterator[Union[PublishStatus, ErrorResponse, None]]:
+        """
+        Watch a publishing event, yielding its current status, then each change until it finishes.
+        None is yielded if there has been no change for status_stream_heartbeat seconds.
+        :param request_id:
+        :return:
+        """
+        status = await self.cache.get(request_id, self.config, self.http)
+        yield status
+        if is_finished(status):
+            return
+
+        queue = asyncio.Queue()
+        self.subscribers.setdefault(request_id, set()).add(queue)
+        self.last.setdefault(request_id, status)
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        try:
+            while True:
+                try:
+                    status = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield status
+                if is_finished(status):
+                    return
+        finally:
+            queues = self.subscribers.get(request_id)
+            if queues is not None:
+                queues.discard(queue)
+                if not queues:
+                    del self.subscribers[request_id]
+                    self.last.pop(request_id, None)
+
+    async def _run(self):
+        try:
+            while self.subscribers:
+                await asyncio.sleep(self.interval)
+                try:
+                    await self.poll()
+                except Exception as e:
+                    logging.error(f"Error polling DAG runs {e}", exc_info=True)
+        finally:
+            self.task = None
+
+    async def poll(self):
+        watched = list(self.subscribers)
+        if not watched:
+            return
+        active = await self._list_active()
+        if active is None:
+            return
+
+        finished = [request_id for request_id in watched if request_id not in active]
+        statuses = await asyncio.gather(*(self.cache.fetch(request_id, self.config, self.http) for request_id in finished))
+        updates = dict(zip(finished, statuses))
+        updates.update((request_id, active[request_id]) for request_id in watched if request_id in active)
+
+        for request_id, status in updates.items():
+            if isinstance(status, ErrorResponse):
+                # try again on the next poll
+                continue
+            self.cache.store(request_id, status)
+            if status != self.last.get(request_id):
+                self.last[request_id] = status
+                for queue in self.subscribers.get(request_id, ()):
+                    queue.put_nowait(status)
+
+    async def _list_active(self) -> Union[Dict[str, PublishStatus], None]:
+        """
+        List the queued and running ingest and delete runs, a page at a time
+        :return: the status of each run by ID, or None if airflow couldn't be reached
+        """
+        active = {}
+        offset = 0
+        while True:
+            dag_list = await list_dag_runs(self.config, self.http, offset, self.page_size, ['queued', 'running'])
+            if dag_list is None:
+                return None
+            for item in dag_list['dag_runs']:
+                active[item['dag_run_id']] = to_publish_status(item)
+            offset += len(dag_list['dag_runs'])
+            if not dag_list['dag_runs'] or offset >= dag_list.get('total_entries', 0):
+                return active
+
+
+status_cache = StatusCache(app_config, request_registry, validation_executor)
+status_poller = StatusPoller(app_config)
+
+
+def get_status_cache():
+    """
+    Get the publishing event status cache
+    :return:
+    """
+    return status_cache
+
+
+def get_status_poller():
+    """
+    Get the publishing event status poller
+    :return:
+    """
+    return status_poller
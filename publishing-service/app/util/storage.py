@@ -0,0 +1,270 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, List, Union
+
+import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from util.config import AppConfig
+from util.upload import StoredUpload, UploadTooLargeException, remove_temp_file
+
+# S3 rejects single part copies of objects larger than this
+MAX_COPY_OBJECT_SIZE = 5 * 1024 * 1024 * 1024
+
+_clients: Dict[Union[str, None], object] = {}
+_clients_lock = threading.Lock()
+
+
+def s3_client(config: AppConfig):
+    """
+    Get the S3 client, using s3_endpoint_url if set, e.g. for a local S3 stand-in. Clients are thread safe,
+    so a single client is shared, keeping its connection pool warm between requests. Requests are signed with
+    SigV4, which, unlike the legacy signature, can sign the length of a presigned upload.
+    :param config:
+    :return:
+    """
+    with _clients_lock:
+        client = _clients.get(config.s3_endpoint_url)
+        if client is None:
+            client = boto3.client('s3', endpoint_url=config.s3_endpoint_url,
+                                   config=Config(signature_version='s3v4'))
+            _clients[config.s3_endpoint_url] = client
+        return client
+
+
+def transfer_config(config: AppConfig) -> TransferConfig:
+    """
+    Transfer settings for managed uploads and copies. Objects over s3_multipart_threshold are transferred
+    as s3_multipart_chunk_size parts, s3_max_concurrency at a time.
+    :param config:
+    :return:
+    """
+    return TransferConfig(multipart_threshold=min(config.s3_multipart_threshold, MAX_COPY_OBJECT_SIZE),
+                          multipart_chunksize=config.s3_multipart_chunk_size,
+                          max_concurrency=config.s3_max_concurrency,
+                          use_threads=True)
+
+
+class TransferStats:
+    """
+    Counters for S3 transfers, to show transfer throughput
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_progress = 0
+        self.completed = 0
+        self.failed = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def started(self):
+        with self.lock:
+            self.in_progress += 1
+
+    def finished(self, transferred: int, seconds: float, success: bool):
+        with self.lock:
+            self.in_progress -= 1
+            if success:
+                self.completed += 1
+                self.bytes += transferred
+                self.seconds += seconds
+            else:
+                self.failed += 1
+
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "inProgress": self.in_progress,
+                "completed": self.completed,
+                "failed": self.failed,
+                "bytes": self.bytes,
+                "bytesPerSecond": self.bytes / self.seconds if self.seconds else 0
+            }
+
+
+transfer_stats = TransferStats()
+
+
+def get_transfer_stats():
+    """
+    Get the S3 transfer counters
+    :return:
+    """
+    return transfer_stats
+
+
+class TransferProgress:
+    """
+    Progress callback for a managed transfer. Parts complete on several threads, so updates are locked.
+    Progress is logged every 10%, along with the transfer rate.
+    """
+    def __init__(self, description: str, size: int, on_progress: Union[Callable[[str], None], None] = None):
+        self.description = description
+        self.size = size
+        self.on_progress = on_progress
+        self.transferred = 0
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.reported = 0
+
+    def __call__(self, bytes_amount: int):
+        with self.lock:
+            self.transferred += bytes_amount
+            percent = int(self.transferred * 100 / self.size) if self.size else 100
+            if percent < self.reported + 10 and self.transferred < self.size:
+                return
+            self.reported = percent
+            message = f'{self.description} {percent}% ({self.transferred} of {self.size} bytes, ' \
+                      f'{self.rate() / (1024 * 1024):.1f} MiB/s)'
+        logging.info(message)
+        if self.on_progress:
+            self.on_progress(message)
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def rate(self) -> float:
+        elapsed = self.elapsed()
+        return self.transferred / elapsed if elapsed else 0
+
+
+def _transfer(progress: TransferProgress, transfer: Callable):
+    transfer_stats.started()
+    success = False
+    try:
+        transfer(progress)
+        success = True
+    finally:
+        transfer_stats.finished(progress.transferred, progress.elapsed(), success)
+    logging.info(f'{progress.description} complete, {progress.transferred} bytes in {progress.elapsed():.1f}s '
+                 f'({progress.rate() / (1024 * 1024):.1f} MiB/s)')
+
+
+def upload_archive(config: AppConfig, temp_file_path: str, key: str,
+                   on_progress: Union[Callable[[str], None], None] = None):
+    """
+    Upload a file to S3, as a parallel multipart upload if it is over s3_multipart_threshold
+    :param config:
+    :param temp_file_path: the file to upload
+    :param key: the key to upload to
+    :param on_progress: optionally called with a progress message as the upload proceeds
+    :return:
+    """
+    progress = TransferProgress(f'Upload to {key}', os.path.getsize(temp_file_path), on_progress)
+    _transfer(progress, lambda callback: s3_client(config).upload_file(
+        temp_file_path, config.s3_bucket_name, key, Config=transfer_config(config), Callback=callback))
+
+
+def copy_archive(config: AppConfig, source_key: str, key: str,
+                 on_progress: Union[Callable[[str], None], None] = None):
+    """
+    Copy an object within the bucket, as a parallel multipart copy if it is over s3_multipart_threshold.
+    Unlike copy_object, this copes with objects over 5 GB.
+    :param config:
+    :param source_key: the key to copy from
+    :param key: the key to copy to
+    :param on_progress: optionally called with a progress message as the copy proceeds
+    :return:
+    """
+    s3 = s3_client(config)
+    size = s3.head_object(Bucket=config.s3_bucket_name, Key=source_key)['ContentLength']
+    progress = TransferProgress(f'Copy of {source_key} to {key}', size, on_progress)
+    _transfer(progress, lambda callback: s3.copy({'Bucket': config.s3_bucket_name, 'Key': source_key},
+                                                 config.s3_bucket_name, key, Config=transfer_config(config),
+                                                 Callback=callback))
+
+
+def upload_key(user_id: str, request_id: str) -> str:
+    """
+    The key of an archive uploaded for later publishing
+    """
+    return f"file-uploads/{user_id}/{request_id}.zip"
+
+
+def presign_upload(config: AppConfig, key: str, size: int) -> Dict:
+    """
+    Issue presigned URLs for uploading an object directly to S3. Objects larger than presigned_multipart_threshold
+    are uploaded as a multipart upload, with a URL for each part. The length of each PUT is signed into its URL,
+    so S3 rejects a body of any other size.
+    :param config:
+    :param key: the key to upload to
+    :param size: the size of the object in bytes
+    :return: the URL for a single PUT, or the multipart upload ID, part size and part URLs
+    """
+    s3 = s3_client(config)
+    if size <= config.presigned_multipart_threshold:
+        url = s3.generate_presigned_url('put_object',
+                                        Params={'Bucket': config.s3_bucket_name, 'Key': key, 'ContentLength': size},
+                                        ExpiresIn=config.presigned_url_expiry)
+        return {'url': url}
+
+    upload_id = s3.create_multipart_upload(Bucket=config.s3_bucket_name, Key=key)['UploadId']
+    part_size = config.presigned_part_size
+    part_count = -(-size // part_size)
+    part_urls = [
+        s3.generate_presigned_url('upload_part',
+                                  Params={'Bucket': config.s3_bucket_name, 'Key': key, 'UploadId': upload_id,
+                                          'PartNumber': part_number,
+                                          'ContentLength': min(part_size, size - part_size * (part_number - 1))},
+                                  ExpiresIn=config.presigned_url_expiry)
+        for part_number in range(1, part_count + 1)
+    ]
+    return {'uploadId': upload_id, 'partSize': part_size, 'partUrls': part_urls}
+
+
+def complete_presigned_upload(config: AppConfig, key: str, upload_id: str, parts: List[Dict]):
+    """
+    Complete a presigned multipart upload
+    :param config:
+    :param key:
+    :param upload_id: the multipart upload ID
+    :param parts: the PartNumber and ETag of each uploaded part
+    :return:
+    """
+    s3_client(config).complete_multipart_upload(Bucket=config.s3_bucket_name, Key=key, UploadId=upload_id,
+                                                MultipartUpload={'Parts': sorted(parts, key=lambda part: part['PartNumber'])})
+
+
+def download_archive(config: AppConfig, key: str, temp_file_path: str, file_name: str = None) -> StoredUpload:
+    """
+    Stream an archive from S3 to disk, computing the SHA-256 and byte count as it goes. Archives over
+    max_upload_size are rejected before they are downloaded, and the download is stopped if it goes over.
+    :param config:
+    :param key: the key of the archive
+    :param temp_file_path: the path to write the file to
+    :param file_name: the name of the file
+    :return: details of the stored file
+    :raises UploadTooLargeException: if the archive exceeds the maximum upload size
+    """
+    s3 = s3_client(config)
+    size = s3.head_object(Bucket=config.s3_bucket_name, Key=key)['ContentLength']
+    if config.max_upload_size and size > config.max_upload_size:
+        raise UploadTooLargeException(f'The supplied file exceeds the maximum upload size of {config.max_upload_size} bytes')
+
+    digest = hashlib.sha256()
+    response = s3.get_object(Bucket=config.s3_bucket_name, Key=key)
+    body = response['Body']
+    progress = TransferProgress(f'Download of {key}', response['ContentLength'])
+
+    def download(callback: TransferProgress):
+        with open(temp_file_path, 'wb') as f:
+            for data in body.iter_chunks(config.upload_chunk_size):
+                # the object may have been replaced since it was checked
+                if config.max_upload_size and callback.transferred + len(data) > config.max_upload_size:
+                    raise UploadTooLargeException(f'The supplied file exceeds the maximum upload size of {config.max_upload_size} bytes')
+                digest.update(data)
+                f.write(data)
+                callback(len(data))
+
+    try:
+        _transfer(progress, download)
+    except Exception:
+        remove_temp_file(temp_file_path)
+        raise
+    finally:
+        body.close()
+    return StoredUpload(path=temp_file_path, size=progress.transferred, sha256=digest.hexdigest(), file_name=file_name)
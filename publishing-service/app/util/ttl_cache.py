@@ -0,0 +1,43 @@
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Tuple, Union
+
+
+class TTLCache:
+    """
+    Bounded in-memory cache. Entries expire ttl seconds after they are stored, unless stored with their
+    own ttl, and once there are more than max_size entries the least recently used are evicted. Not thread safe, it is intended
+    for use from the event loop.
+    """
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: Dict[Hashable, Tuple[Any, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        entry = self.entries.get(key)
+        if entry is None or time.monotonic() > entry[1]:
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return default
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, ttl: Union[float, None] = None):
+        self.entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+
+    def to_dict(self) -> Dict:
+        return {"size": len(self.entries), "maxSize": self.max_size, "hits": self.hits, "misses": self.misses}
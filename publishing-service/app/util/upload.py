@@ -0,0 +1,71 @@
+import hashlib
+import logging
+import os
+from dataclasses import dataclass
+from typing import Union
+
+from fastapi import UploadFile
+from fastapi.concurrency import run_in_threadpool
+
+from util.config import AppConfig
+
+
+class UploadTooLargeException(Exception):
+    """
+    Raised when an upload exceeds the configured maximum size
+    """
+    pass
+
+
+@dataclass
+class StoredUpload:
+    path: str
+    size: int
+    sha256: str
+    file_name: Union[str, None] = None
+
+
+async def store_upload(file: UploadFile, temp_file_path: str, config: AppConfig) -> StoredUpload:
+    """
+    Stream the uploaded file to disk in fixed size chunks, computing the SHA-256 and byte count as it goes.
+    Only a single chunk is held in memory at a time, regardless of the archive size, and chunks are written in the
+    thread pool so a slow disk doesn't hold up the event loop.
+    :param file: the uploaded file
+    :param temp_file_path: the path to write the file to
+    :param config:
+    :return: details of the stored file
+    """
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        f = await run_in_threadpool(open, temp_file_path, 'wb')
+        try:
+            while True:
+                chunk = await file.read(config.upload_chunk_size)
+                if not chunk:
+                    break
+                size += len(chunk)
+                if config.max_upload_size and size > config.max_upload_size:
+                    raise UploadTooLargeException(f'The supplied file exceeds the maximum upload size of {config.max_upload_size} bytes')
+                digest.update(chunk)
+                await run_in_threadpool(f.write, chunk)
+        finally:
+            await run_in_threadpool(f.close)
+    except Exception:
+        remove_temp_file(temp_file_path)
+        raise
+    finally:
+        file.file.close()
+
+    logging.info(f"Stored upload {temp_file_path}, {size} bytes, sha256 {digest.hexdigest()}")
+    return StoredUpload(path=temp_file_path, size=size, sha256=digest.hexdigest(), file_name=file.filename)
+
+
+def remove_temp_file(temp_file_path: str):
+    """
+    Remove the temporary file if it exists
+    :param temp_file_path:
+    :return:
+    """
+    if temp_file_path and os.path.isfile(temp_file_path):
+        os.remove(temp_file_path)
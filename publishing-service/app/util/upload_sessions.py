@@ -0,0 +1,360 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Callable, Dict, List, Union
+
+from botocore.exceptions import ClientError
+from fastapi.concurrency import run_in_threadpool
+
+from util.config import AppConfig, app_config
+from util.responses import UploadSession
+from util.storage import s3_client, download_archive, upload_key
+from util.upload import StoredUpload, UploadTooLargeException, remove_temp_file
+
+# S3 multipart uploads need every part but the last to be at least this size, and have at most S3_MAX_PARTS parts
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+
+# with the s3 backend, session state is kept in the bucket under this prefix, so any replica can continue a session
+S3_SESSION_PREFIX = 'upload-sessions'
+
+
+class UploadNotFoundException(Exception):
+    pass
+
+
+class UploadIncompleteException(Exception):
+    pass
+
+
+class InvalidChunkException(Exception):
+    pass
+
+
+@dataclass
+class UploadSessionState:
+    upload_id: str
+    user_id: str
+    file_name: str
+    size: int
+    chunk_size: int
+    created: float
+    complete: bool = False
+    sha256: Union[str, None] = None
+    s3_upload_id: Union[str, None] = None
+
+    @property
+    def chunk_count(self) -> int:
+        return -(-self.size // self.chunk_size)
+
+    def expected_chunk_size(self, number: int) -> int:
+        if number < self.chunk_count:
+            return self.chunk_size
+        return self.size - self.chunk_size * (self.chunk_count - 1)
+
+
+class UploadSessions:
+    """
+    Resumable uploads, sent as numbered chunks of upload_session_chunk_size bytes (the last may be smaller).
+    Chunks are assembled on local disk, or with upload_session_backend 's3', sent as the parts of an S3 multipart
+    upload to file-uploads/{user.id}/{uploadID}.zip. Session state is kept on local disk in upload_session_dir, or
+    with the s3 backend in the bucket at upload-sessions/{user.id}/{uploadID}.json, with the parts received read from
+    the multipart upload, so a session can be continued on any replica. Sessions not used within upload_session_ttl
+    seconds are removed.
+    """
+    def __init__(self, config: AppConfig):
+        self.config = config
+        self.directory = config.upload_session_dir
+        self.chunk_size = config.upload_session_chunk_size
+        self.ttl = config.upload_session_ttl
+        self.max_upload_size = config.max_upload_size
+        self.use_s3 = config.upload_session_backend == 's3'
+        self.bucket = config.s3_bucket_name
+        if self.use_s3 and self.chunk_size < S3_MIN_PART_SIZE:
+            raise ValueError(f'upload_session_chunk_size must be at least {S3_MIN_PART_SIZE} bytes with the s3 backend')
+
+    def create(self, user_id: str, file_name: str, size: int) -> UploadSessionState:
+        """
+        Start a new upload session
+        :param user_id: the user uploading the file
+        :param file_name: the name of the file
+        :param size: the size of the file in bytes
+        :return:
+        """
+        if self.max_upload_size and size > self.max_upload_size:
+            raise UploadTooLargeException(f'The supplied file exceeds the maximum upload size of {self.max_upload_size} bytes')
+        if self.use_s3 and -(-size // self.chunk_size) > S3_MAX_PARTS:
+            raise UploadTooLargeException(f'The supplied file exceeds the maximum upload size of {self.chunk_size * S3_MAX_PARTS} bytes')
+        self.expire()
+
+        state = UploadSessionState(upload_id=str(uuid.uuid4()), user_id=user_id, file_name=file_name, size=size,
+                                   chunk_size=self.chunk_size, created=time.time())
+        if self.use_s3:
+            response = s3_client(self.config).create_multipart_upload(Bucket=self.bucket, Key=self._key(state))
+            state.s3_upload_id = response['UploadId']
+        else:
+            os.makedirs(self._dir(state.upload_id))
+        self._save(state)
+        logging.info(f"Created upload session {state.upload_id} for {size} bytes in {state.chunk_count} chunks")
+        return state
+
+    def get(self, upload_id: str, user_id: str) -> UploadSessionState:
+        """
+        Get an upload session belonging to the supplied user
+        :param upload_id:
+        :param user_id:
+        :return:
+        """
+        try:
+            uuid.UUID(upload_id)
+            state = self._load(upload_id, user_id)
+        except (ValueError, OSError):
+            raise UploadNotFoundException('The upload is not recognised')
+        except ClientError as e:
+            if e.response['Error']['Code'] not in ('NoSuchKey', '404'):
+                raise
+            raise UploadNotFoundException('The upload is not recognised')
+        if state.user_id != user_id:
+            raise UploadNotFoundException('The upload is not recognised')
+        return state
+
+    def received_chunks(self, state: UploadSessionState) -> List[int]:
+        if state.complete:
+            return list(range(1, state.chunk_count + 1))
+        if self.use_s3:
+            return sorted(self._s3_parts(state))
+        return sorted(int(name[:-len('.part')]) for name in os.listdir(self._dir(state.upload_id)) if name.endswith('.part'))
+
+    async def receive_chunk(self, state: UploadSessionState, number: int, stream: AsyncIterator[bytes],
+                            run_io: Callable = run_in_threadpool) -> str:
+        """
+        Write a chunk from the request body to a temporary file, checking it is the expected size
+        :param state:
+        :param number: the chunk number, starting at 1
+        :param stream: the request body
+        :param run_io: runs the blocking file writes off the event loop, e.g. the executor's run_io
+        :return: path to the temporary file
+        """
+        if state.complete:
+            raise InvalidChunkException('The upload has already been completed')
+        if number < 1 or number > state.chunk_count:
+            raise InvalidChunkException(f'Chunk number must be between 1 and {state.chunk_count}')
+
+        expected = state.expected_chunk_size(number)
+        if self.use_s3:
+            # the chunk is only held here until it is sent as a part
+            await run_io(os.makedirs, self.directory, exist_ok=True)
+            temp_path = os.path.join(self.directory, f'{state.upload_id}.{number}.{uuid.uuid4()}.tmp')
+        else:
+            temp_path = os.path.join(self._dir(state.upload_id), f'{number}.{uuid.uuid4()}.tmp')
+        size = 0
+        try:
+            f = await run_io(open, temp_path, 'wb')
+            try:
+                async for data in stream:
+                    size += len(data)
+                    if size > expected:
+                        break
+                    await run_io(f.write, data)
+            finally:
+                await run_io(f.close)
+            if size != expected:
+                raise InvalidChunkException(f'Chunk {number} must be {expected} bytes')
+        except Exception:
+            remove_temp_file(temp_path)
+            raise
+        return temp_path
+
+    def store_chunk(self, state: UploadSessionState, number: int, temp_path: str):
+        """
+        Store a received chunk, replacing any previous attempt at the same chunk
+        """
+        if self.use_s3:
+            # the multipart upload records the part and its ETag
+            try:
+                with open(temp_path, 'rb') as f:
+                    s3_client(self.config).upload_part(Bucket=self.bucket, Key=self._key(state), PartNumber=number,
+                                                       UploadId=state.s3_upload_id, Body=f)
+            finally:
+                remove_temp_file(temp_path)
+        else:
+            os.replace(temp_path, os.path.join(self._dir(state.upload_id), f'{number}.part'))
+
+    def complete(self, state: UploadSessionState) -> UploadSessionState:
+        """
+        Finalise the upload once all the chunks have been received
+        :param state:
+        :return:
+        """
+        if state.complete:
+            return state
+        missing = set(range(1, state.chunk_count + 1)) - set(self.received_chunks(state))
+        if missing:
+            raise UploadIncompleteException(f'The upload is missing chunks {sorted(missing)}')
+
+        if self.use_s3:
+            received = self._s3_parts(state)
+            parts = [{'PartNumber': number, 'ETag': received[number]['ETag']} for number in range(1, state.chunk_count + 1)]
+            s3_client(self.config).complete_multipart_upload(Bucket=self.bucket, Key=self._key(state),
+                                                             UploadId=state.s3_upload_id, MultipartUpload={'Parts': parts})
+        else:
+            # assemble the chunks, removing each as it is copied
+            directory = self._dir(state.upload_id)
+            digest = hashlib.sha256()
+            with open(os.path.join(directory, 'archive.zip'), 'wb') as archive:
+                for number in range(1, state.chunk_count + 1):
+                    part_path = os.path.join(directory, f'{number}.part')
+                    with open(part_path, 'rb') as part:
+                        for data in iter(lambda: part.read(1024 * 1024), b''):
+                            digest.update(data)
+                            archive.write(data)
+                    os.remove(part_path)
+            state.sha256 = digest.hexdigest()
+
+        state.complete = True
+        self._save(state)
+        return state
+
+    def claim(self, upload_id: str, user_id: str, temp_file_path: str) -> StoredUpload:
+        """
+        Move a completed upload to the supplied path for validation, ending the session. With the s3 backend, the
+        assembled object is downloaded and then deleted from the bucket.
+        :param upload_id:
+        :param user_id:
+        :param temp_file_path: the path to write the file to
+        :return: details of the stored file
+        """
+        state = self.get(upload_id, user_id)
+        if not state.complete:
+            raise UploadIncompleteException('The upload has not been completed')
+
+        if self.use_s3:
+            upload = download_archive(self.config, self._key(state), temp_file_path, state.file_name)
+            s3_client(self.config).delete_object(Bucket=self.bucket, Key=self._key(state))
+            s3_client(self.config).delete_object(Bucket=self.bucket, Key=self._state_key(state.user_id, upload_id))
+        else:
+            shutil.move(os.path.join(self._dir(upload_id), 'archive.zip'), temp_file_path)
+            upload = StoredUpload(path=temp_file_path, size=state.size, sha256=state.sha256, file_name=state.file_name)
+            shutil.rmtree(self._dir(upload_id), ignore_errors=True)
+        return upload
+
+    def abort(self, state: UploadSessionState):
+        """
+        Abandon an upload, removing any chunks received
+        """
+        if self.use_s3:
+            try:
+                if state.complete:
+                    s3_client(self.config).delete_object(Bucket=self.bucket, Key=self._key(state))
+                else:
+                    s3_client(self.config).abort_multipart_upload(Bucket=self.bucket, Key=self._key(state),
+                                                                  UploadId=state.s3_upload_id)
+                s3_client(self.config).delete_object(Bucket=self.bucket,
+                                                     Key=self._state_key(state.user_id, state.upload_id))
+            except Exception as e:
+                logging.error(f"Error aborting multipart upload {state.upload_id} {e}")
+        else:
+            shutil.rmtree(self._dir(state.upload_id), ignore_errors=True)
+
+    def expire(self):
+        """
+        Remove sessions that haven't been used within the TTL
+        """
+        if self.use_s3:
+            self._expire_s3()
+            return
+        if not os.path.isdir(self.directory):
+            return
+        now = time.time()
+        for entry in os.scandir(self.directory):
+            try:
+                if now - entry.stat().st_mtime <= self.ttl:
+                    continue
+                with open(os.path.join(entry.path, 'session.json')) as f:
+                    state = UploadSessionState(**json.load(f))
+            except OSError:
+                continue
+            logging.info(f"Removing expired upload session {state.upload_id}")
+            self.abort(state)
+
+    def to_response(self, state: UploadSessionState) -> UploadSession:
+        return UploadSession(
+            uploadID=state.upload_id,
+            fileName=state.file_name,
+            size=state.size,
+            chunkSize=state.chunk_size,
+            chunkCount=state.chunk_count,
+            receivedChunks=self.received_chunks(state),
+            complete=state.complete
+        )
+
+    def _dir(self, upload_id: str) -> str:
+        return os.path.join(self.directory, upload_id)
+
+    @staticmethod
+    def _key(state: UploadSessionState) -> str:
+        return upload_key(state.user_id, state.upload_id)
+
+    @staticmethod
+    def _state_key(user_id: str, upload_id: str) -> str:
+        return f'{S3_SESSION_PREFIX}/{user_id}/{upload_id}.json'
+
+    def _load(self, upload_id: str, user_id: str) -> UploadSessionState:
+        if self.use_s3:
+            response = s3_client(self.config).get_object(Bucket=self.bucket, Key=self._state_key(user_id, upload_id))
+            return UploadSessionState(**json.loads(response['Body'].read()))
+        with open(os.path.join(self._dir(upload_id), 'session.json')) as f:
+            return UploadSessionState(**json.load(f))
+
+    def _s3_parts(self, state: UploadSessionState) -> Dict[int, Dict]:
+        # the parts of the multipart upload received so far, by part number
+        paginator = s3_client(self.config).get_paginator('list_parts')
+        return {part['PartNumber']: part
+                for page in paginator.paginate(Bucket=self.bucket, Key=self._key(state), UploadId=state.s3_upload_id)
+                for part in page.get('Parts', [])}
+
+    def _expire_s3(self):
+        # a session is last used when its state is saved, or a part is received
+        client = s3_client(self.config)
+        now = time.time()
+        for page in client.get_paginator('list_objects_v2').paginate(Bucket=self.bucket, Prefix=f'{S3_SESSION_PREFIX}/'):
+            for entry in page.get('Contents', []):
+                if now - entry['LastModified'].timestamp() <= self.ttl:
+                    continue
+                try:
+                    state = UploadSessionState(**json.loads(client.get_object(Bucket=self.bucket, Key=entry['Key'])['Body'].read()))
+                    if not state.complete and any(now - part['LastModified'].timestamp() <= self.ttl
+                                                  for part in self._s3_parts(state).values()):
+                        continue
+                except (ClientError, ValueError, TypeError) as e:
+                    logging.error(f"Error reading upload session {entry['Key']} {e}")
+                    continue
+                logging.info(f"Removing expired upload session {state.upload_id}")
+                self.abort(state)
+
+    def _save(self, state: UploadSessionState):
+        if self.use_s3:
+            s3_client(self.config).put_object(Bucket=self.bucket, Key=self._state_key(state.user_id, state.upload_id),
+                                              Body=json.dumps(asdict(state)).encode('utf-8'),
+                                              ContentType='application/json')
+            return
+        directory = self._dir(state.upload_id)
+        with open(os.path.join(directory, 'session.json.tmp'), 'w') as f:
+            json.dump(asdict(state), f)
+        os.replace(os.path.join(directory, 'session.json.tmp'), os.path.join(directory, 'session.json'))
+
+
+upload_sessions = UploadSessions(app_config)
+
+
+def get_upload_sessions():
+    """
+    Get the upload sessions
+    :return:
+    """
+    return upload_sessions
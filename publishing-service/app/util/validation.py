@@ -0,0 +1,98 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Union
+
+from dwca.darwincore.utils import qualname as qn
+from dwca.read import DwCAReader
+from dwc_validator.validate_dwca import validate_archive
+from fastapi.encoders import jsonable_encoder
+
+from util.archive import read_coordinates, read_coordinate_chunks
+from util.chunked_validation import is_large_core, validate_archive_in_chunks
+from util.config import AppConfig
+from util.eml import extract_metadata, has_required_metadata
+from util.map import generate_preview_map, generate_chunked_preview_map, get_basemap
+
+SUPPORTED_CORE_TYPES = {qn('Occurrence'), qn('Event')}
+
+
+@dataclass
+class ArchiveValidation:
+    """
+    Picklable result of validating an archive, so it can be returned from a worker process
+    """
+    core_type: str
+    supported_core_type: bool = False
+    validated: bool = False
+    valid: bool = False
+    dataset_type: str = ""
+    breakdowns: Dict = field(default_factory=dict)
+    core_validation: Any = None
+    extension_validations: Any = None
+    metadata: Dict = field(default_factory=dict)
+    has_eml: bool = False
+    map_image: Union[str, None] = None
+
+
+def init_worker(config: AppConfig):
+    """
+    Initialise a validation worker process, rendering the basemap up front so requests don't pay for it
+    :param config:
+    :return:
+    """
+    try:
+        get_basemap(config)
+    except Exception as e:
+        logging.error(f"Error rendering basemap: {e}", exc_info=True)
+
+
+def validate_dwca_file(temp_file_path: str, config: AppConfig, preview_map: bool = True,
+                       require_metadata: bool = False) -> ArchiveValidation:
+    """
+    Read and validate the darwin core archive at the supplied path. This is CPU bound and
+    is intended to be run in the validation executor's process pool.
+    :param temp_file_path: path to the archive
+    :param config:
+    :param preview_map: generate a preview map of the core records
+    :param require_metadata: skip validation if the mandatory EML fields are missing
+    :return: the validation result
+    """
+    with DwCAReader(temp_file_path) as dwca:
+
+        # check the core type is supported
+        core_type = dwca.descriptor.core.type
+        result = ArchiveValidation(core_type=core_type)
+        if core_type not in SUPPORTED_CORE_TYPES:
+            return result
+        result.supported_core_type = True
+
+        # check metadata
+        if dwca.metadata:
+            result.has_eml = True
+            result.metadata = extract_metadata(dwca.metadata)
+
+        if require_metadata and not has_required_metadata(result.metadata):
+            return result
+
+        # validate large cores a partition at a time, so memory use doesn't grow with the dataset
+        large_core = is_large_core(dwca, config)
+        if large_core:
+            validate_report = validate_archive_in_chunks(dwca, config)
+        else:
+            validate_report = validate_archive(dwca)
+        result.validated = True
+        result.valid = validate_report.valid
+        result.dataset_type = validate_report.dataset_type
+        result.breakdowns = validate_report.breakdowns
+        result.core_validation = jsonable_encoder(validate_report.core)
+        result.extension_validations = jsonable_encoder(validate_report.extensions)
+
+        # generate a preview map
+        if preview_map and large_core:
+            coordinate_chunks = read_coordinate_chunks(dwca, config.validation_chunk_rows)
+            result.map_image = generate_chunked_preview_map(coordinate_chunks, config)
+        elif preview_map:
+            coordinates_df = read_coordinates(dwca)
+            result.map_image = generate_preview_map(coordinates_df, config)
+
+    return result
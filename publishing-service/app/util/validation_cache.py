@@ -0,0 +1,271 @@
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import asdict
+from typing import Dict, List, Union
+
+from fastapi.encoders import jsonable_encoder
+
+from util.config import AppConfig, app_config
+from util.executor import ValidationExecutor
+from util.upload import StoredUpload
+from util.validation import ArchiveValidation, validate_dwca_file
+from util.zip_safety import scan_archive
+
+# settings that change the result of validating an archive, so are part of its cache key
+CACHE_KEY_SETTINGS = (
+    'geopandas_dataset', 'default_min_latitude', 'default_max_latitude', 'default_min_longitude',
+    'default_max_longitude', 'map_density_threshold', 'map_density_cell_size', 'validation_chunk_threshold',
+    'validation_chunk_rows'
+)
+
+# packages whose version changes the result of validating an archive, so are part of its cache key
+VALIDATOR_PACKAGES = ('dwc_validator', 'dwca')
+
+
+class ValidationCache(ABC):
+    """
+    Cache of validation results keyed by the SHA-256 of the archive and the settings it was validated with.
+    Subclass this to provide another backend, and set validation_cache_backend to its dotted path. It will be
+    constructed with the app config.
+    """
+    @abstractmethod
+    def get(self, key: str) -> Union[ArchiveValidation, None]:
+        pass
+
+    @abstractmethod
+    def put(self, key: str, result: ArchiveValidation):
+        pass
+
+
+class NullValidationCache(ValidationCache):
+    """
+    Disables caching
+    """
+    def __init__(self, config: AppConfig = None):
+        pass
+
+    def get(self, key: str) -> Union[ArchiveValidation, None]:
+        return None
+
+    def put(self, key: str, result: ArchiveValidation):
+        pass
+
+
+class DiskValidationCache(ValidationCache):
+    """
+    Stores validation results as JSON files on local disk, in a directory only the service can write to.
+    Entries expire validation_cache_ttl seconds after they are stored, however often they are used, and the least
+    recently used entries are evicted when the cache exceeds validation_cache_max_size bytes. An entry's
+    modification time is when it was stored, and its access time when it was last used.
+    """
+    def __init__(self, config: AppConfig):
+        self.directory = config.validation_cache_dir
+        self.ttl = config.validation_cache_ttl
+        self.max_size = config.validation_cache_max_size
+        self.lock = threading.Lock()
+        _make_private_directory(self.directory)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str) -> Union[ArchiveValidation, None]:
+        path = self._path(key)
+        try:
+            stored = os.path.getmtime(path)
+            if time.time() - stored > self.ttl:
+                os.remove(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as f:
+                result = ArchiveValidation(**json.load(f))
+            # record the use for eviction, keeping the time it was stored for expiry
+            os.utime(path, (time.time(), stored))
+            return result
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.error(f"Error reading validation cache entry {key}: {e}")
+            return None
+
+    def put(self, key: str, result: ArchiveValidation):
+        # write to a temporary file first so readers never see a partial entry
+        fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(jsonable_encoder(asdict(result)), f)
+            os.replace(temp_path, self._path(key))
+        except Exception as e:
+            logging.error(f"Error writing validation cache entry {key}: {e}")
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Remove expired entries, then the least recently used entries until the cache is within its maximum size
+        """
+        with self.lock:
+            now = time.time()
+            entries = []
+            for entry in os.scandir(self.directory):
+                if not entry.name.endswith('.json'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if now - stat.st_mtime > self.ttl:
+                    self._remove(entry.path)
+                else:
+                    entries.append((max(stat.st_atime, stat.st_mtime), stat.st_size, entry.path))
+
+            total_size = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size:
+                    break
+                self._remove(path)
+                total_size -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _make_private_directory(directory: str):
+    # the cache is trusted, so other users mustn't be able to plant or alter entries
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    if os.stat(directory).st_uid != os.getuid():
+        raise PermissionError(f'The validation cache directory {directory} is not owned by the service')
+    os.chmod(directory, 0o700)
+
+
+def create_validation_cache(config: AppConfig) -> ValidationCache:
+    """
+    Create the validation cache for the configured backend - 'disk', 'none' or the dotted path of a ValidationCache subclass
+    :param config:
+    :return:
+    """
+    backend = config.validation_cache_backend
+    if backend == 'disk':
+        return DiskValidationCache(config)
+    if backend == 'none':
+        return NullValidationCache(config)
+    module_name, class_name = backend.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)(config)
+
+
+def cache_key(upload: StoredUpload, config: AppConfig, require_metadata: bool) -> str:
+    """
+    The cache key of a validation, from the SHA-256 of the archive, the settings that change the result and the
+    versions of the validator packages, so results from before a deploy that changes them aren't reused
+    :param upload: the stored upload
+    :param config:
+    :param require_metadata: validation is skipped if the mandatory EML fields are missing
+    :return:
+    """
+    settings = {name: getattr(config, name) for name in CACHE_KEY_SETTINGS}
+    settings['require_metadata'] = require_metadata
+    settings['validator_versions'] = validator_versions
+    settings_digest = hashlib.sha256(json.dumps(settings, sort_keys=True).encode('utf-8')).hexdigest()
+    return f'{upload.sha256}-{settings_digest[:16]}'
+
+
+def package_versions(packages: List[str]) -> Dict[str, str]:
+    """
+    Get the versions of the installed distributions providing the supplied top level packages. Packages installed
+    from a git repository include the commit, as their version isn't always changed between commits.
+    :param packages: the names packages are imported as
+    :return: the version of each package, or None if it isn't installed from a distribution
+    """
+    versions = {package: None for package in packages}
+    for distribution in importlib.metadata.distributions():
+        top_level = (distribution.read_text('top_level.txt') or '').split()
+        files = distribution.files or []
+        for package in packages:
+            if package in top_level or any(file.parts[0] == package for file in files):
+                version = distribution.version
+                direct_url = json.loads(distribution.read_text('direct_url.json') or '{}')
+                commit = direct_url.get('vcs_info', {}).get('commit_id')
+                versions[package] = f'{version}+{commit}' if commit else version
+    return versions
+
+
+validator_versions = package_versions(list(VALIDATOR_PACKAGES))
+
+
+def is_reusable(result: ArchiveValidation, preview_map: bool) -> bool:
+    """
+    Check a result has everything a request needs, rather than having stopped early
+    :param result:
+    :param preview_map: the request needs a preview map
+    :return:
+    """
+    if not result.supported_core_type:
+        return True
+    return result.validated and (not preview_map or result.map_image is not None)
+
+
+def validation_summary(upload: StoredUpload, result: ArchiveValidation) -> Dict:
+    """
+    Summary of a validation to record with the request
+    """
+    return {
+        "fileName": upload.file_name,
+        "size": upload.size,
+        "sha256": upload.sha256,
+        "coreType": result.core_type,
+        "datasetType": result.dataset_type,
+        "valid": result.valid,
+        "breakdowns": result.breakdowns
+    }
+
+
+async def validate_upload(upload: StoredUpload, config: AppConfig, executor: ValidationExecutor, cache: ValidationCache,
+                          preview_map: bool = True, require_metadata: bool = False) -> ArchiveValidation:
+    """
+    Validate an uploaded archive, reusing the result of a previous validation of the same content
+    :param upload: the stored upload
+    :param config:
+    :param executor:
+    :param cache:
+    :param preview_map: generate a preview map of the core records
+    :param require_metadata: skip validation if the mandatory EML fields are missing
+    :return: the validation result
+    :raises UnsafeArchiveException: if the archive exceeds the configured size or compression limits
+    :raises CorruptArchiveException: if the archive fails its integrity check
+    """
+    key = cache_key(upload, config, require_metadata)
+    result = await executor.run_io(cache.get, key)
+    if result is not None and is_reusable(result, preview_map):
+        logging.info(f"Using cached validation for {key}")
+        return result
+
+    # reject zip bombs and corrupt archives before they are opened in a worker
+    await executor.run_io(scan_archive, upload.path, config)
+    result = await executor.run_cpu(validate_dwca_file, upload.path, config, preview_map=preview_map,
+                                    require_metadata=require_metadata)
+    if is_reusable(result, preview_map):
+        await executor.run_io(cache.put, key, result)
+    return result
+
+
+validation_cache = create_validation_cache(app_config)
+
+
+def get_validation_cache():
+    """
+    Get the validation cache
+    :return:
+    """
+    return validation_cache
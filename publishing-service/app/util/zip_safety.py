@@ -0,0 +1,144 @@
+import gzip
+import logging
+import os
+import posixpath
+import tarfile
+import zipfile
+import zlib
+
+from util.config import AppConfig
+
+# members smaller than this are not held to the compression ratio limit, as small, repetitive files compress well
+RATIO_MIN_SIZE = 1024 * 1024
+GZIP_MAGIC = b'\x1f\x8b'
+
+
+class UnsafeArchiveException(Exception):
+    """
+    Raised when an archive exceeds the configured size, member or compression ratio limits, or has members that
+    would be written outside it
+    """
+    pass
+
+
+class CorruptArchiveException(Exception):
+    """
+    Raised when an archive can't be read, or a member fails its CRC check
+    """
+    pass
+
+
+def check_zip_limits(archive: zipfile.ZipFile, archive_size: int, config: AppConfig):
+    """
+    Check the sizes recorded in a zip's central directory against the configured limits, without
+    decompressing anything
+    :param archive: the open zip
+    :param archive_size: the size of the zip file in bytes
+    :param config:
+    :return:
+    :raises UnsafeArchiveException: if the archive exceeds a limit
+    """
+    members = archive.infolist()
+    if len(members) > config.archive_max_members:
+        raise UnsafeArchiveException(f'The archive contains {len(members)} files, more than the limit of {config.archive_max_members}')
+
+    uncompressed_size = 0
+    compressed_size = 0
+    for member in members:
+        if member.flag_bits & 0x1:
+            raise UnsafeArchiveException(f'The archive file {member.filename} is encrypted')
+        if posixpath.isabs(member.filename) or '..' in member.filename.split('/'):
+            raise UnsafeArchiveException(f'The archive file {member.filename} is outside the archive')
+        if member.file_size > RATIO_MIN_SIZE and \
+                member.file_size > config.archive_max_compression_ratio * max(member.compress_size, 1):
+            raise UnsafeArchiveException(f'The archive file {member.filename} exceeds the compression ratio limit of {config.archive_max_compression_ratio}')
+        uncompressed_size += member.file_size
+        compressed_size += member.compress_size
+
+    if uncompressed_size > config.archive_max_uncompressed_size:
+        raise UnsafeArchiveException(f'The archive expands to {uncompressed_size} bytes, more than the limit of {config.archive_max_uncompressed_size} bytes')
+    # members can only share compressed data if they overlap, which only zip bombs do
+    if compressed_size > archive_size:
+        raise UnsafeArchiveException('The archive files overlap')
+
+
+def check_tar_member(member: tarfile.TarInfo, members: int, uncompressed_size: int, archive_size: int,
+                     config: AppConfig):
+    """
+    Check a tar member, and the members before it, against the configured limits. Tars have no central directory,
+    so members are checked as their headers are read, and the compression ratio is that of the whole archive so far.
+    :param member: the member's header
+    :param members: the number of members up to and including this one
+    :param uncompressed_size: the total size of the members up to and including this one
+    :param archive_size: the size of the tar file in bytes
+    :param config:
+    :return:
+    :raises UnsafeArchiveException: if the archive exceeds a limit
+    """
+    if members > config.archive_max_members:
+        raise UnsafeArchiveException(f'The archive contains more than the limit of {config.archive_max_members} files')
+    if posixpath.isabs(member.name) or '..' in member.name.split('/'):
+        raise UnsafeArchiveException(f'The archive file {member.name} is outside the archive')
+    if not (member.isfile() or member.isdir()):
+        raise UnsafeArchiveException(f'The archive file {member.name} is not a regular file')
+    if uncompressed_size > config.archive_max_uncompressed_size:
+        raise UnsafeArchiveException(f'The archive expands to more than the limit of {config.archive_max_uncompressed_size} bytes')
+    if uncompressed_size > RATIO_MIN_SIZE and \
+            uncompressed_size > config.archive_max_compression_ratio * max(archive_size, 1):
+        raise UnsafeArchiveException(f'The archive exceeds the compression ratio limit of {config.archive_max_compression_ratio}')
+
+
+def scan_archive(temp_file_path: str, config: AppConfig):
+    """
+    Inspect an archive before it is opened for validation. A zip's central directory is checked against the
+    configured limits, then every member is decompressed in a streaming pass to verify its CRC. A tar's members are
+    checked against the same limits as their headers are read, and a gzipped tar is decompressed to the end to
+    verify its CRC. Nothing is extracted and only a chunk is held in memory at a time. Files that are
+    neither are left to the archive reader.
+    :param temp_file_path: path to the archive
+    :param config:
+    :return:
+    :raises UnsafeArchiveException: if the archive exceeds a limit
+    :raises CorruptArchiveException: if the archive can't be read or a member fails its CRC check
+    """
+    if not zipfile.is_zipfile(temp_file_path):
+        if tarfile.is_tarfile(temp_file_path):
+            _scan_tar(temp_file_path, config)
+        return
+
+    try:
+        with zipfile.ZipFile(temp_file_path) as archive:
+            check_zip_limits(archive, os.path.getsize(temp_file_path), config)
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                # reads are bounded by the member's recorded size, which has been checked, and the CRC is
+                # verified once it has all been read
+                with archive.open(member) as member_file:
+                    while member_file.read(config.upload_chunk_size):
+                        pass
+    except (zipfile.BadZipFile, zlib.error, EOFError, NotImplementedError, OSError) as e:
+        logging.info(f"Archive {temp_file_path} failed integrity check {e}")
+        raise CorruptArchiveException(f'The archive is corrupt: {e}') from e
+
+
+def _scan_tar(temp_file_path: str, config: AppConfig):
+    archive_size = os.path.getsize(temp_file_path)
+    members = 0
+    uncompressed_size = 0
+    with open(temp_file_path, 'rb') as f:
+        compressed = f.read(2) == GZIP_MAGIC
+    try:
+        # read as a stream, so each header is checked before the member's data is decompressed
+        with (gzip.open if compressed else open)(temp_file_path, 'rb') as stream:
+            with tarfile.open(fileobj=stream, mode='r|') as archive:
+                for member in archive:
+                    members += 1
+                    uncompressed_size += member.size
+                    check_tar_member(member, members, uncompressed_size, archive_size, config)
+            # read to the end, so the gzip checksum is verified
+            while stream.read(config.upload_chunk_size):
+                pass
+    except (tarfile.TarError, zlib.error, EOFError, OSError) as e:
+        logging.info(f"Archive {temp_file_path} failed integrity check {e}")
+        raise CorruptArchiveException(f'The archive is corrupt: {e}') from e
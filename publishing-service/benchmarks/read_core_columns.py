@@ -0,0 +1,80 @@
+"""
+Compare reading columns of a core data file with read_core_columns and with the DwCAReader's pandas reader.
+
+Writes a synthetic occurrence archive of the requested size, then times reading its coordinates, and a mix of
+categorical and numeric terms, both ways, and reports the memory used by the resulting DataFrames.
+
+    python benchmarks/read_core_columns.py --rows 2000000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+from dwca.read import DwCAReader  # noqa: E402
+
+from util.archive import read_core_columns, column_type, _pandas_type  # noqa: E402
+
+TERMS = ['occurrenceID', 'basisOfRecord', 'decimalLatitude', 'decimalLongitude', 'coordinateUncertaintyInMeters',
+         'scientificName', 'kingdom', 'family', 'countryCode', 'stateProvince', 'eventDate', 'recordedBy',
+         'minimumElevationInMeters', 'maximumElevationInMeters', 'locality', 'occurrenceRemarks']
+
+COORDINATES = ['decimalLatitude', 'decimalLongitude']
+MIXED = ['basisOfRecord', 'countryCode', 'stateProvince', 'decimalLatitude', 'decimalLongitude',
+         'coordinateUncertaintyInMeters']
+
+
+def write_archive(path: str, rows: int):
+    fields = '\n'.join(f'<field index="{i}" term="http://rs.tdwg.org/dwc/terms/{term}"/>' for i, term in enumerate(TERMS))
+    meta = f'''<archive xmlns="http://rs.tdwg.org/dwc/text/">
+<core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" fieldsEnclosedBy="" ignoreHeaderLines="1" rowType="http://rs.tdwg.org/dwc/terms/Occurrence">
+<files><location>occurrence.txt</location></files>
+<id index="0"/>
+{fields}
+</core></archive>'''
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('meta.xml', meta)
+        with archive.open('occurrence.txt', 'w', force_zip64=True) as core:
+            core.write(('\t'.join(TERMS) + '\n').encode())
+            for i in range(rows):
+                core.write((f'occ-{i}\t{"HumanObservation" if i % 3 else "PreservedSpecimen"}\t{-10 - (i % 3000) / 100}\t'
+                            f'{115 + (i % 3500) / 100}\t{(i % 50) * 10}\tSpecies {i % 997}\tAnimalia\tFamily {i % 97}\tAU\t'
+                            f'State {i % 8}\t2020-01-{1 + i % 28:02d}\tObserver {i % 211}\t{i % 400}\t{i % 400 + 10}\t'
+                            f'Locality {i % 5000}\tSeen near the track\n').encode())
+
+
+def measure(name: str, read):
+    start = time.perf_counter()
+    dataframe = read()
+    elapsed = time.perf_counter() - start
+    memory = dataframe.memory_usage(deep=True).sum() / 1024 / 1024
+    print(f'{name:40} {elapsed:8.2f}s {memory:10.1f} MiB')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=2000000, help='the number of records in the core')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, 'archive.zip')
+        write_archive(path, args.rows)
+        with DwCAReader(path) as dwca:
+            core = dwca.absolute_temporary_path(dwca.descriptor.core.file_location)
+            print(f'{args.rows} records, {len(TERMS)} columns, {os.path.getsize(core) / 1024 / 1024:.0f} MiB core')
+            for name, columns in (('coordinates', COORDINATES), ('mixed terms', MIXED)):
+                dtypes = {column: _pandas_type(column) for column in columns if column_type(column) is not None}
+                measure(f'{name}, pandas', lambda: dwca.pd_read(dwca.descriptor.core.file_location, usecols=columns,
+                                                                parse_dates=False))
+                measure(f'{name}, pandas with compact types',
+                        lambda: dwca.pd_read(dwca.descriptor.core.file_location, usecols=columns, parse_dates=False,
+                                             dtype=dtypes))
+                measure(f'{name}, read_core_columns', lambda: read_core_columns(dwca, columns))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+import zipfile
+from typing import List
+
+META = '''<archive xmlns="http://rs.tdwg.org/dwc/text/" metadata="eml.xml">
+<core encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" fieldsEnclosedBy="" ignoreHeaderLines="1" rowType="http://rs.tdwg.org/dwc/terms/Occurrence">
+<files><location>occurrence.txt</location></files>
+<id index="0"/>
+<field index="0" term="http://rs.tdwg.org/dwc/terms/occurrenceID"/>
+<field index="1" term="http://rs.tdwg.org/dwc/terms/decimalLatitude"/>
+<field index="2" term="http://rs.tdwg.org/dwc/terms/decimalLongitude"/>
+<field index="3" term="http://rs.tdwg.org/dwc/terms/scientificName"/>
+<field index="4" term="http://rs.tdwg.org/dwc/terms/basisOfRecord"/>
+</core></archive>'''
+
+EML = '''<eml:eml xmlns:eml="eml://ecoinformatics.org/eml-2.1.1"><dataset><title>Test dataset</title>
+<abstract><para>A test dataset</para></abstract>
+<intellectualRights><para><ulink url="https://creativecommons.org/licenses/by/4.0/"><citetitle>CC-BY</citetitle></ulink></para></intellectualRights>
+</dataset></eml:eml>'''
+
+HEADER = 'occurrenceID\tdecimalLatitude\tdecimalLongitude\tscientificName\tbasisOfRecord\n'
+
+
+def occurrence_rows(count: int) -> List[str]:
+    """
+    Tab separated occurrence records for the META core
+    """
+    return [f'occ-{i}\t{-10 - (i % 30) - 0.5}\t{115 + (i % 35)}\tSpecies {i % 7}\t'
+            f'{"HumanObservation" if i % 3 else "PreservedSpecimen"}\n' for i in range(count)]
+
+
+def make_archive(path: str, rows: List[str], meta: str = META, header: str = HEADER) -> str:
+    """
+    Write a darwin core archive with an occurrence core of the supplied rows
+    """
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('meta.xml', meta)
+        archive.writestr('eml.xml', EML)
+        archive.writestr('occurrence.txt', header + ''.join(rows))
+    return path
@@ -0,0 +1,52 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the app is run from its own directory, so its modules are imported as top level packages
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'app'))
+
+# the app's singletons are created from the environment on import, so keep their files out of the way
+work_dir = tempfile.mkdtemp(prefix='publishing-service-tests-')
+for name, value in {
+    'AIRFLOW_API_BASE_URL': 'http://airflow.test/api/v1',
+    'COLLECTORY_LOOKUP_URL': 'http://collectory.test/ws',
+    'S3_BUCKET_NAME': 'publishing-test',
+    'ALA_API_KEY': 'test',
+    'AIRFLOW_USERNAME': 'test',
+    'AIRFLOW_PASSWORD': 'test',
+    'AWS_ACCESS_KEY_ID': 'test',
+    'AWS_SECRET_ACCESS_KEY': 'test',
+    'AWS_DEFAULT_REGION': 'us-east-1',
+    'VALIDATION_CACHE_DIR': os.path.join(work_dir, 'validation-cache'),
+    'UPLOAD_SESSION_DIR': os.path.join(work_dir, 'upload-sessions'),
+    'REQUEST_REGISTRY_PATH': os.path.join(work_dir, 'requests.db')
+}.items():
+    os.environ.setdefault(name, value)
+
+
+@pytest.fixture
+def config(tmp_path):
+    """
+    App config with its working directories under the test's temporary directory
+    """
+    from util.config import AppConfig
+    return AppConfig(validation_cache_dir=str(tmp_path / 'validation-cache'),
+                     upload_session_dir=str(tmp_path / 'upload-sessions'),
+                     request_registry_path=str(tmp_path / 'requests.db'))
+
+
+@pytest.fixture
+def s3(config):
+    """
+    A local S3 stand-in with the configured bucket
+    """
+    moto = pytest.importorskip('moto')
+    import util.storage as storage
+    with moto.mock_aws():
+        storage._clients.clear()
+        client = storage.s3_client(config)
+        client.create_bucket(Bucket=config.s3_bucket_name)
+        yield client
+    storage._clients.clear()
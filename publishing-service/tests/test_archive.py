@@ -0,0 +1,94 @@
+import pandas as pd
+import pytest
+from dwca.read import DwCAReader
+
+from archives import META, make_archive, occurrence_rows
+
+pytest.importorskip('dwc_validator')
+from util.archive import read_core_columns, read_coordinates  # noqa: E402
+from dwc_validator.exceptions import CoordinatesException  # noqa: E402
+
+COLUMNS = ['decimalLatitude', 'decimalLongitude', 'basisOfRecord']
+
+
+def _pandas_columns(dwca) -> pd.DataFrame:
+    dataframe = dwca.pd_read(dwca.descriptor.core.file_location, usecols=COLUMNS, parse_dates=False)[COLUMNS]
+    return dataframe.astype({'decimalLatitude': 'float64', 'decimalLongitude': 'float64', 'basisOfRecord': 'category'})
+
+
+def _assert_same_values(dataframe: pd.DataFrame, expected: pd.DataFrame):
+    pd.testing.assert_frame_equal(dataframe.reset_index(drop=True), expected.reset_index(drop=True),
+                                  check_categorical=False)
+
+
+def test_columns_are_read_as_compact_types(tmp_path):
+    path = make_archive(str(tmp_path / 'archive.zip'), occurrence_rows(100))
+    with DwCAReader(path) as dwca:
+        dataframe = read_core_columns(dwca, COLUMNS + ['notInTheCore'])
+        expected = _pandas_columns(dwca)
+
+    assert list(dataframe.columns) == COLUMNS
+    assert dataframe['decimalLatitude'].dtype == 'float64'
+    assert dataframe['basisOfRecord'].dtype == 'category'
+    _assert_same_values(dataframe, expected)
+
+
+def test_rows_with_missing_fields_are_read_as_pandas_reads_them(tmp_path):
+    rows = occurrence_rows(100)
+    rows[40] = 'occ-40\t-12.5\n'
+    path = make_archive(str(tmp_path / 'archive.zip'), rows)
+    with DwCAReader(path) as dwca:
+        dataframe = read_core_columns(dwca, COLUMNS)
+        expected = _pandas_columns(dwca)
+
+    assert len(dataframe) == 100
+    _assert_same_values(dataframe, expected)
+
+
+def test_chunks_with_missing_fields_are_read_as_pandas_reads_them(tmp_path):
+    # big enough for several of arrow's blocks, with the short row after the first
+    rows = occurrence_rows(60000)
+    rows[45000] = 'occ-45000\t-12.5\n'
+    path = make_archive(str(tmp_path / 'archive.zip'), rows)
+    with DwCAReader(path) as dwca:
+        chunks = list(read_core_columns(dwca, COLUMNS, chunk_rows=10000))
+        expected = _pandas_columns(dwca)
+
+    assert len(chunks) > 1
+    _assert_same_values(pd.concat([chunk.astype({'basisOfRecord': str}) for chunk in chunks]),
+                        expected.astype({'basisOfRecord': str}))
+
+
+def test_rows_with_extra_fields_are_read_as_pandas_reads_them(tmp_path):
+    rows = occurrence_rows(100)
+    rows[40] = 'occ-40\t-12.5\t115\tSpecies 1\tHumanObservation\textra\n'
+    path = make_archive(str(tmp_path / 'archive.zip'), rows)
+    with DwCAReader(path) as dwca:
+        dataframe = read_core_columns(dwca, COLUMNS)
+        expected = _pandas_columns(dwca)
+
+    assert len(dataframe) == 100
+    _assert_same_values(dataframe, expected)
+
+
+def test_invalid_coordinates_are_rejected(tmp_path):
+    rows = occurrence_rows(100)
+    rows[40] = 'occ-40\t-12.5\tnot a number\tSpecies 1\tHumanObservation\n'
+    rows[60] = 'occ-60\t-12.5\n'
+    path = make_archive(str(tmp_path / 'archive.zip'), rows)
+    with DwCAReader(path) as dwca:
+        with pytest.raises(CoordinatesException):
+            read_coordinates(dwca)
+
+
+def test_chunks_of_a_core_with_default_values_and_missing_fields_are_read(tmp_path):
+    meta = META.replace('</core>', '<field term="http://rs.tdwg.org/dwc/terms/country" default="Australia"/>\n</core>')
+    rows = occurrence_rows(60000)
+    rows[45000] = 'occ-45000\t-12.5\n'
+    path = make_archive(str(tmp_path / 'archive.zip'), rows, meta)
+    with DwCAReader(path) as dwca:
+        chunks = list(read_core_columns(dwca, COLUMNS, chunk_rows=10000))
+        expected = _pandas_columns(dwca)
+
+    _assert_same_values(pd.concat([chunk.astype({'basisOfRecord': str}) for chunk in chunks]),
+                        expected.astype({'basisOfRecord': str}))
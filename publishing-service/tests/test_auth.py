@@ -0,0 +1,119 @@
+import asyncio
+import json
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import Depends, FastAPI, Request
+from fastapi.testclient import TestClient
+
+import util.auth as auth
+import util.ttl_cache as ttl_cache
+from util.auth import JWTBearer, TokenVerifier, InvalidTokenException
+
+AUDIENCE = 'publishing'
+ISSUER = 'https://auth.example.org'
+
+
+def _key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+def _write_jwks(path, keys):
+    jwks = {'keys': [{**json.loads(jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key())), 'kid': kid, 'use': 'sig',
+                      'alg': 'RS256'} for kid, key in keys.items()]}
+    path.write_text(json.dumps(jwks))
+
+
+def _token(key, kid: str, expires_in: int = 600, **claims) -> str:
+    payload = {'userid': 'user-1', 'email': 'user@example.org', 'name': 'User', 'role': ['ROLE_DATA_PUBLISHER'],
+               'aud': AUDIENCE, 'iss': ISSUER, 'exp': int(time.time()) + expires_in, **claims}
+    return jwt.encode(payload, key, algorithm='RS256', headers={'kid': kid})
+
+
+@pytest.fixture
+def signing_key():
+    return _key()
+
+
+@pytest.fixture
+def jwks_file(tmp_path, signing_key):
+    path = tmp_path / 'jwks.json'
+    _write_jwks(path, {'key-1': signing_key})
+    return path
+
+
+@pytest.fixture
+def verifier(config, jwks_file):
+    config.jwks_url = str(jwks_file)
+    config.jwt_audience = AUDIENCE
+    config.jwt_issuer = ISSUER
+    return TokenVerifier(config)
+
+
+@pytest.fixture
+def client(verifier):
+    app = FastAPI()
+    bearer = JWTBearer(verifier=verifier)
+
+    @app.get('/user')
+    async def user(request: Request, token: str = Depends(bearer)):
+        return {'id': request.state.user.id, 'isPublisher': request.state.user.is_publisher}
+
+    return TestClient(app)
+
+
+def _get(client, token: str):
+    return client.get('/user', headers={'Authorization': f'Bearer {token}'})
+
+
+def test_valid_token_is_accepted(client, signing_key):
+    response = _get(client, _token(signing_key, 'key-1'))
+    assert response.status_code == 200
+    assert response.json() == {'id': 'user-1', 'isPublisher': True}
+
+
+@pytest.mark.parametrize('token', [
+    pytest.param(lambda key: _token(_key(), 'key-1'), id='wrong key'),
+    pytest.param(lambda key: _token(key, 'key-1', expires_in=-60), id='expired'),
+    pytest.param(lambda key: _token(key, 'key-1', aud='another-service'), id='wrong audience'),
+    pytest.param(lambda key: _token(key, 'key-1', iss='https://another.example.org'), id='wrong issuer'),
+    pytest.param(lambda key: _token(key, 'key-2'), id='unknown key'),
+    pytest.param(lambda key: jwt.encode({'userid': 'user-1'}, 'secret', algorithm='HS256'), id='wrong algorithm')
+])
+def test_invalid_tokens_are_rejected(client, signing_key, token):
+    assert _get(client, token(signing_key)).status_code == 403
+
+
+def test_unknown_key_reloads_the_key_set_once_within_the_cooldown(verifier, jwks_file, signing_key, monkeypatch):
+    loads = []
+    load_keys = verifier._load_keys
+    monkeypatch.setattr(verifier, '_load_keys', lambda: loads.append(1) or load_keys())
+    asyncio.run(verifier.authenticate(_token(signing_key, 'key-1')))
+    assert len(loads) == 1
+
+    # the key set is rotated, and a token signed by the new key arrives after the cooldown
+    new_key = _key()
+    _write_jwks(jwks_file, {'key-1': signing_key, 'key-2': new_key})
+    verifier.keys_loaded -= auth.KEY_RELOAD_COOLDOWN + 1
+    assert asyncio.run(verifier.authenticate(_token(new_key, 'key-2'))).id == 'user-1'
+    assert len(loads) == 2
+
+    # tokens for keys that still aren't in the set don't reload it again within the cooldown
+    for _ in range(3):
+        with pytest.raises(InvalidTokenException):
+            asyncio.run(verifier.authenticate(_token(_key(), 'key-3')))
+    assert len(loads) == 2
+
+
+def test_cached_user_is_dropped_when_the_token_expires(verifier, signing_key, monkeypatch):
+    token = _token(signing_key, 'key-1', expires_in=60)
+    asyncio.run(verifier.authenticate(token))
+    assert verifier.users.get(token) is not None
+
+    now = time.monotonic()
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', lambda: now + 59)
+    assert verifier.users.get(token) is not None
+    monkeypatch.setattr(ttl_cache.time, 'monotonic', lambda: now + 61)
+    assert verifier.users.get(token) is None
@@ -0,0 +1,113 @@
+import logging
+import zipfile
+
+import pytest
+from dwca.read import DwCAReader
+from fastapi.encoders import jsonable_encoder
+
+from archives import META, make_archive, occurrence_rows
+
+validate_dwca = pytest.importorskip('dwc_validator.validate_dwca')
+from util.chunked_validation import validate_archive_in_chunks, merge_reports, _read_records, \
+    UnpartitionableArchiveException, DUPLICATE_ID_ERROR  # noqa: E402
+
+EXTENSION_META = META.replace('</core>', '</core>\n' + '''<extension encoding="UTF-8" fieldsTerminatedBy="\\t" linesTerminatedBy="\\n" fieldsEnclosedBy="" ignoreHeaderLines="1" rowType="http://rs.gbif.org/terms/1.0/Multimedia">
+<files><location>multimedia.txt</location></files>
+<coreid index="0"/>
+<field index="1" term="http://purl.org/dc/terms/identifier"/>
+<field index="2" term="http://purl.org/dc/terms/type"/>
+</extension>''')
+
+
+def _archive(path: str) -> str:
+    rows = occurrence_rows(95)
+    # values the validator reports on, spread across partitions
+    rows[7] = 'occ-7\t-95.5\t115\tSpecies 0\tHumanObservation\n'
+    rows[52] = 'occ-52\t-10.5\tnot a number\tNot a species\tUnknownBasis\n'
+    rows[90] = 'occ-90\t\t\tSpecies 6\tPreservedSpecimen\n'
+    # media for core records in other partitions, and for a record that isn't in the core
+    media = [f'occ-{i}\thttps://example.org/{i}.jpg\tStillImage\n' for i in (93, 3, 51, 3, 12)]
+    media.append('occ-missing\thttps://example.org/missing.jpg\tStillImage\n')
+    make_archive(path, rows, EXTENSION_META)
+    with zipfile.ZipFile(path, 'a') as archive:
+        archive.writestr('multimedia.txt', 'coreid\tidentifier\ttype\n' + ''.join(media))
+    return path
+
+
+def test_partitioned_report_matches_a_single_pass(config, tmp_path, caplog):
+    path = _archive(str(tmp_path / 'archive.zip'))
+    config.validation_chunk_rows = 20
+
+    caplog.set_level(logging.INFO)
+    with DwCAReader(path) as dwca:
+        expected = jsonable_encoder(validate_dwca.validate_archive(dwca))
+        merged = jsonable_encoder(validate_archive_in_chunks(dwca, config))
+        # the archive's files are restored afterwards
+        assert jsonable_encoder(validate_dwca.validate_archive(dwca)) == expected
+
+    assert merged == expected
+    assert 'in 5 partitions' in caplog.text
+
+
+def test_records_are_copied_as_they_are(tmp_path):
+    path = make_archive(str(tmp_path / 'archive.zip'), [], META.replace('fieldsEnclosedBy=""', 'fieldsEnclosedBy="&quot;"'))
+    text = 'occ-1\t"a\tquoted\nvalue"\t115\r\n\nocc-2\t1.50\t115.0\tSpecies\tHuman'
+    with DwCAReader(path) as dwca:
+        data_file = tmp_path / 'occurrence.txt'
+        data_file.write_bytes(text.encode('utf-8'))
+        with open(data_file, newline='') as f:
+            records = list(_read_records(f, dwca.descriptor.core, 0))
+    assert records == [('occ-1\t"a\tquoted\nvalue"\t115\r\n', 'occ-1'), ('occ-2\t1.50\t115.0\tSpecies\tHuman\n', 'occ-2')]
+
+
+def test_reports_are_merged_by_field():
+    reports = [
+        {'record_count': 2, 'valid': True, 'record_type': 'Occurrence', 'column_counts': {'a': 2},
+         'errors': [{'row': 1, 'error': 'x'}], 'unrecognised_taxa': ['a', 'c']},
+        {'record_count': 3, 'valid': False, 'record_type': 'Occurrence', 'column_counts': {'a': 1, 'b': 3},
+         'errors': [{'row': 0, 'error': 'y'}], 'unrecognised_taxa': ['b', 'c']}
+    ]
+    assert merge_reports(reports, [range(0, 2), range(2, 5)]) == {
+        'record_count': 5, 'valid': False, 'record_type': 'Occurrence', 'column_counts': {'a': 3, 'b': 3},
+        'errors': [{'row': 1, 'error': 'x'}, {'row': 2, 'error': 'y'}], 'unrecognised_taxa': ['a', 'b', 'c']
+    }
+
+
+def test_ids_in_more_than_one_partition_are_reported(config, tmp_path):
+    rows = occurrence_rows(30)
+    rows[25] = rows[25].replace('occ-25', 'occ-3')
+    rows[28] = rows[28].replace('occ-28', 'occ-12')
+    path = make_archive(str(tmp_path / 'archive.zip'), rows)
+    config.validation_chunk_rows = 10
+
+    with DwCAReader(path) as dwca:
+        report = jsonable_encoder(validate_archive_in_chunks(dwca, config))
+
+    assert report['valid'] is False
+    errors = [error for error in report['core']['errors'] if error.get('error') == DUPLICATE_ID_ERROR]
+    assert len(errors) == 1
+    assert sorted(errors[0]['ids']) == ['occ-12', 'occ-3']
+
+
+def test_unknown_report_fields_are_an_error(config, tmp_path, monkeypatch):
+    import util.chunked_validation as chunked_validation
+    path = make_archive(str(tmp_path / 'archive.zip'), occurrence_rows(30))
+    config.validation_chunk_rows = 10
+    monkeypatch.setattr(chunked_validation, 'REPORT_FIELDS', {})
+
+    with DwCAReader(path) as dwca:
+        with pytest.raises(UnpartitionableArchiveException):
+            validate_archive_in_chunks(dwca, config)
+        # the archive's files are restored
+        assert len(dwca.pd_read(dwca.descriptor.core.file_location)) == 30
+
+
+def test_cores_that_fit_in_a_partition_are_validated_in_one_pass(config, tmp_path, monkeypatch):
+    import util.chunked_validation as chunked_validation
+    path = make_archive(str(tmp_path / 'archive.zip'), occurrence_rows(30))
+    config.validation_chunk_rows = 30
+    monkeypatch.setattr(chunked_validation, 'REPORT_FIELDS', {})
+
+    with DwCAReader(path) as dwca:
+        expected = jsonable_encoder(validate_dwca.validate_archive(dwca))
+        assert jsonable_encoder(validate_archive_in_chunks(dwca, config)) == expected
@@ -0,0 +1,24 @@
+import asyncio
+import operator
+import os
+
+import pytest
+
+pytest.importorskip('dwc_validator')
+from util.executor import ValidationExecutor, WorkerFailedException  # noqa: E402
+
+
+def test_process_pool_is_replaced_when_a_worker_dies(config):
+    config.validation_workers = 1
+    executor = ValidationExecutor(config)
+
+    async def run():
+        with pytest.raises(WorkerFailedException):
+            await executor.run_cpu(os._exit, 1)
+        return await executor.run_cpu(operator.add, 1, 2)
+
+    try:
+        assert asyncio.run(run()) == 3
+        assert executor.stats()['validation']['failed'] == 1
+    finally:
+        executor.shutdown()
@@ -0,0 +1,121 @@
+import json
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from routers.licences import router
+from util.licences import LicenceRegistry, get_licence_registry, normalise_licence_url
+
+BASELINE = {
+    'CC0': 'creativecommons.org/publicdomain/zero/1.0',
+    'CC_BY_4_0': 'creativecommons.org/licenses/by/4.0',
+    'CC_BY_NC_4_0': 'creativecommons.org/licenses/by-nc/4.0',
+    'CC_BY_NC_SA_4_0': 'creativecommons.org/licenses/by-nc-sa/4.0',
+    'CC_BY_3_0': 'creativecommons.org/licenses/by/3.0',
+    'CC_BY_NC_3_0': 'creativecommons.org/licenses/by-nc/3.0',
+    'CC_BY_NC_SA_3_0': 'creativecommons.org/licenses/by-nc-sa/3.0',
+    'CC_BY_NC_3_0_AU': 'creativecommons.org/licenses/by-nc/3.0/au',
+    'CC_BY_4_0_AU': 'creativecommons.org/licenses/by/4.0/au',
+    'CC_BY_NC_4_0_AU': 'creativecommons.org/licenses/by-nc/4.0/au',
+    'CC_BY_NC_SA_4_0_AU': 'creativecommons.org/licenses/by-nc-sa/4.0/au',
+    'CC_BY_3_0_AU': 'creativecommons.org/licenses/by/3.0/au',
+    'CC_BY_NC_SA_3_0_AU': 'creativecommons.org/licenses/by-nc-sa/3.0/au'
+}
+
+# ways the same licence is written in EML
+VARIANTS = [
+    'https://{}/legalcode',
+    'https://{}/',
+    'https://{}',
+    'http://{}/',
+    'https://www.{}/',
+    'http://www.{}',
+    '{}',
+    'https://{}/legalcode.en',
+    'https://{}/legalcode.de',
+    'https://{}/legalcode.txt',
+    'https://{}/deed',
+    'https://{}/deed.en',
+    'https://{}/deed.zh_tw',
+    'https://{}/deed.pt-br',
+    'https://{}/?ref=chooser',
+    ' HTTPS://{}/LEGALCODE ',
+]
+
+
+@pytest.fixture
+def registry(config):
+    return LicenceRegistry(config)
+
+
+def test_baseline_licences_are_loaded(registry):
+    assert set(registry.licences) == set(BASELINE)
+
+
+@pytest.mark.parametrize('key,path', BASELINE.items())
+@pytest.mark.parametrize('variant', VARIANTS)
+def test_licence_url_variants_are_recognised(registry, key, path, variant):
+    url = variant.format(path.upper() if variant.isupper() else path)
+    assert registry.get(url).key == key
+
+
+@pytest.mark.parametrize('url', [
+    None,
+    '',
+    'https://creativecommons.org/licenses/by/5.0/',
+    'https://creativecommons.org/licenses/by/4.0/nz/',
+    'https://creativecommons.org/licenses/by-sa/4.0/',
+    'https://example.org/licenses/by/4.0/',
+    'https://creativecommons.org/licenses/by/4.0/legalcodes'
+])
+def test_other_urls_are_not_recognised(registry, url):
+    assert registry.get(url) is None
+
+
+def test_jurisdiction_ports_are_kept():
+    assert normalise_licence_url('https://creativecommons.org/licenses/by/4.0/au/legalcode.en') == \
+        'creativecommons.org/licenses/by/4.0/au'
+    assert normalise_licence_url('https://creativecommons.org/licenses/by/4.0/au/') != \
+        normalise_licence_url('https://creativecommons.org/licenses/by/4.0/')
+
+
+def test_licences_file_adds_and_replaces_licences(config, tmp_path):
+    licences_file = tmp_path / 'licences.json'
+    licences_file.write_text(json.dumps({
+        'CC_BY_4_0': {'url': 'https://creativecommons.org/licenses/by/4.0/legalcode', 'acronym': 'CC-BY',
+                      'version': '4.0', 'name': 'Attribution 4.0 International',
+                      'aliases': ['https://opensource.org/licenses/cc-by-4.0']},
+        'ODBL': {'url': 'https://opendatacommons.org/licenses/odbl/1-0/', 'acronym': 'ODbL', 'version': '1.0',
+                 'name': 'Open Data Commons Open Database License'}
+    }))
+    config.licences_file = str(licences_file)
+    registry = LicenceRegistry(config)
+
+    assert set(registry.licences) == set(BASELINE) | {'ODBL'}
+    assert registry.get('http://www.opendatacommons.org/licenses/odbl/1-0').key == 'ODBL'
+    assert registry.get('https://opensource.org/licenses/cc-by-4.0/').key == 'CC_BY_4_0'
+    assert registry.get('https://creativecommons.org/licenses/by/4.0/').name == 'Attribution 4.0 International'
+    assert registry.etag != LicenceRegistry(config.model_copy(update={'licences_file': None})).etag
+
+
+def test_licences_are_served_with_an_etag(registry):
+    app = FastAPI()
+    app.include_router(router)
+    app.dependency_overrides[get_licence_registry] = lambda: registry
+    client = TestClient(app)
+
+    response = client.get('/licences')
+    assert response.status_code == 200
+    assert set(response.json()) == set(BASELINE)
+    etag = response.headers['ETag']
+    assert etag == registry.etag
+
+    response = client.get('/licences', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['ETag'] == etag
+
+    response = client.get('/licences', headers={'If-None-Match': f'"stale", {etag}'})
+    assert response.status_code == 304
+    assert client.get('/licences', headers={'If-None-Match': '"stale"'}).status_code == 200
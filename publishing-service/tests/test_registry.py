@@ -0,0 +1,32 @@
+from util.auth import User
+from util.registry import RequestRegistry, INGEST
+
+OWNER = User('user-1', 'owner@example.org', 'Owner', is_admin=False, is_publisher=True)
+OTHER = User('user-2', 'other@example.org', 'Other', is_admin=False, is_publisher=True)
+
+
+def test_runs_are_recorded_against_validations(config):
+    registry = RequestRegistry(config)
+    registry.record_validation('request-1', OWNER, {'valid': True})
+    registry.record_run('request-1', 'ingest_dag', INGEST, OWNER, ['dr1'], 'Dataset')
+
+    record = registry.get('request-1')
+    assert record.dag_id == 'ingest_dag'
+    assert record.validation == {'valid': True}
+    assert [record.request_id for record in registry.list_for_user(OWNER.id, 10)] == ['request-1']
+
+
+def test_other_users_cannot_update_a_request(config):
+    registry = RequestRegistry(config)
+    registry.record_validation('request-1', OWNER, {'valid': True})
+    assert registry.is_owned_by('request-1', OWNER)
+    assert not registry.is_owned_by('request-1', OTHER)
+    assert registry.is_owned_by('request-2', OTHER)
+
+    registry.record_run('request-1', 'ingest_dag', INGEST, OTHER, ['dr2'], 'Other dataset')
+    registry.record_validation('request-1', OTHER, {'valid': False})
+    record = registry.get('request-1')
+    assert record.user_id == OWNER.id
+    assert record.dag_id is None
+    assert record.validation == {'valid': True}
+    assert registry.list_for_user(OTHER.id, 10) == []
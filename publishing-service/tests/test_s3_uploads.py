@@ -0,0 +1,87 @@
+import os
+import urllib.parse
+
+import pytest
+import requests
+
+from archives import make_archive, occurrence_rows
+from util.storage import presign_upload, download_archive, upload_key
+from util.upload import UploadTooLargeException
+
+USER_ID = 'user-1'
+REQUEST_ID = '6a0e3f52-9d4c-4c57-bb1c-0d3bf1b0c5a4'
+
+
+def _signed_headers(url: str):
+    query = urllib.parse.parse_qs(urllib.parse.urlparse(url).query)
+    return query['X-Amz-SignedHeaders'][0].split(';')
+
+
+def test_presigned_put_signs_the_content_length(config, s3):
+    urls = presign_upload(config, upload_key(USER_ID, REQUEST_ID), 1000)
+    assert 'content-length' in _signed_headers(urls['url'])
+
+
+def test_presigned_parts_sign_their_content_length(config, s3):
+    config.presigned_multipart_threshold = 100
+    config.presigned_part_size = 40
+    urls = presign_upload(config, upload_key(USER_ID, REQUEST_ID), 101)
+    assert len(urls['partUrls']) == 3
+    assert all('content-length' in _signed_headers(url) for url in urls['partUrls'])
+
+
+def test_presigned_upload_can_be_downloaded(config, s3, tmp_path):
+    data = os.urandom(1000)
+    key = upload_key(USER_ID, REQUEST_ID)
+    response = requests.put(presign_upload(config, key, len(data))['url'], data=data)
+    assert response.status_code == 200
+
+    upload = download_archive(config, key, str(tmp_path / 'archive.zip'), 'archive.zip')
+    assert upload.size == len(data)
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+
+
+def test_download_rejects_objects_over_the_maximum_size(config, s3, tmp_path):
+    config.max_upload_size = 1000
+    key = upload_key(USER_ID, REQUEST_ID)
+    s3.put_object(Bucket=config.s3_bucket_name, Key=key, Body=b'x' * 1001)
+
+    temp_path = tmp_path / 'archive.zip'
+    with pytest.raises(UploadTooLargeException):
+        download_archive(config, key, str(temp_path))
+    assert not temp_path.exists()
+
+
+def test_presign_put_and_validate(config, s3, tmp_path):
+    pytest.importorskip('dwc_validator')
+    import jwt
+    from fastapi.testclient import TestClient
+    import main
+
+    token = jwt.encode({'userid': USER_ID, 'email': 'user@example.org', 'name': 'User',
+                        'role': ['ROLE_DATA_PUBLISHER']}, 'secret', algorithm='HS256')
+    headers = {'Authorization': f'Bearer {token}'}
+    client = TestClient(main.app)
+    archive = make_archive(str(tmp_path / 'archive.zip'), occurrence_rows(100))
+    with open(archive, 'rb') as f:
+        data = f.read()
+
+    presigned = client.post('/uploads/presigned', data={'size': len(data)}, headers=headers).json()
+    assert requests.put(presigned['url'], data=data).status_code == 200
+
+    response = client.post('/validate/s3', data={'requestID': presigned['requestID'], 'fileName': 'archive.zip'},
+                           headers=headers).json()
+    assert response['valid'] is True
+    assert response['requestID'] == presigned['requestID']
+    assert response['tempPath'] == f"{USER_ID}/{presigned['requestID']}.zip"
+
+    # an archive over the maximum size is rejected before it is downloaded
+    main_config = main.validate.get_app_config()
+    max_upload_size = main_config.max_upload_size
+    main_config.max_upload_size = len(data) - 1
+    try:
+        response = client.post('/validate/s3', data={'requestID': presigned['requestID']}, headers=headers).json()
+    finally:
+        main_config.max_upload_size = max_upload_size
+    assert response['error'] == 'FILE_TOO_LARGE'
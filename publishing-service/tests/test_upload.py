@@ -0,0 +1,33 @@
+import asyncio
+import hashlib
+import io
+import os
+
+import pytest
+from fastapi import UploadFile
+
+from util.upload import store_upload, UploadTooLargeException
+
+
+def _upload(data: bytes) -> UploadFile:
+    return UploadFile(file=io.BytesIO(data), filename='archive.zip')
+
+
+def test_upload_is_stored_in_chunks(config, tmp_path):
+    config.upload_chunk_size = 1000
+    data = os.urandom(2500)
+    upload = asyncio.run(store_upload(_upload(data), str(tmp_path / 'archive.zip'), config))
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+    assert upload.size == len(data)
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    assert upload.file_name == 'archive.zip'
+
+
+def test_uploads_over_the_maximum_size_are_removed(config, tmp_path):
+    config.upload_chunk_size = 1000
+    config.max_upload_size = 1500
+    temp_path = tmp_path / 'archive.zip'
+    with pytest.raises(UploadTooLargeException):
+        asyncio.run(store_upload(_upload(os.urandom(2500)), str(temp_path), config))
+    assert not temp_path.exists()
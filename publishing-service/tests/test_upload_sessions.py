@@ -0,0 +1,136 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+
+from util.upload import UploadTooLargeException
+from util.upload_sessions import UploadSessions, UploadIncompleteException, InvalidChunkException, \
+    UploadNotFoundException, S3_MIN_PART_SIZE
+
+USER_ID = 'user-1'
+
+
+async def _stream(data: bytes, size: int = 64 * 1024):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def _send(sessions: UploadSessions, state, data: bytes, numbers=None):
+    for number in numbers or range(1, state.chunk_count + 1):
+        chunk = data[(number - 1) * state.chunk_size:number * state.chunk_size]
+        temp_path = asyncio.run(sessions.receive_chunk(state, number, _stream(chunk)))
+        sessions.store_chunk(state, number, temp_path)
+
+
+def test_chunks_are_assembled_in_order(config, tmp_path):
+    config.upload_session_chunk_size = 1000
+    sessions = UploadSessions(config)
+    data = os.urandom(2500)
+    state = sessions.create(USER_ID, 'archive.zip', len(data))
+    assert state.chunk_count == 3
+
+    # chunks can arrive in any order, and be resent
+    _send(sessions, state, data, [3, 1, 2, 1])
+    assert sessions.received_chunks(state) == [1, 2, 3]
+
+    sessions.complete(state)
+    upload = sessions.claim(state.upload_id, USER_ID, str(tmp_path / 'claimed.zip'))
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    assert not os.path.exists(os.path.join(config.upload_session_dir, state.upload_id))
+
+
+def test_chunks_must_be_the_expected_size(config):
+    config.upload_session_chunk_size = 1000
+    sessions = UploadSessions(config)
+    state = sessions.create(USER_ID, 'archive.zip', 2500)
+    with pytest.raises(InvalidChunkException):
+        asyncio.run(sessions.receive_chunk(state, 1, _stream(b'x' * 999)))
+    with pytest.raises(InvalidChunkException):
+        asyncio.run(sessions.receive_chunk(state, 3, _stream(b'x' * 501)))
+    with pytest.raises(InvalidChunkException):
+        asyncio.run(sessions.receive_chunk(state, 4, _stream(b'x')))
+
+
+def test_incomplete_uploads_cannot_be_claimed(config, tmp_path):
+    config.upload_session_chunk_size = 1000
+    sessions = UploadSessions(config)
+    data = os.urandom(2500)
+    state = sessions.create(USER_ID, 'archive.zip', len(data))
+    _send(sessions, state, data, [1, 3])
+    with pytest.raises(UploadIncompleteException):
+        sessions.complete(state)
+    with pytest.raises(UploadIncompleteException):
+        sessions.claim(state.upload_id, USER_ID, str(tmp_path / 'claimed.zip'))
+
+
+def test_uploads_over_the_maximum_size_are_rejected(config):
+    config.max_upload_size = 1000
+    with pytest.raises(UploadTooLargeException):
+        UploadSessions(config).create(USER_ID, 'archive.zip', 1001)
+
+
+def test_s3_chunk_size_must_be_a_valid_part_size(config):
+    config.upload_session_backend = 's3'
+    config.upload_session_chunk_size = S3_MIN_PART_SIZE - 1
+    with pytest.raises(ValueError):
+        UploadSessions(config)
+
+
+def test_s3_upload_is_removed_from_the_bucket_once_claimed(config, s3, tmp_path):
+    config.upload_session_backend = 's3'
+    config.upload_session_chunk_size = S3_MIN_PART_SIZE
+    sessions = UploadSessions(config)
+    data = os.urandom(S3_MIN_PART_SIZE + 1000)
+    state = sessions.create(USER_ID, 'archive.zip', len(data))
+    _send(sessions, state, data)
+    sessions.complete(state)
+
+    upload = sessions.claim(state.upload_id, USER_ID, str(tmp_path / 'claimed.zip'))
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    assert s3.list_objects_v2(Bucket=config.s3_bucket_name).get('KeyCount') == 0
+
+
+def test_s3_sessions_can_be_continued_on_another_replica(config, s3, tmp_path):
+    config.upload_session_backend = 's3'
+    config.upload_session_chunk_size = S3_MIN_PART_SIZE
+    data = os.urandom(S3_MIN_PART_SIZE * 2 + 1000)
+    first = UploadSessions(config)
+    state = first.create(USER_ID, 'archive.zip', len(data))
+    _send(first, state, data, [2])
+
+    # another replica has its own local directory, so only sees what is in the bucket
+    other_config = config.model_copy(update={'upload_session_dir': str(tmp_path / 'other-replica')})
+    other = UploadSessions(other_config)
+    resumed = other.get(state.upload_id, USER_ID)
+    assert other.received_chunks(resumed) == [2]
+    _send(other, resumed, data, [1, 3])
+    other.complete(resumed)
+
+    upload = first.claim(state.upload_id, USER_ID, str(tmp_path / 'claimed.zip'))
+    with open(upload.path, 'rb') as f:
+        assert f.read() == data
+    assert s3.list_objects_v2(Bucket=config.s3_bucket_name).get('KeyCount') == 0
+    with pytest.raises(UploadNotFoundException):
+        other.get(state.upload_id, USER_ID)
+
+
+def test_chunks_are_written_with_the_supplied_runner(config):
+    config.upload_session_chunk_size = 1000
+    sessions = UploadSessions(config)
+    state = sessions.create(USER_ID, 'archive.zip', 2500)
+    calls = []
+
+    async def run_io(fn, *args, **kwargs):
+        calls.append(fn)
+        return fn(*args, **kwargs)
+
+    temp_path = asyncio.run(sessions.receive_chunk(state, 1, _stream(b'x' * 1000, 400), run_io))
+    with open(temp_path, 'rb') as f:
+        assert f.read() == b'x' * 1000
+    assert open in calls
+    assert len(calls) == 5
@@ -0,0 +1,68 @@
+import asyncio
+
+import httpx
+import pytest
+
+from util.auth import User
+from util.collectory import create_or_update_data_resource, get_data_resource, update_conn_params, RegistryException
+from util.error_codes import ErrorCode
+from util.http import HttpClients
+from util.registry import RequestRegistry
+
+USER = User('user-1', 'user@example.org', 'User', is_admin=False, is_publisher=True)
+
+
+def _failing_clients(config, error: Exception) -> HttpClients:
+    def fail(request):
+        raise error
+
+    http = HttpClients(config)
+    http.airflow = httpx.AsyncClient(transport=httpx.MockTransport(fail))
+    http.collectory = httpx.AsyncClient(transport=httpx.MockTransport(fail))
+    return http
+
+
+def test_airflow_timeout_is_an_airflow_error(config):
+    pytest.importorskip('dwc_validator')
+    from util.airflow import start_ingest_dag
+    from util.executor import get_validation_executor
+
+    http = _failing_clients(config, httpx.ReadTimeout('timed out'))
+    response = asyncio.run(start_ingest_dag('Dataset', 'dr1', 'request-1', USER, config, http, RequestRegistry(config),
+                                            get_validation_executor()))
+    assert response.error == ErrorCode.AIRFLOW_ERROR
+
+
+def test_collectory_connection_failure_is_a_registry_error(config):
+    http = _failing_clients(config, httpx.ConnectError('refused'))
+    assert asyncio.run(create_or_update_data_resource(None, {'name': 'Dataset'}, USER, config, http)) is None
+    assert asyncio.run(create_or_update_data_resource('dr1', {'name': 'Dataset'}, USER, config, http)) is None
+
+
+def test_collectory_timeout_getting_a_data_resource_is_a_registry_error(config):
+    http = _failing_clients(config, httpx.ReadTimeout('timed out'))
+    with pytest.raises(RegistryException):
+        asyncio.run(get_data_resource('dr-timeout', config, http))
+
+
+def test_collectory_timeout_updating_connection_parameters_is_a_registry_error(config):
+    http = _failing_clients(config, httpx.ReadTimeout('timed out'))
+    with pytest.raises(RegistryException):
+        asyncio.run(update_conn_params('dr-timeout', config, http))
+
+
+def test_unpublish_reports_a_collectory_timeout_as_a_registry_error(config):
+    pytest.importorskip('dwc_validator')
+    import jwt
+    from fastapi.testclient import TestClient
+    import main
+    from util.http import get_http_clients
+
+    token = jwt.encode({'userid': USER.id, 'email': USER.email, 'name': USER.name, 'role': ['ROLE_DATA_PUBLISHER']},
+                       'secret', algorithm='HS256')
+    main.app.dependency_overrides[get_http_clients] = lambda: _failing_clients(config, httpx.ReadTimeout('timed out'))
+    try:
+        response = TestClient(main.app).delete('/publish/dr-timeout', headers={'Authorization': f'Bearer {token}'})
+    finally:
+        main.app.dependency_overrides.clear()
+    assert response.json()['error'] == ErrorCode.REGISTRY_ERROR
@@ -0,0 +1,86 @@
+import os
+import stat
+import time
+
+import pytest
+
+pytest.importorskip('dwc_validator')
+import util.validation_cache as validation_cache  # noqa: E402
+from util.upload import StoredUpload  # noqa: E402
+from util.validation import ArchiveValidation  # noqa: E402
+from util.validation_cache import DiskValidationCache, cache_key, package_versions  # noqa: E402
+
+UPLOAD = StoredUpload(path='archive.zip', size=100, sha256='a' * 64)
+
+
+def _result(core_type: str = 'http://rs.tdwg.org/dwc/terms/Occurrence') -> ArchiveValidation:
+    return ArchiveValidation(core_type=core_type, supported_core_type=True, validated=True, valid=True)
+
+
+def _age(cache: DiskValidationCache, key: str, seconds: int):
+    # move the time an entry was stored and last used back
+    path = cache._path(key)
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def test_results_are_cached(config):
+    cache = DiskValidationCache(config)
+    assert cache.get('key') is None
+    cache.put('key', _result())
+    assert cache.get('key') == _result()
+    assert stat.S_IMODE(os.stat(config.validation_cache_dir).st_mode) == 0o700
+
+
+def test_entries_expire_after_the_ttl_however_often_they_are_used(config):
+    config.validation_cache_ttl = 100
+    cache = DiskValidationCache(config)
+    cache.put('key', _result())
+    _age(cache, 'key', 60)
+    stored = os.path.getmtime(cache._path('key'))
+    assert cache.get('key') is not None
+    # using an entry doesn't change when it was stored
+    assert os.path.getmtime(cache._path('key')) == stored
+
+    os.utime(cache._path('key'), (time.time(), time.time() - 120))
+    assert cache.get('key') is None
+    assert not os.path.exists(cache._path('key'))
+
+
+def test_least_recently_used_entries_are_evicted(config):
+    cache = DiskValidationCache(config)
+    for key in ('first', 'second', 'third'):
+        cache.put(key, _result())
+    entry_size = os.path.getsize(cache._path('first'))
+    _age(cache, 'first', 30)
+    _age(cache, 'second', 20)
+    _age(cache, 'third', 10)
+    assert cache.get('first') is not None
+
+    cache.max_size = entry_size * 2
+    cache.evict()
+    assert cache.get('second') is None
+    assert cache.get('first') is not None
+    assert cache.get('third') is not None
+
+
+def test_cache_key_changes_with_the_settings(config):
+    key = cache_key(UPLOAD, config, False)
+    assert key.startswith(UPLOAD.sha256)
+    assert cache_key(UPLOAD, config, False) == key
+    assert cache_key(UPLOAD, config, True) != key
+
+    config.validation_chunk_rows += 1
+    assert cache_key(UPLOAD, config, False) != key
+
+
+def test_cache_key_changes_with_the_validator_version(config, monkeypatch):
+    key = cache_key(UPLOAD, config, False)
+    monkeypatch.setattr(validation_cache, 'validator_versions', {'dwc_validator': 'another', 'dwca': 'version'})
+    assert cache_key(UPLOAD, config, False) != key
+
+
+def test_package_versions():
+    versions = package_versions(['dwca', 'not_a_package'])
+    assert versions['dwca']
+    assert versions['not_a_package'] is None
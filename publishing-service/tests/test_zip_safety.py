@@ -0,0 +1,95 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from archives import make_archive, occurrence_rows
+from util.zip_safety import scan_archive, UnsafeArchiveException, CorruptArchiveException
+
+
+def _tar(path, members, mode='w:gz'):
+    with tarfile.open(path, mode) as archive:
+        for info, data in members:
+            archive.addfile(info, io.BytesIO(data) if data is not None else None)
+    return str(path)
+
+
+def _file(name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    return info, data
+
+
+def test_valid_archives_pass(config, tmp_path):
+    scan_archive(make_archive(str(tmp_path / 'archive.zip'), occurrence_rows(100)), config)
+    scan_archive(_tar(tmp_path / 'archive.tgz', [_file('meta.xml', b'<archive/>'), _file('occurrence.txt', b'id\n1\n')]),
+                 config)
+
+
+def test_zip_bomb_is_rejected(config, tmp_path):
+    path = tmp_path / 'bomb.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('occurrence.txt', b'0' * (50 * 1024 * 1024))
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(str(path), config)
+
+
+def test_zip_path_traversal_is_rejected(config, tmp_path):
+    path = tmp_path / 'traversal.zip'
+    with zipfile.ZipFile(path, 'w') as archive:
+        archive.writestr('../occurrence.txt', b'id\n')
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(str(path), config)
+
+
+def test_corrupt_zip_is_rejected(config, tmp_path):
+    path = tmp_path / 'corrupt.zip'
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+        archive.writestr('occurrence.txt', b'id\n1\n2\n')
+    data = bytearray(path.read_bytes())
+    data[data.index(b'1\n2')] = ord('9')
+    path.write_bytes(bytes(data))
+    with pytest.raises(CorruptArchiveException):
+        scan_archive(str(path), config)
+
+
+def test_tar_bomb_is_rejected(config, tmp_path):
+    path = _tar(tmp_path / 'bomb.tgz', [_file('occurrence.txt', b'0' * (50 * 1024 * 1024))])
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(path, config)
+
+
+def test_tar_over_the_size_limit_is_rejected(config, tmp_path):
+    config.archive_max_uncompressed_size = 1000
+    path = _tar(tmp_path / 'large.tar', [_file('occurrence.txt', b'x' * 1001)], mode='w')
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(path, config)
+
+
+def test_tar_links_and_traversal_are_rejected(config, tmp_path):
+    link = tarfile.TarInfo('occurrence.txt')
+    link.type = tarfile.SYMTYPE
+    link.linkname = '/etc/passwd'
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(_tar(tmp_path / 'link.tgz', [(link, None)]), config)
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(_tar(tmp_path / 'traversal.tgz', [_file('../occurrence.txt', b'id\n')]), config)
+
+
+def test_tar_member_limit(config, tmp_path):
+    config.archive_max_members = 2
+    path = _tar(tmp_path / 'members.tgz', [_file(f'{i}.txt', b'x') for i in range(3)])
+    with pytest.raises(UnsafeArchiveException):
+        scan_archive(path, config)
+
+
+def test_corrupt_tgz_is_rejected(config, tmp_path):
+    path = tmp_path / 'corrupt.tgz'
+    _tar(path, [_file('occurrence.txt', bytes(range(256)) * 4000)])
+    data = bytearray(path.read_bytes())
+    for i in range(200, 260):
+        data[i] ^= 0xff
+    path.write_bytes(bytes(data))
+    with pytest.raises(CorruptArchiveException):
+        scan_archive(str(path), config)